@@ -1,8 +1,9 @@
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
-from flask import Flask, request, jsonify, render_template, redirect, session, flash, url_for
+from flask import Flask, request, jsonify, render_template, redirect, session, flash, url_for, abort
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, create_access_token, get_jwt_identity, get_jwt, jwt_required
 from flask_migrate import Migrate
@@ -24,23 +25,69 @@ app.secret_key = os.getenv('SECRET_KEY', 'super-secret-session-key')
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'super-secure-jwt-key')
 app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'statiDec', 'uploads')
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(days=30)  # ⏳ Set token to last 30 days
+# Max simultaneous Onshape calls per access/secret key pair
+app.config["ONSHAPE_MAX_CONCURRENCY"] = int(os.getenv("ONSHAPE_MAX_CONCURRENCY", "4"))
+# Token bucket per Onshape access key (per worker process)
+app.config["ONSHAPE_RATE_PER_SEC"] = float(os.getenv("ONSHAPE_RATE_PER_SEC", "2"))
+app.config["ONSHAPE_RATE_BURST"] = int(os.getenv("ONSHAPE_RATE_BURST", "10"))
+app.config["ONSHAPE_BULK_RESERVE"] = int(os.getenv("ONSHAPE_BULK_RESERVE", "3"))
+# Translated CAD files cache (0 bytes disables it)
+app.config["CAD_CACHE_DIR"] = os.getenv("CAD_CACHE_DIR", os.path.join(app.instance_path, "cad_cache"))
+app.config["CAD_CACHE_MAX_BYTES"] = int(os.getenv("CAD_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Viewer GLTF cache, including its gzip/brotli copies (0 bytes disables it)
+app.config["GLTF_CACHE_DIR"] = os.getenv("GLTF_CACHE_DIR", os.path.join(app.instance_path, "gltf_cache"))
+app.config["GLTF_CACHE_MAX_BYTES"] = int(os.getenv("GLTF_CACHE_MAX_BYTES", str(512 * 1024 ** 2)))
+# Longest wait for an Onshape translation before giving up (seconds)
+app.config["TRANSLATION_DEADLINE"] = float(os.getenv("TRANSLATION_DEADLINE", "120"))
+# Parts translated at once by a bulk CAD export
+app.config["CAD_EXPORT_CONCURRENCY"] = int(os.getenv("CAD_EXPORT_CONCURRENCY", "4"))
+# Opt-in: pre-translate each part's next machine file into the CAD cache after BOM/progress changes
+app.config["CAD_WARMER_ENABLED"] = os.getenv("CAD_WARMER_ENABLED", "").lower() in ("1", "true", "yes")
+app.config["CAD_WARMER_CONCURRENCY"] = int(os.getenv("CAD_WARMER_CONCURRENCY", "2"))
+# (team_number, robot, system) -> ids lookups remembered per worker
+app.config["PATH_CACHE_SIZE"] = int(os.getenv("PATH_CACHE_SIZE", "1024"))
 
 # Initialize extensions
-from models import db, Team, Robot, System, Machine
+from models import db, Team, Robot, System, BomItem, RobotBomItem, Machine, Job, MAIN_SYSTEM
+from bom import build_system_bom, fetch_change_marker, make_client, locate_part, document_microversion
+from bom_query import query_bom, stream_bom_dict, stream_bom_list
+from bom_export import FORMATS as EXPORT_FORMATS, bom_frame, stream_export
+from resolver import PathResolver
+from file_cache import FileCache
+from gltf import (ENCODINGS as GLTF_ENCODINGS, VIEWER_LODS, GltfFetchError, SingleFlight, encoded_variant,
+                  fetch_part_gltf, glb_variant, part_gltf_path, scene_variant)
+from cad_export import (translate_part, translate_part_to_cache, warm_part, current_process, part_matches,
+                        export_filename, stream_zip)
+from translations import TranslationError, tracker
+from onshape import (OnshapeApi, PRIORITY_INTERACTIVE, PRIORITY_BULK, RateBudgetExceeded,
+                     configure_rate_budget, rate_budget_usage, relay_stream)
+from jobs import register_runner, create_job, pending_job, start_job, check_job, job_payload
 
 db.init_app(app)
+configure_rate_budget(rate=app.config["ONSHAPE_RATE_PER_SEC"], burst=app.config["ONSHAPE_RATE_BURST"],
+                      bulk_reserve=app.config["ONSHAPE_BULK_RESERVE"])
 migrate = Migrate(app, db)
 jwt = JWTManager(app)
 CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True,
-     methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+     methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
      allow_headers=["Content-Type", "Authorization", "X-Requested-With"])
 
 socketio = SocketIO(app, cors_allowed_origins="*")
 
+cad_cache = FileCache(app.config["CAD_CACHE_DIR"], app.config["CAD_CACHE_MAX_BYTES"])
+gltf_cache = FileCache(app.config["GLTF_CACHE_DIR"], app.config["GLTF_CACHE_MAX_BYTES"])
+gltf_fetches = SingleFlight()
+paths = PathResolver(app.config["PATH_CACHE_SIZE"])
+
 # Ensure base upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 
+@app.errorhandler(RateBudgetExceeded)
+def handle_rate_budget_exceeded(e):
+    return jsonify({"error": str(e)}), 429
+
+
 # HTML page routes
 @app.route('/')
 def home():
@@ -49,14 +96,15 @@ def home():
 
 @app.route('/<team_number>/<robot_name>')
 def team_dashboard(team_number, robot_name):
-    team = Team.query.filter_by(team_number=team_number).first_or_404()
-    robot = Robot.query.filter_by(team_id=team.id, name=robot_name).first_or_404()
+    team, robot, _ = paths.resolve(team_number, robot_name)
+    if not team or not robot:
+        abort(404)
     return render_template('robot_detail_user.html', team=team, robot=robot)
 
 
 @app.route('/<team_number>')
 def team_page(team_number):
-    team = Team.query.filter_by(team_number=str(team_number)).first()
+    team = paths.resolve(str(team_number)).team
     if not team:
         return "Team not found", 404
 
@@ -67,7 +115,7 @@ def team_page(team_number):
 
 @app.route("/<team_number>/Admin")
 def team_admin_dashboard(team_number):
-    team = Team.query.filter_by(team_number=team_number).first()
+    team = paths.resolve(team_number).team
     if not team:
         return "Team not found", 404
     robots = Robot.query.filter_by(team_id=team.id).all()
@@ -77,7 +125,7 @@ def team_admin_dashboard(team_number):
 @app.route("/<int:team_number>/Admin/machines", methods=["GET"])
 def manage_machines(team_number):
     print(team_number)
-    team = Team.query.filter_by(team_number=str(team_number)).first()
+    team = paths.resolve(str(team_number)).team
     if not team:
         return "Team not found", 404
 
@@ -88,28 +136,29 @@ def manage_machines(team_number):
 
 @app.route("/<team_number>/new_robot")
 def new_robot_form(team_number):
-    team = Team.query.filter_by(team_number=team_number).first_or_404()
+    team = paths.resolve(team_number).team
+    if not team:
+        abort(404)
     return render_template("new_robot.html", team=team, team_id=team.id, team_number=team.team_number)
 
 
 @app.route("/<team_number>/Admin/<robot_name>")
 def team_admin_robot(team_number, robot_name):
-    team = Team.query.filter_by(team_number=team_number).first_or_404()
-    robot = Robot.query.filter_by(team_id=team.id, name=robot_name).first_or_404()
+    team, robot, _ = paths.resolve(team_number, robot_name)
+    if not team or not robot:
+        abort(404)
     return render_template("robot_detail.html", robot=robot, team=team)
 
 
 @app.route('/<team_number>/Admin/<robot_name>/<system>')
 def team_admin_bom(team_number, robot_name, system):
-    team = Team.query.filter_by(team_number=team_number).first()
+    team, robot, system_obj = paths.resolve(team_number, robot_name, system)
     if not team:
         return "Team not found", 404
 
-    robot = Robot.query.filter_by(team_id=team.id, name=robot_name).first()
     if not robot:
         return "Robot not found", 404
 
-    system_obj = System.query.filter_by(robot_id=robot.id, name=system).first()
     if not system_obj:
         return "System not found", 404
 
@@ -128,11 +177,10 @@ def team_admin_bom(team_number, robot_name, system):
 
 @app.route("/<team_number>/<robot_name>/<system>")
 def team_bom_filtered(team_number, robot_name, system):
-    team = Team.query.filter_by(team_number=str(team_number)).first()
+    team, robot, _ = paths.resolve(str(team_number), robot_name)
     if not team:
         return "Team not found", 404
 
-    robot = Robot.query.filter_by(team_id=team.id, name=robot_name).first()
     if not robot:
         return "Robot not found", 404
 
@@ -162,7 +210,7 @@ def register():
     admin_password = data.get("adminPassword")
     if not team_number or not password or not admin_password:
         return jsonify({"error": "Team number, password, and adminPassword are required"}), 400
-    if Team.query.filter_by(team_number=team_number).first():
+    if paths.resolve(team_number).team:
         return jsonify({"error": "Team already exists"}), 400
 
     hashed_password = generate_password_hash(password)
@@ -188,7 +236,7 @@ def login():
     password = data.get('password')
     if not team_number or not password:
         return jsonify({"error": "Team number and password are required"}), 400
-    team = Team.query.filter_by(team_number=team_number).first()
+    team = paths.resolve(team_number).team
     if not team or not (
             check_password_hash(team.password, password) or check_password_hash(team.adminPassword, password)):
         return jsonify({"error": "Invalid credentials"}), 401
@@ -211,7 +259,7 @@ def team_exists():
     team_number = request.args.get('team_number')
     if not team_number:
         return jsonify({"error": "Team number is required"}), 400
-    exists = bool(Team.query.filter_by(team_number=team_number).first())
+    exists = bool(paths.resolve(team_number).team)
     return jsonify({"exists": exists}), 200
 
 
@@ -233,7 +281,7 @@ def list_robots():
             return jsonify({"error": "Team number is required"}), 400
     else:
         team_number = current_user  # non-admin can only list their own team
-    team = Team.query.filter_by(team_number=team_number).first()
+    team = paths.resolve(team_number).team
     if not team:
         return jsonify({"error": "Team not found"}), 404
 
@@ -264,7 +312,7 @@ def create_robot():
         return jsonify({"error": "Team number and robot name are required"}), 400
     if not (claims.get('is_team_admin') and current_user == team_number) and not claims.get('is_global_admin'):
         return jsonify({"error": "Unauthorized"}), 403
-    team = Team.query.filter_by(team_number=team_number).first()
+    team = paths.resolve(team_number).team
     if not team:
         return jsonify({"error": "Team not found"}), 404
     if Robot.query.filter_by(team_id=team.id, name=robot_name).first():
@@ -290,7 +338,7 @@ def create_robot():
 
     default_systems = ["Main", "System1", "System2", "System3", "System4", "System5"]
     for sys_name in default_systems:
-        sys_record = System(robot=new_robot, name=sys_name, assembly_url=None, partstudio_urls=[], bom_data=[])
+        sys_record = System(robot=new_robot, name=sys_name, assembly_url=None, partstudio_urls=[])
         if template_robot:
             templ_sys = System.query.filter_by(robot_id=template_robot.id, name=sys_name).first()
             if templ_sys:
@@ -345,6 +393,7 @@ def update_robot(robot_id):
         if new_name != robot.name:
             if Robot.query.filter_by(team_id=team.id, name=new_name).first():
                 return jsonify({"error": "Another robot with this name already exists"}), 400
+            paths.invalidate(team.team_number, robot.name)
             robot.name = new_name
     if image_text:
         team_dir = os.path.join(app.config['UPLOAD_FOLDER'], f"team_{team.team_number}", "robots")
@@ -403,6 +452,7 @@ def delete_robot_by_id(robot_id):
                     os.remove(icon_path)
                 except Exception as e:
                     print(f"Warning: could not delete machine icon file: {e}")
+    paths.invalidate(team.team_number, robot.name)
     try:
         db.session.delete(robot)
         db.session.commit()
@@ -425,7 +475,7 @@ def new_robot_legacy():
     claims = get_jwt()
     if not (claims.get('is_team_admin') and current_user == team_number) and not claims.get('is_global_admin'):
         return jsonify({"error": "Unauthorized"}), 403
-    team = Team.query.filter_by(team_number=team_number).first()
+    team = paths.resolve(team_number).team
     if not team:
         return jsonify({"error": "Team not found"}), 404
     if Robot.query.filter_by(team_id=team.id, name=robot_name).first():
@@ -437,7 +487,7 @@ def new_robot_legacy():
     db.session.flush()
     default_systems = ["Main", "System1", "System2", "System3", "System4", "System5"]
     for sys_name in default_systems:
-        sys_record = System(robot=new_robot, name=sys_name, assembly_url=None, partstudio_urls=[], bom_data=[])
+        sys_record = System(robot=new_robot, name=sys_name, assembly_url=None, partstudio_urls=[])
         if template_robot:
             templ_sys = System.query.filter_by(robot_id=template_robot.id, name=sys_name).first()
             if templ_sys:
@@ -478,7 +528,7 @@ def get_robots_legacy():
         return jsonify({"error": "Team number is required"}), 400
     if current_user != team_number and not claims.get('is_global_admin'):
         return jsonify({"error": "Unauthorized"}), 403
-    team = Team.query.filter_by(team_number=team_number).first()
+    team = paths.resolve(team_number).team
     if not team:
         return jsonify({"error": "Team not found"}), 404
     robot_names = [robot.name for robot in Robot.query.filter_by(team_id=team.id).all()]
@@ -498,14 +548,14 @@ def rename_robot():
         return jsonify({"error": "Missing required fields"}), 400
     if not (claims.get('is_team_admin') and current_user == team_number) and not claims.get('is_global_admin'):
         return jsonify({"error": "Unauthorized"}), 403
-    team = Team.query.filter_by(team_number=team_number).first()
+    team, robot, _ = paths.resolve(team_number, old_name)
     if not team:
         return jsonify({"error": "Team not found"}), 404
-    robot = Robot.query.filter_by(team_id=team.id, name=old_name).first()
     if not robot:
         return jsonify({"error": f"Robot '{old_name}' does not exist"}), 404
     if Robot.query.filter_by(team_id=team.id, name=new_name).first():
         return jsonify({"error": f"Robot '{new_name}' already exists"}), 400
+    paths.invalidate(team.team_number, old_name)
     robot.name = new_name
     try:
         db.session.commit()
@@ -527,10 +577,9 @@ def delete_robot_legacy():
         return jsonify({"error": "Missing required fields"}), 400
     if not (claims.get('is_team_admin') and current_user == team_number) and not claims.get('is_global_admin'):
         return jsonify({"error": "Unauthorized"}), 403
-    team = Team.query.filter_by(team_number=team_number).first()
+    team, robot, _ = paths.resolve(team_number, robot_name)
     if not team:
         return jsonify({"error": "Team not found"}), 404
-    robot = Robot.query.filter_by(team_id=team.id, name=robot_name).first()
     if not robot:
         return jsonify({"error": f"Robot '{robot_name}' not found"}), 404
     # Remove files for this robot
@@ -549,6 +598,7 @@ def delete_robot_legacy():
                     os.remove(icon_path)
                 except Exception:
                     pass
+    paths.invalidate(team.team_number, robot.name)
     try:
         db.session.delete(robot)
         db.session.commit()
@@ -567,7 +617,7 @@ def list_machines():
     if not team_number:
         return jsonify({"error": "Team number is required"}), 400
 
-    team = Team.query.filter_by(team_number=team_number).first()
+    team = paths.resolve(team_number).team
     if not team:
         return jsonify({"error": "Team or robot not found"}), 404
 
@@ -588,20 +638,18 @@ def api_robot_data():
     robot_name = request.args.get("robot")
     system_name = request.args.get("system")
 
-    team = Team.query.filter_by(team_number=team_number).first()
+    team, robot, system = paths.resolve(team_number, robot_name, system_name)
     if not team:
         return jsonify({"error": "Team not found"}), 404
 
-    robot = Robot.query.filter_by(team_id=team.id, name=robot_name).first()
     if not robot:
         return jsonify({"error": "Robot not found"}), 404
 
-    system = System.query.filter_by(robot_id=robot.id, name=system_name).first()
     if not system:
         return jsonify({"error": "System not found"}), 404
 
     return jsonify({
-        "bom_data": system.bom_data or [],
+        "bom_data": system.bom_entries(),
         "thumbnail_url": system.thumbnail_url
     })
 
@@ -631,7 +679,7 @@ def add_machine():
     if not (claims.get('is_team_admin') and current_user == team_number) and not claims.get('is_global_admin'):
         return jsonify({"error": "Unauthorized"}), 403
 
-    team = Team.query.filter_by(team_number=str(team_number)).first()
+    team = paths.resolve(str(team_number)).team
     if not team:
         return jsonify({"error": "Team not found"}), 404
 
@@ -768,7 +816,12 @@ def delete_machine(machine_id):
 @app.route('/api/get_bom', methods=['GET'])
 @jwt_required()
 def get_bom():
-    """Retrieve BOM data for a specific team, robot, and system."""
+    """Retrieve BOM data for a specific team, robot, and system.
+
+    Optional query parameters: `process` (machine name, COTS or InHouse),
+    `material`, `q` (part name search), `sort` (position, name, quantity or
+    material; "-" prefix for descending), `limit` and `cursor` for paging.
+    """
     current_user = get_jwt_identity()
     claims = get_jwt()
     team_number = request.args.get('team_number')
@@ -778,23 +831,74 @@ def get_bom():
         return jsonify({"error": "Team number and robot name are required"}), 400
     if current_user != team_number and not claims.get('is_global_admin'):
         return jsonify({"error": "Unauthorized"}), 403
-    team = Team.query.filter_by(team_number=team_number).first()
-    robot = Robot.query.filter_by(team_id=team.id, name=robot_name).first() if team else None
+    team, robot, sys_record = paths.resolve(team_number, robot_name, None if system_name == "Main" else system_name)
     if not team or not robot:
         return jsonify({"error": "Team or robot not found"}), 404
 
     if system_name == "Main":
-        combined = []
-        for sys_record in robot.systems:
-            if sys_record.bom_data:
-                combined.extend(sys_record.bom_data)
-        return jsonify({"bom_data": combined}), 200
+        # Robot-wide view: served from the rollup kept current on every BOM or progress change
+        model, scope = RobotBomItem, RobotBomItem.robot_id == robot.id
     else:
-        sys_record = System.query.filter_by(robot_id=robot.id, name=system_name).first()
         if not sys_record:
             return jsonify({"error": "System not found"}), 404
-        bom_list = sys_record.bom_data if sys_record.bom_data is not None else []
-        return jsonify({"bom_data": bom_list}), 200
+        model, scope = BomItem, BomItem.system_id == sys_record.id
+
+    # Optional server-side filtering, sorting and cursor pagination
+    limit = request.args.get('limit') or None
+    try:
+        limit = int(limit) if limit is not None else None
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    try:
+        result = query_bom(model, scope,
+                           process=request.args.get('process') or None,
+                           material=request.args.get('material', '').strip() or None,
+                           search=request.args.get('q') or None,
+                           sort=request.args.get('sort', 'position'),
+                           cursor=request.args.get('cursor') or None,
+                           limit=limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result), 200
+
+
+@app.route('/api/export_bom', methods=['GET'])
+@jwt_required()
+def export_bom():
+    """Download a system's, a robot's or a whole team's BOM as CSV or Parquet.
+
+    Query parameters: `team_number`, optional `robot` and `system` to narrow the
+    export, and `format` (csv or parquet).
+    """
+    from flask import Response, stream_with_context
+    current_user = get_jwt_identity()
+    claims = get_jwt()
+    team_number = request.args.get('team_number')
+    robot_name = request.args.get('robot')
+    system_name = request.args.get('system')
+    fmt = (request.args.get('format') or 'csv').lower()
+    if not team_number:
+        return jsonify({"error": "Team number is required"}), 400
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unsupported format '{fmt}'", "formats": list(EXPORT_FORMATS)}), 400
+    if current_user != team_number and not claims.get('is_global_admin'):
+        return jsonify({"error": "Unauthorized"}), 403
+
+    if not robot_name or system_name == "Main":
+        system_name = None
+    team, robot, system = paths.resolve(team_number, robot_name or None, system_name or None)
+    if not team:
+        return jsonify({"error": "Team not found"}), 404
+    if robot_name and not robot:
+        return jsonify({"error": "Robot not found"}), 404
+    if system_name and not system:
+        return jsonify({"error": "System not found"}), 404
+
+    df = bom_frame(team.id, robot.id if robot else None, system.id if system else None)
+    mimetype, ext = EXPORT_FORMATS[fmt]
+    label = " - ".join(str(p) for p in (team_number, robot_name, system.name if system else None) if p)
+    headers = {"Content-Disposition": f'attachment; filename="{secure_filename(label + " BOM")}.{ext}"'}
+    return Response(stream_with_context(stream_export(df, fmt)), mimetype=mimetype, headers=headers)
 
 
 @app.route('/api/save_bom_for_robot_system', methods=['POST'])
@@ -813,24 +917,71 @@ def save_bom_for_robot_system():
     if current_user != team_number and not claims.get('is_global_admin'):
         return jsonify({"error": "Unauthorized"}), 403
 
-    team = Team.query.filter_by(team_number=team_number).first()
-    robot = Robot.query.filter_by(team_id=team.id, name=robot_name).first() if team else None
+    team, robot, system = paths.resolve(team_number, robot_name, system_name)
     if not team or not robot:
         return jsonify({"error": "Team or robot not found"}), 404
 
-    system = System.query.filter_by(robot_id=robot.id, name=system_name).first()
     if not system:
         system = System(robot=robot, name=system_name)
         db.session.add(system)
-    system.bom_data = bom_data
     try:
+        system.replace_bom(bom_data)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": f"Failed to save BOM data: {str(e)}"}), 500
+    queue_cad_warm(system)
     return jsonify({"message": "BOM data saved successfully"}), 200
 
 
+@app.route('/api/bom_items/<int:item_id>/progress', methods=['PATCH'])
+@jwt_required()
+def update_bom_item_progress(item_id):
+    """Update the progress counters of one BOM part.
+
+    The body carries the `version` the client last saw plus any of
+    `done_preprocess`, `done_process1`, `done_process2` and `available_qty`.
+    The update only applies if the row is still at that version; otherwise
+    409 is returned with the current part so the client can reapply its edit.
+    """
+    current_user = get_jwt_identity()
+    claims = get_jwt()
+    data = request.get_json() or {}
+    item = db.session.get(BomItem, item_id)
+    if not item:
+        return jsonify({"error": "BOM item not found"}), 404
+    team_number = item.system.robot.team.team_number
+    if str(team_number) != str(current_user) and not claims.get("is_global_admin"):
+        return jsonify({"error": "Unauthorized"}), 403
+
+    version = data.get("version")
+    if not isinstance(version, int) or isinstance(version, bool):
+        return jsonify({"error": "version is required"}), 400
+    changes = {}
+    for key in BomItem.PROGRESS_FIELDS:
+        if key not in data:
+            continue
+        value = data[key]
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            return jsonify({"error": f"{key} must be a non-negative integer"}), 400
+        changes[getattr(BomItem, key)] = value
+    if not changes:
+        return jsonify({"error": "No progress fields to update"}), 400
+
+    # Compare-and-set in a single UPDATE so concurrent edits cannot interleave
+    changes[BomItem.version] = BomItem.version + 1
+    updated = BomItem.query.filter_by(id=item_id, version=version).update(changes, synchronize_session=False)
+    if updated == 1 and item.system.name != MAIN_SYSTEM:
+        RobotBomItem.rebuild(item.system.robot_id, {item.part_id})
+    db.session.commit()
+    db.session.refresh(item)
+    if updated != 1:
+        return jsonify({"error": "Part was changed by someone else", "part": item.to_entry()}), 409
+    # Progress moves parts on to their next process, whose file format may not be cached yet
+    queue_cad_warm(item.system)
+    return jsonify({"part": item.to_entry()}), 200
+
+
 @app.route("/api/robot_exists", methods=["POST"])
 @jwt_required()
 def robot_exists():
@@ -841,31 +992,110 @@ def robot_exists():
     if not team_number or not robot_name:
         return jsonify({"error": "Missing fields"}), 400
 
-    team = Team.query.filter_by(team_number=team_number).first()
+    team, robot, _ = paths.resolve(team_number, robot_name)
     if not team:
         return jsonify({"exists": False})
 
-    robot = Robot.query.filter_by(team_id=team.id, name=robot_name).first()
     return jsonify({"exists": robot is not None})
 
 
+def run_bom_refresh(job, report):
+    """Job runner: download the Onshape BOM for the job's system and save it."""
+    system = job.system
+    if system is None:
+        raise ValueError("System no longer exists")
+
+    # Skip the full download when no referenced document changed since the last fetch
+    report("checking", 5)
+    marker = fetch_change_marker(make_client(system.access_key, system.secret_key), [system.assembly_url])
+    force = bool((job.params or {}).get("force"))
+    if not force and system.microversion is not None and system.microversion == marker:
+        print(f"⏭️ Onshape documents unchanged ({marker}), keeping stored BOM", flush=True)
+        parts = BomItem.query.filter_by(system_id=system.id).count()
+        return {"msg": "✅ BOM unchanged since last fetch", "parts": parts, "unchanged": True}
+
+    final_bom, thumbnail_url, part_index = build_system_bom(system, app.config["ONSHAPE_MAX_CONCURRENCY"], report)
+    report("saving", 90)
+    if thumbnail_url:
+        system.thumbnail_url = thumbnail_url
+    system.replace_bom(final_bom)
+    system.part_index = part_index
+    system.microversion = marker
+    db.session.commit()
+    queue_cad_warm(system)
+    return {"msg": "✅ BOM successfully fetched and saved!", "parts": len(final_bom), "unchanged": False}
+
+
+register_runner("bom_refresh", run_bom_refresh)
+
+
+def queue_cad_warm(system):
+    """Queue pre-translation of the files a system's parts need next, when the warmer is enabled."""
+    if not app.config["CAD_WARMER_ENABLED"] or not cad_cache.enabled:
+        return None
+    if not all([system.access_key, system.secret_key]) or not (system.partstudio_urls or system.part_index):
+        return None
+    # A queued run will read the latest BOM when it starts; a running one may be stale, so queue another
+    job = pending_job("cad_warm", system.id, states=("queued",))
+    if job:
+        return job
+    job = create_job("cad_warm", system_id=system.id)
+    db.session.commit()
+    start_job(app, socketio, job.id)
+    return job
+
+
+def run_cad_warm(job, report):
+    """Job runner: translate the file each part's current machine needs into the CAD cache."""
+    system = job.system
+    if system is None:
+        raise ValueError("System no longer exists")
+
+    machine_formats = {m.name: (m.cad_format or "STEP").upper()
+                       for m in Machine.query.filter_by(team_id=system.robot.team_id).all()}
+    api = OnshapeApi(system.access_key, system.secret_key, priority=PRIORITY_BULK)
+
+    report("locating", 10)
+    targets = []
+    part_index = system.part_index
+    for part in system.bom_entries():
+        file_format = machine_formats.get(current_process(part, int(part.get("Quantity") or 1)))
+        if not file_format:
+            continue
+        target, new_index = locate_part(api, part.get("partId"), part_index, system.partstudio_urls)
+        if new_index is not None:
+            part_index = new_index
+        if target:
+            targets.append((target, part.get("partId"), file_format))
+    if part_index is not system.part_index:
+        system.part_index = part_index
+        db.session.commit()
+
+    def warm(target, part_id, file_format):
+        try:
+            return warm_part(api, cad_cache, target, part_id, file_format, app.config["TRANSLATION_DEADLINE"])
+        except Exception as e:
+            print(f"⚠️ Pre-translating {part_id} as {file_format} failed: {e}")
+            return "failed"
+
+    # The warmer's own pool, not the credential's slots: each worker mostly sleeps on a
+    # translation, and the rate budget already keeps its calls behind interactive ones
+    report("translating", 30)
+    with ThreadPoolExecutor(max_workers=max(1, app.config["CAD_WARMER_CONCURRENCY"])) as pool:
+        outcomes = list(pool.map(lambda t: warm(*t), targets))
+    return {outcome: outcomes.count(outcome) for outcome in ("translated", "cached", "failed")}
+
+
+register_runner("cad_warm", run_cad_warm)
+
+
 @app.route("/api/bom", methods=["POST"])
 @jwt_required()
 def fetch_bom():
-    from onshape_client.client import Client
-    from onshape_client.onshape_url import OnshapeElement
-    import json as jsonlib
-    import traceback
-
-    def safe_json(data):
-        if isinstance(data, (bytes, bytearray)):
-            return jsonlib.loads(data.decode("utf-8"))
-        if isinstance(data, str):
-            return jsonlib.loads(data)
-        if isinstance(data, dict):
-            return data
-        raise ValueError("❌ Invalid JSON payload type")
+    """Queue a background BOM refresh for a system and return its job id.
 
+    Pass `"force": true` to re-download even if the Onshape documents are unchanged.
+    """
     data = request.get_json()
     team_number = data.get("team_number")
     robot_name = data.get("robot_name")
@@ -874,175 +1104,46 @@ def fetch_bom():
     if system_name == "Main":
         return jsonify({"error": "Cannot fetch BOM into 'Main'. Select a specific system."}), 400
 
-    team = Team.query.filter_by(team_number=team_number).first()
+    team, robot, system = paths.resolve(team_number, robot_name, system_name)
     if not team:
         return jsonify({"error": "Team not found"}), 404
 
-    robot = Robot.query.filter_by(team_id=team.id, name=robot_name).first()
     if not robot:
         return jsonify({"error": "Robot not found"}), 404
 
-    system = System.query.filter_by(robot_id=robot.id, name=system_name).first()
     if not system:
         return jsonify({"error": "System not found"}), 404
 
     if not system.assembly_url or not system.access_key or not system.secret_key:
         return jsonify({"error": "Missing required Onshape credentials or assembly URL"}), 400
 
-    print(f"🚀 Starting BOM fetch for {team_number}/{robot_name}/{system_name}", flush=True)
+    # Reuse a refresh that is already pending for this system
+    job = pending_job("bom_refresh", system.id)
+    if job:
+        return jsonify(job_payload(job)), 202
 
-    client = Client(configuration={
-        "base_url": "https://cad.onshape.com",
-        "access_key": system.access_key,
-        "secret_key": system.secret_key
-    })
-
-    def fetch_bom_from_url(url):
-        print(f"📥 Fetching BOM from: {url}", flush=True)
-        element = OnshapeElement(url)
-        did, wid, eid = element.did, element.wvmid, element.eid
-        bom_url = f"/api/v10/assemblies/d/{did}/w/{wid}/e/{eid}/bom"
-        headers = {'Accept': 'application/vnd.onshape.v1+json', 'Content-Type': 'application/json'}
-        response = client.api_client.request(
-            'GET',
-            url="https://cad.onshape.com" + bom_url,
-            query_params={"indented": True},
-            headers=headers,
-            body={}
-        )
-        return safe_json(response.data)
-
-    def fetch_subassembly_names(document_id, workspace_id):
-        print(f"📂 Fetching subassembly names from contents: {document_id}/{workspace_id}", flush=True)
-        url = f"https://cad.onshape.com/api/v12/documents/d/{document_id}/w/{workspace_id}/contents"
-        r = client.api_client.request('GET', url=url, query_params={})
-        content = safe_json(r.data)
-        assembly_map = {el["id"]: el["name"] for el in content.get("elements", []) if
-                        el.get("elementType") == "ASSEMBLY"}
-        print(f"🔧 Found subassemblies: {assembly_map}", flush=True)
-        return assembly_map
-
-    def fetch_thumbnail_url(document_id):
-        print(f"🖼️ Fetching thumbnail for document {document_id}", flush=True)
-        url = f"https://cad.onshape.com/api/v12/documents/{document_id}"
-        r = client.api_client.request('GET', url=url, query_params={})
-        doc_data = safe_json(r.data)
-        thumbnail = doc_data.get("thumbnail")
-        print("📦 Thumbnail field:", thumbnail, flush=True)
-        if not thumbnail:
-            return None
-        sizes = thumbnail.get("sizes", [])
-        if not sizes or not isinstance(sizes, list):
-            return thumbnail.get("href")
-        best = max(sizes, key=lambda s: int(s.get("size", "0x0").split("x")[0]), default=None)
-        return best.get("href") if best else thumbnail.get("href")
-
-    def extract_part_data(bom_json, old_bom_by_id, multiplier=1):
-        def get_id(name):
-            for header in bom_json.get("headers", []):
-                if header.get("name") == name:
-                    return header.get("id")
-            return None
-
-        part_name_id = get_id("Name")
-        desc_id = get_id("Description")
-        qty_id = get_id("Quantity") or get_id("QTY")
-        material_id = get_id("Material")
-        material_bom_id = get_id("Bom Material") or material_id
-        preproc_id = get_id("Pre Process")
-        proc1_id = get_id("Process 1")
-        proc2_id = get_id("Process 2")
-
-        part_list = []
-        for row in bom_json.get("rows", []):
-            values = row.get("headerIdToValue", {})
-            part_id = row.get("itemSource", {}).get("partId", "")
-            qty = values.get(qty_id, 1)
-            qty = int(qty) if isinstance(qty, (int, str)) and str(qty).isdigit() else 1
-            entry = {
-                "Part Name": values.get(part_name_id, "Unknown"),
-                "Description": values.get(desc_id, "Unknown"),
-                "Quantity": qty * multiplier,
-                "Material": values.get(material_id, "Unknown"),
-                "materialBOM": values.get(material_bom_id, "Unknown"),
-                "Pre Process": values.get(preproc_id, "Unknown"),
-                "Process 1": values.get(proc1_id, "Unknown"),
-                "Process 2": values.get(proc2_id, "Unknown"),
-                "partId": part_id
-            }
-
-            for key in ["Material", "materialBOM"]:
-                if isinstance(entry[key], dict):
-                    entry[key] = entry[key].get("displayName", "Unknown")
-
-            old = old_bom_by_id.get(part_id)
-            if old:
-                entry["done_preprocess"] = old.get("done_preprocess", 0)
-                entry["done_process1"] = old.get("done_process1", 0)
-                entry["done_process2"] = old.get("done_process2", 0)
-                entry["available_qty"] = old.get("available_qty", 0)
-
-            part_list.append(entry)
-
-        return part_list
-
-    # Load previous progress
-    old_bom_by_id = {p.get("partId"): p for p in (system.bom_data or [])}
-
-    try:
-        # === Main BOM ===
-        main_json = fetch_bom_from_url(system.assembly_url)
-        main_parts = extract_part_data(main_json, old_bom_by_id)
-        print(f"✅ Main BOM has {len(main_parts)} parts", flush=True)
-
-        # === Parse base document ===
-        main_element = OnshapeElement(system.assembly_url)
-        did, wid, _ = main_element.did, main_element.wvmid, main_element.eid
-
-        # === Save thumbnail ===
-        thumbnail_url = fetch_thumbnail_url(did)
-        print(f"🖼️ Thumbnail URL: {thumbnail_url}", flush=True)
-        if thumbnail_url:
-            system.thumbnail_url = thumbnail_url
-
-        # === Get subassembly names ===
-        subassembly_names = fetch_subassembly_names(did, wid)
-        sub_part_names = set()
-        final_parts = []
-
-        print("🔗 Starting subassembly processing...", flush=True)
-
-        for row in main_json.get("rows", []):
-            values = row.get("headerIdToValue", {})
-            sub_name = values.get("Name")
-            qty = values.get("Quantity", 1)
-            qty = int(qty) if isinstance(qty, (int, str)) and str(qty).isdigit() else 1
-
-            for sub_url in (system.subassembly_urls or []):
-                sub_elem = OnshapeElement(sub_url)
-                if sub_elem.eid in subassembly_names:
-                    expected_name = subassembly_names[sub_elem.eid]
-                    if sub_name == expected_name:
-                        print(f"🔁 Found matching subassembly '{sub_name}' with qty={qty}", flush=True)
-                        sub_json = fetch_bom_from_url(sub_url)
-                        sub_parts = extract_part_data(sub_json, old_bom_by_id, multiplier=qty)
-                        final_parts.extend(sub_parts)
-                        sub_part_names.add(sub_name)
-
-        # === Merge all parts ===
-        cleaned_main = [p for p in main_parts if p["Part Name"] not in sub_part_names]
-        final_bom = cleaned_main + final_parts
-
-        system.bom_data = final_bom
-        db.session.commit()
+    print(f"🚀 Queuing BOM fetch for {team_number}/{robot_name}/{system_name}", flush=True)
+    job = create_job("bom_refresh", system_id=system.id, params={"force": bool(data.get("force"))})
+    db.session.commit()
+    start_job(app, socketio, job.id)
+    return jsonify(job_payload(job)), 202
 
-        print(f"✅ Final BOM has {len(final_bom)} parts", flush=True)
-        return jsonify({"msg": "✅ BOM successfully fetched and saved!", "bom_data": final_bom}), 200
 
-    except Exception as e:
-        traceback.print_exc()
-        db.session.rollback()
-        return jsonify({"error": f"Failed to process BOM: {str(e)}"}), 500
+@app.route("/api/bom/jobs/<job_id>", methods=["GET"])
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+@jwt_required()
+def bom_job_status(job_id):
+    """Report the state of a background job (BOM refresh, assembly export, ...)."""
+    current_user = get_jwt_identity()
+    claims = get_jwt()
+    job = db.session.get(Job, job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    team_number = job.system.robot.team.team_number if job.system else None
+    if str(team_number) != str(current_user) and not claims.get("is_global_admin"):
+        return jsonify({"error": "Unauthorized"}), 403
+    check_job(app, socketio, job)
+    return jsonify(job_payload(job)), 200
 
 
 # Global admin endpoints
@@ -1058,127 +1159,201 @@ def admin_get_bom():
     system_name = request.args.get('system', 'Main')
     if not team_number:
         return jsonify({"error": "Team number is required"}), 400
-    team = Team.query.filter_by(team_number=team_number).first()
+    team = paths.resolve(team_number).team
     if not team:
         return jsonify({"error": "Team not found"}), 404
 
-    combined_parts = []
-    if system_name == "Main":
-        for robot in team.robots:
-            for sys in robot.systems:
-                if sys.bom_data:
-                    combined_parts.extend(sys.bom_data)
-    else:
-        for robot in team.robots:
-            for sys in robot.systems:
-                if sys.name == system_name and sys.bom_data:
-                    combined_parts.extend(sys.bom_data)
-    return jsonify({"bom_data": combined_parts}), 200
+    from flask import Response, stream_with_context
+    # Streamed straight from one batched query instead of building the list first
+    chunks = stream_bom_list(team.id, None if system_name == "Main" else system_name)
+    return Response(stream_with_context(chunks), mimetype="application/json")
 
 
 @app.route('/api/admin/download_bom_dict', methods=['GET'])
 @jwt_required()
 def download_bom_dict():
     """(Global Admin) Download the entire BOM data dictionary for all teams."""
+    from flask import Response, stream_with_context
     current_user = get_jwt_identity()
     claims = get_jwt()
     if not claims.get('is_global_admin'):
         return jsonify({"error": "Unauthorized"}), 403
-    bom_data_dict = {}
-    for team in Team.query.all():
-        team_dict = {}
-        for robot in team.robots:
-            robot_dict = {}
-            for sys in robot.systems:
-                robot_dict[sys.name] = sys.bom_data if sys.bom_data else []
-            team_dict[robot.name] = robot_dict
-        bom_data_dict[team.team_number] = team_dict
-    return jsonify({"bom_data_dict": bom_data_dict}), 200
+    return Response(stream_with_context(stream_bom_dict()), mimetype="application/json")
+
+
+@app.route('/api/admin/onshape_budget', methods=['GET'])
+@jwt_required()
+def onshape_budget():
+    """(Global Admin) Current Onshape rate budget usage per access key in this worker."""
+    claims = get_jwt()
+    if not claims.get('is_global_admin'):
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify({"pid": os.getpid(), "budgets": rate_budget_usage()}), 200
+
+
+# Assembly tessellation used for the system viewer
+ASSEMBLY_GLTF_EXPORT = {
+    "formatName": "GLTF",
+    "destinationName": "FRCAssembly",
+    "storeInDocument": False,
+    "importWithinDocument": False,
+    "angularTolerance": 0.01,
+    "distanceTolerance": 0.01,
+    "maximumChordLength": 0.01,
+    "allowFaultyParts": False,
+}
+
+
+def run_gltf_export(job, report):
+    """Job runner: export the system's assembly to GLTF into the GLTF cache."""
+    system = job.system
+    if system is None:
+        raise ValueError("System no longer exists")
+    params = job.params or {}
+    cache_key = params["cache_key"]
+    if gltf_cache.get(cache_key):
+        return {"cache_key": cache_key}
+
+    api = OnshapeApi(system.access_key, system.secret_key, priority=PRIORITY_BULK)
+    did, wvm, wvmid, eid = params["did"], params["wvm"], params["wvmid"], params["eid"]
+
+    # Step 1: Start translation
+    report("exporting", 10)
+    start_url = f"/api/v12/assemblies/d/{did}/{wvm}/{wvmid}/e/{eid}/export/gltf"
+    start_res = api.post(start_url, json=ASSEMBLY_GLTF_EXPORT, headers={"Accept": "application/json"})
+    if start_res.status_code != 200:
+        raise RuntimeError(f"GLTF export failed to start: {start_res.text}")
+    translation_id = start_res.json().get("id")
+    if not translation_id:
+        raise RuntimeError("Missing translation job ID")
+
+    # Step 2: Wait for the shared poller to report the translation finished
+    result = tracker.wait(api, translation_id, poll_path=f"/api/v12/translations/{translation_id}",
+                          deadline=app.config["TRANSLATION_DEADLINE"])
+    ids = result.get("resultExternalDataIds")
+    if not ids:
+        raise RuntimeError("Export completed but no file found")
+
+    # Step 3: Download the actual GLTF straight into the cache
+    report("downloading", 70)
+    file_res = api.get(f"/api/documents/d/{did}/externaldata/{ids[0]}", stream=True)
+    if file_res.status_code != 200:
+        raise RuntimeError(f"Failed to fetch exported GLTF: {file_res.text}")
+    gltf_cache.put(cache_key, file_res.iter_content(chunk_size=64 * 1024))
+    return {"cache_key": cache_key}
+
+
+register_runner("gltf_export", run_gltf_export)
 
 
 @app.route("/api/viewer_gltf_batch", methods=["POST"])
 @jwt_required()
 def viewer_gltf_batch():
-    import requests, time
-    from flask import Response
+    """Start (or join) the GLTF export of a system's assembly and return its job handle.
+
+    The export is cached per assembly version. Once the job is done, fetch the
+    scene from `/api/viewer_gltf_batch/<job_id>/scene`.
+    """
     from onshape_client.onshape_url import OnshapeElement
 
     data = request.get_json()
     team_number = data.get("team_number")
     robot_name = data.get("robot")
     system_name = data.get("system")
-    part_ids = data.get("part_ids", [])
 
-    team = Team.query.filter_by(team_number=team_number).first()
+    team, robot, system = paths.resolve(team_number, robot_name, system_name)
     if not team: return jsonify({"error": "Team not found"}), 404
-    robot = Robot.query.filter_by(team_id=team.id, name=robot_name).first()
     if not robot: return jsonify({"error": "Robot not found"}), 404
-    system = System.query.filter_by(robot_id=robot.id, name=system_name).first()
     if not system: return jsonify({"error": "System not found"}), 404
 
-    auth = (system.access_key, system.secret_key)
+    if not gltf_cache.enabled:
+        return jsonify({"error": "The assembly viewer needs the GLTF cache (GLTF_CACHE_MAX_BYTES)"}), 503
+    if not system.assembly_url or not system.access_key or not system.secret_key:
+        return jsonify({"error": "Missing required Onshape credentials or assembly URL"}), 400
+
+    api = OnshapeApi(system.access_key, system.secret_key, priority=PRIORITY_INTERACTIVE)
     element = OnshapeElement(system.assembly_url)
     did, wvm, wvmid, eid = element.did, element.wvm, element.wvmid, element.eid
+    microversion = document_microversion(api, did, wvm, wvmid)
+    cache_key = FileCache.key(did, microversion, eid, sorted(ASSEMBLY_GLTF_EXPORT.items()), "assembly_gltf")
+
+    # Join an export of this exact assembly version that is already queued or running
+    job = pending_job("gltf_export", system.id)
+    if job and (job.params or {}).get("cache_key") != cache_key:
+        job = None
+    if job is None and gltf_cache.get(cache_key):
+        # Already exported: hand back the finished job without touching Onshape
+        latest = Job.query.filter_by(kind="gltf_export", system_id=system.id, state="done") \
+            .order_by(Job.created_at.desc()).first()
+        if latest and (latest.result or {}).get("cache_key") == cache_key:
+            job = latest
+    if job is None:
+        job = create_job("gltf_export", system_id=system.id, params={
+            "cache_key": cache_key, "did": did, "wvm": wvm, "wvmid": wvmid, "eid": eid,
+        })
+        if gltf_cache.get(cache_key):
+            job.state, job.stage, job.progress, job.result = "done", "done", 100, {"cache_key": cache_key}
+            db.session.commit()
+        else:
+            db.session.commit()
+            start_job(app, socketio, job.id)
+    return jsonify(job_payload(job)), 200 if job.state == "done" else 202
 
-    # Step 1: Start translation
-    start_url = f"https://cad.onshape.com/api/v12/assemblies/d/{did}/{wvm}/{wvmid}/e/{eid}/export/gltf"
-    part_id_string = ",".join(part_ids)
-
-    payload = {
-        "formatName": "GLTF",
-        "destinationName": "FRCAssembly",
-        "storeInDocument": False,
-        "importWithinDocument": False,
-        "angularTolerance": 0.01,
-        "distanceTolerance": 0.01,
-        "maximumChordLength": 0.01,
-        "allowFaultyParts": False,
-        # "advancedParams": {
-        #     "partIds": part_id_string
-        # }
-    }
 
-    start_res = requests.post(start_url, json=payload, auth=auth, headers={"Accept": "application/json"})
-    if start_res.status_code != 200:
-        return jsonify({"error": "GLTF export failed to start", "details": start_res.text}), start_res.status_code
-
-    job = start_res.json()
-    translation_id = job.get("id")
-    if not translation_id:
-        return jsonify({"error": "Missing translation job ID"}), 500
-
-    # Step 2: Poll the translation until ready
-    poll_url = f"https://cad.onshape.com/api/v12/translations/{translation_id}"
-    print(poll_url)
-    while(True):  # ~30s max
-        poll_res = requests.get(poll_url, auth=auth)
-        if poll_res.status_code != 200:
-            return jsonify({"error": "Polling failed", "details": poll_res.text}), poll_res.status_code
-
-        poll_data = poll_res.json()
-        if poll_data.get("requestState") == "DONE":
-            break
-        elif poll_data.get("requestState") == "FAILED":
-            return jsonify({"error": "GLTF export failed"}), 500
-        time.sleep(1)
-    else:
-        return jsonify({"error": "GLTF export timed out"}), 504
+@app.route("/api/viewer_gltf_batch/<job_id>/scene", methods=["GET"])
+@jwt_required()
+def viewer_gltf_batch_scene(job_id):
+    """Serve a finished assembly export, cut down to `part_ids` (comma separated) on the server.
 
-    # Step 3: Download the actual GLTF
-    download_url = f"https://cad.onshape.com/api/documents/d/{did}/externaldata/{translation_id}"
-    file_res = requests.get(download_url, auth=auth, stream=True)
-    if file_res.status_code == 200:
-        return Response(file_res.content, content_type="model/gltf+json")
-    else:
-        return jsonify({"error": "Failed to fetch exported GLTF", "details": file_res.text}), file_res.status_code
+    `format=glb` returns the quantized binary conversion.
+    """
+    current_user = get_jwt_identity()
+    claims = get_jwt()
+    job = db.session.get(Job, job_id)
+    if not job or job.kind != "gltf_export":
+        return jsonify({"error": "Job not found"}), 404
+    team_number = job.system.robot.team.team_number if job.system else None
+    if str(team_number) != str(current_user) and not claims.get("is_global_admin"):
+        return jsonify({"error": "Unauthorized"}), 403
+    if job.state != "done":
+        check_job(app, socketio, job)
+        return jsonify(job_payload(job)), 409
+
+    part_ids = [p for p in (request.args.get("part_ids") or "").split(",") if p]
+    want_glb = (request.args.get("format") or "gltf").lower() == "glb"
+    cache_key = job.result["cache_key"]
+    variant = scene_variant(gltf_cache, cache_key, part_ids, glb=want_glb)
+    if variant is None and want_glb:
+        variant = scene_variant(gltf_cache, cache_key, part_ids)
+        want_glb = False
+    if variant is None:
+        return jsonify({"error": "Exported scene is no longer cached, start the export again"}), 410
+    return send_gltf_from_cache(variant, mimetype="model/gltf-binary" if want_glb else "model/gltf+json")
+
+
+def onshape_rejected(status):
+    """True for a 4xx other than 429: Onshape does not know the part where we asked for it."""
+    return status is not None and 400 <= status < 500 and status != 429
+
+
+def relocate_part(api, system, part_id, target):
+    """Re-scan the system's part studios after Onshape rejected `target`, a stored index entry.
+
+    Saves the corrected index and returns the part's new location, or None if the
+    scan finds it nowhere else.
+    """
+    print(f"🔁 Onshape rejected the indexed studio of {part_id}, scanning the part studios again")
+    new_target, new_index = locate_part(api, part_id, system.part_index, system.partstudio_urls, refresh=True)
+    if new_index is not None:
+        system.part_index = new_index
+        db.session.commit()
+    return new_target if new_target and new_target != target else None
 
 
 @app.route("/api/download_cad", methods=["POST"])
 @jwt_required()
 def download_cad():
-    import requests, time, io
-    from flask import send_file
-    from onshape_client.onshape_url import OnshapeElement
+    from flask import Response, send_file
 
     current_user = get_jwt_identity()
     claims = get_jwt()
@@ -1198,177 +1373,279 @@ def download_cad():
     if current_user != team_number and not claims.get("is_global_admin"):
         return jsonify({"error": "Unauthorized"}), 403
 
-    team = Team.query.filter_by(team_number=team_number).first()
+    team, robot, system = paths.resolve(team_number, robot_name, system_name)
     if not team:
         return jsonify({"error": "Team not found"}), 404
 
-    robot = Robot.query.filter_by(team_id=team.id, name=robot_name).first()
     if not robot:
         return jsonify({"error": "Robot not found"}), 404
 
-    system = System.query.filter_by(robot_id=robot.id, name=system_name).first()
     if not system:
         return jsonify({"error": "System not found"}), 404
 
-    if not all([system.access_key, system.secret_key, system.partstudio_urls]):
+    if not all([system.access_key, system.secret_key]) or not (system.partstudio_urls or system.part_index):
         return jsonify({"error": "Onshape credentials or part studio URLs missing"}), 400
 
-    headers = {"Accept": "application/json"}
-    auth = (system.access_key, system.secret_key)
+    api = OnshapeApi(system.access_key, system.secret_key, priority=PRIORITY_INTERACTIVE)
 
-    # 🔁 Find matching partId
-    target = None
-    for ps_url in system.partstudio_urls:
-        try:
-            element = OnshapeElement(ps_url)
-            did, wid, eid = element.did, element.wvmid, element.eid
-
-            res = requests.get(
-                f"https://cad.onshape.com/api/parts/d/{did}/w/{wid}/e/{eid}",
-                headers=headers,
-                auth=auth
-            )
-            if res.status_code != 200:
-                continue
-
-            part_ids = [p["partId"] for p in res.json()]
-            if part_id in part_ids:
-                target = {"did": did, "wid": wid, "eid": eid}
-                break
-        except Exception as e:
-            print(f"⚠️ Failed to process {ps_url}: {e}")
+    # 🔁 Find matching partId (persisted index first, studio scan only on a miss)
+    target, new_index = locate_part(api, part_id, system.part_index, system.partstudio_urls)
+    indexed = new_index is None  # the location came from the stored index and may be stale
+    if new_index is not None:
+        system.part_index = new_index
+        db.session.commit()
 
     if not target:
         return jsonify({"error": f"Part ID '{part_id}' not found in any part studio"}), 404
 
-    print(f"🚀 Found part, requesting export to {file_format}")
-    r = requests.post(
-        f"https://cad.onshape.com/api/partstudios/d/{target['did']}/w/{target['wid']}/e/{target['eid']}/translations",
-        headers={"Accept": "application/json", "Content-Type": "application/json"},
-        auth=auth,
-        json={
-            "formatName": file_format,
-            "partIds": part_id,
-            "storeInDocument": False
-        }
-    )
+    filename = f"{part_id}.{file_format.lower()}"
+
+    def export(target):
+        # 💾 Go through the translated-file cache when enabled (keyed by exact document state)
+        if cad_cache.enabled:
+            cached_path, cache_key = translate_part_to_cache(api, cad_cache, target, part_id, file_format,
+                                                             app.config["TRANSLATION_DEADLINE"])
+            return send_file(cached_path, mimetype="application/octet-stream", as_attachment=True,
+                             download_name=filename, etag=cache_key, conditional=True)
+        return translate_part(api, target, part_id, file_format, app.config["TRANSLATION_DEADLINE"])
+
+    try:
+        try:
+            result = export(target)
+        except FileNotFoundError:
+            # 💾 Evicted by another worker's put between caching and sending: translate it once more
+            result = export(target)
+        except TranslationError as e:
+            # 🔁 A stale index entry: Onshape no longer has the part there, so look for it once more
+            retarget = relocate_part(api, system, part_id, target) if indexed and onshape_rejected(
+                e.upstream_status) else None
+            if not retarget:
+                raise
+            result = export(retarget)
+    except TranslationError as e:
+        return jsonify({"error": e.message}), e.status
+    if cad_cache.enabled:
+        return result
+
+    # 🧾 Relay the file to the client as it arrives
+    chunks, headers = relay_stream(result, request.headers.get("Accept-Encoding"))
+    headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return Response(chunks, mimetype="application/octet-stream", headers=headers)
+
+
+@app.route("/api/download_cad_bulk", methods=["POST"])
+@jwt_required()
+def download_cad_bulk():
+    from flask import Response, stream_with_context
+
+    current_user = get_jwt_identity()
+    claims = get_jwt()
+    data = request.get_json()
+
+    team_number = data.get("team_number")
+    robot_name = data.get("robot")
+    system_name = data.get("system")
+    material = data.get("material")
+    process = data.get("process")
+    part_ids = data.get("part_ids")
+
+    if not all([team_number, robot_name, system_name]):
+        return jsonify({"error": "Missing required fields (team_number, robot, system)"}), 400
+    if part_ids is not None and not isinstance(part_ids, list):
+        return jsonify({"error": "part_ids must be a list"}), 400
+
+    if current_user != team_number and not claims.get("is_global_admin"):
+        return jsonify({"error": "Unauthorized"}), 403
+
+    team, robot, system = paths.resolve(team_number, robot_name, system_name)
+    if not team:
+        return jsonify({"error": "Team not found"}), 404
+
+    if not robot:
+        return jsonify({"error": "Robot not found"}), 404
+
+    if not system:
+        return jsonify({"error": "System not found"}), 404
+
+    if not all([system.access_key, system.secret_key]) or not (system.partstudio_urls or system.part_index):
+        return jsonify({"error": "Onshape credentials or part studio URLs missing"}), 400
+
+    parts = [p for p in system.bom_entries() if part_matches(p, process, material, set(part_ids or []))]
+    if not parts:
+        return jsonify({"error": "No parts match the filter"}), 404
+
+    machine_formats = {m.name: (m.cad_format or "STEP").upper()
+                       for m in Machine.query.filter_by(team_id=team.id).all()}
+    api = OnshapeApi(system.access_key, system.secret_key, priority=PRIORITY_BULK)
+
+    # 🔁 Resolve every part up front so the streaming generator never touches the database
+    jobs = []
+    part_index = system.part_index
+    index_changed = False
+    for part in parts:
+        part_id = part.get("partId")
+        target, new_index = locate_part(api, part_id, part_index, system.partstudio_urls)
+        if new_index is not None:
+            part_index = new_index
+            index_changed = True
+        if not target:
+            print(f"⚠️ Part ID '{part_id}' not found in any part studio, skipping")
+            continue
+        qty = int(part.get("Quantity") or 1)
+        file_format = machine_formats.get(current_process(part, qty), "STEP")
+        jobs.append((export_filename(part, file_format, material), api, target, part_id, file_format))
+    if index_changed:
+        system.part_index = part_index
+        db.session.commit()
+
+    if not jobs:
+        return jsonify({"error": "None of the matching parts were found in the part studios"}), 404
+
+    archive_name = secure_filename(f"{system_name}_{material or process or 'parts'}.zip") or "parts.zip"
+    print(f"📦 Bulk export of {len(jobs)} parts to {archive_name}")
+    chunks = stream_zip(jobs, cad_cache, app.config["CAD_EXPORT_CONCURRENCY"], app.config["TRANSLATION_DEADLINE"])
+    return Response(stream_with_context(chunks), mimetype="application/zip",
+                    headers={"Content-Disposition": f'attachment; filename="{archive_name}"'})
+
+
+def send_gltf_from_cache(key, mimetype="model/gltf+json"):
+    """Serve a cached GLTF entry compressed per Accept-Encoding, with a strong ETag and 304 support.
 
-    if r.status_code != 200:
-        print("❌ Failed to start translation:", r.text)
-        return jsonify({"error": "Failed to start translation"}), 500
-
-    translation_id = r.json().get("id")
-    print("🆔 Translation ID:", translation_id)
-
-    # ⏳ Poll until ready
-    for attempt in range(30):
-        time.sleep(0.5)
-        poll = requests.get(
-            f"https://cad.onshape.com/api/translations/{translation_id}",
-            headers=headers,
-            auth=auth
-        )
-        result = poll.json()
-        state = result.get("requestState")
-        print(f"⏳ Attempt {attempt + 1}: {state}")
-        if state == "DONE":
-            ids = result.get("resultExternalDataIds")
-            if not ids:
-                return jsonify({"error": "Export completed but no file found"}), 500
-            external_id = ids[0]
-            download_url = f"https://cad.onshape.com/api/documents/d/{target['did']}/externaldata/{external_id}"
-            print("✅ Downloading from:", download_url)
-
-            # 🎯 Fetch the actual file
-            file_response = requests.get(download_url, headers=headers, auth=auth, stream=True)
-            if file_response.status_code != 200:
-                return jsonify({"error": "Failed to retrieve translated file"}), 500
-
-            # 🧾 Stream the file back
-            filename = f"{part_id}.{file_format.lower()}"
-            return send_file(
-                io.BytesIO(file_response.content),
-                mimetype="application/octet-stream",
-                as_attachment=True,
-                download_name=filename
-            )
-
-        elif state == "FAILED":
-            return jsonify({"error": "Translation failed"}), 500
-
-    return jsonify({"error": "Export timed out"}), 504
-
-
-@app.route("/api/viewer_gltf", methods=["POST"])
+    Answers 503 with Retry-After if the entry was evicted since the caller looked it up.
+    """
+    from flask import send_file
+
+    encoding = request.accept_encodings.best_match(GLTF_ENCODINGS + ["identity"], default="identity")
+    variant = encoded_variant(gltf_cache, key, encoding)
+    if variant is None:
+        response = jsonify({"error": "Model was evicted from the cache, try again"})
+        response.status_code = 503
+        response.headers["Retry-After"] = "1"
+        return response
+    path, etag = variant
+    response = send_file(path, mimetype=mimetype, etag=etag, conditional=True)
+    if encoding != "identity":
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Vary"] = "Accept-Encoding"
+    # Let the browser keep it, but revalidate with If-None-Match each time
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def send_viewer_model(key, want_glb=False):
+    """Serve a cached viewer GLTF, converted to quantized GLB first when asked for and possible."""
+    if want_glb:
+        glb_key = glb_variant(gltf_cache, key)
+        if glb_key:
+            return send_gltf_from_cache(glb_key, mimetype="model/gltf-binary")
+    return send_gltf_from_cache(key)
+
+
+@app.route("/api/viewer_gltf", methods=["GET", "POST"])
 @jwt_required()
 def view_gltf():
-    import requests
     from flask import Response
-    from onshape_client.onshape_url import OnshapeElement
 
-    data = request.get_json()
+    data = request.get_json(silent=True) or request.args
     team_number = data.get("team_number")
     robot_name = data.get("robot")
     system_name = data.get("system")
     part_id = data.get("id")
-
-    team = Team.query.filter_by(team_number=team_number).first()
+    # "glb" asks for the quantized binary conversion (needs the GLTF cache); default is text GLTF
+    want_glb = (data.get("format") or "gltf").lower() == "glb"
+    # "coarse" returns a quick low-detail model and starts on the "fine" one in the background
+    lod = (data.get("lod") or "fine").lower()
+    if lod not in VIEWER_LODS:
+        return jsonify({"error": f"lod must be one of {', '.join(VIEWER_LODS)}"}), 400
+
+    team, robot, system = paths.resolve(team_number, robot_name, system_name)
     if not team: return jsonify({"error": "Team not found"}), 404
 
-    robot = Robot.query.filter_by(team_id=team.id, name=robot_name).first()
     if not robot: return jsonify({"error": "Robot not found"}), 404
 
-    system = System.query.filter_by(robot_id=robot.id, name=system_name).first()
     if not system: return jsonify({"error": "System not found"}), 404
 
-    auth = (system.access_key, system.secret_key)
+    api = OnshapeApi(system.access_key, system.secret_key, priority=PRIORITY_INTERACTIVE)
+
+    # 🔍 Find matching part (persisted index first, studio scan only on a miss)
+    try:
+        target, new_index = locate_part(api, part_id, system.part_index, system.partstudio_urls)
+    except RateBudgetExceeded:
+        raise
+    except Exception as e:
+        return jsonify({"error": f"Exception: {str(e)}"}), 500
+    indexed = new_index is None  # the location came from the stored index and may be stale
+    if new_index is not None:
+        system.part_index = new_index
+        db.session.commit()
+    if not target:
+        return jsonify({"error": f"Part '{part_id}' not found in any partstudio"}), 404
 
-    for ps_url in system.partstudio_urls:
+    # 💾 Cached per part, level of detail and document state; only the microversion lookup hits Onshape
+    if gltf_cache.enabled:
         try:
-            element = OnshapeElement(ps_url)
-            did, wid, eid = element.did, element.wvmid, element.eid
-
-            # 🔍 Find matching part
-            parts_res = requests.get(
-                f"https://cad.onshape.com/api/parts/d/{did}/w/{wid}/e/{eid}",
-                headers={"Accept": "application/json"},
-                auth=auth
-            )
-
-            if parts_res.status_code != 200:
-                return jsonify({"error": "Failed to fetch part list", "status": parts_res.status_code,
-                                "details": parts_res.text}), parts_res.status_code
-
-            for part in parts_res.json():
-                if part["partId"] == part_id:
-                    gltf_url = (
-                        f"https://cad.onshape.com/api/v12/parts/d/{did}/w/{wid}/e/{eid}/partid/{part_id}/gltf"
-                        f"?rollbackBarIndex=-1"
-                        f"&outputSeparateFaceNodes=false"
-                        f"&outputFaceAppearances=false"
-                        f"&angleTolerance=0.5"  # Smaller = smoother curves
-                        f"&chordTolerance=0.05"  # Smaller = higher precision
-                        f"&maxFacetWidth=0.1"  # Smaller = more detail
-                    )
-
-                    headers = {
-                        "Accept": "*/*"
-                    }
-                    gltf_res = requests.get(gltf_url, headers=headers, auth=auth, stream=True)
-
-                    if gltf_res.status_code == 200:
-                        return Response(gltf_res.content, content_type="model/gltf+json")
-                    else:
-                        return jsonify({
-                            "error": "GLTF fetch failed",
-                            "status": gltf_res.status_code,
-                            "url": gltf_url,
-                            "details": gltf_res.text
-                        }), gltf_res.status_code
-        except Exception as e:
-            return jsonify({"error": f"Exception: {str(e)}"}), 500
+            try:
+                microversion = document_microversion(api, target["did"], target["wvm"], target["wvmid"])
+                cache_key = fetch_part_gltf(api, gltf_cache, gltf_fetches, target, part_id, lod, microversion)
+            except GltfFetchError as e:
+                # 🔁 A stale index entry: Onshape no longer has the part there, so look for it once more
+                retarget = relocate_part(api, system, part_id, target) if indexed and onshape_rejected(
+                    e.status) else None
+                if not retarget:
+                    raise
+                target = retarget
+                microversion = document_microversion(api, target["did"], target["wvm"], target["wvmid"])
+                cache_key = fetch_part_gltf(api, gltf_cache, gltf_fetches, target, part_id, lod, microversion)
+        except GltfFetchError as e:
+            return jsonify({"error": "GLTF fetch failed", "status": e.status, "url": e.url,
+                            "details": e.details}), e.status
+
+        # ⏩ Coarse first: start tessellating the fine model so it is ready when the viewer asks
+        if lod == "coarse":
+            def prefetch_fine():
+                try:
+                    fetch_part_gltf(api, gltf_cache, gltf_fetches, target, part_id, "fine", microversion)
+                except Exception as e:
+                    print(f"⚠️ Fine GLTF prefetch for {part_id} failed: {e}")
+            socketio.start_background_task(prefetch_fine)
 
-    return jsonify({"error": f"Part '{part_id}' not found in any partstudio"}), 404
+        response = send_viewer_model(cache_key, want_glb)
+        if response.status_code == 503:
+            # Evicted between the fetch and the send (a small cache under load): fetch it once more
+            try:
+                cache_key = fetch_part_gltf(api, gltf_cache, gltf_fetches, target, part_id, lod, microversion)
+            except GltfFetchError as e:
+                return jsonify({"error": "GLTF fetch failed", "status": e.status, "url": e.url,
+                                "details": e.details}), e.status
+            response = send_viewer_model(cache_key, want_glb)
+        response.headers["X-Model-LOD"] = lod
+        if lod == "coarse":
+            response.headers["X-Model-Next-LOD"] = "fine"  # being prefetched, so asking for it is cheap
+        return response
+
+    gltf_url = part_gltf_path(target, part_id, lod)
+    headers = {
+        "Accept": "*/*"
+    }
+    gltf_res = api.get(gltf_url, headers=headers, stream=True)
+    if indexed and onshape_rejected(gltf_res.status_code):
+        retarget = relocate_part(api, system, part_id, target)
+        if retarget:
+            gltf_res.close()
+            gltf_url = part_gltf_path(retarget, part_id, lod)
+            gltf_res = api.get(gltf_url, headers=headers, stream=True)
+
+    if gltf_res.status_code == 200:
+        chunks, headers = relay_stream(gltf_res, request.headers.get("Accept-Encoding"))
+        headers["X-Model-LOD"] = lod
+        return Response(chunks, content_type="model/gltf+json", headers=headers)
+    else:
+        return jsonify({
+            "error": "GLTF fetch failed",
+            "status": gltf_res.status_code,
+            "url": gltf_url,
+            "details": gltf_res.text
+        }), gltf_res.status_code
 
 
 @app.route('/api/admin/download_settings_dict', methods=['GET'])
@@ -1406,7 +1683,7 @@ def system_settings():
     if not all([team_number, robot_name, system_name]):
         return jsonify({"error": "Missing required parameters"}), 400
 
-    team = Team.query.filter_by(team_number=team_number).first()
+    team, robot, system = paths.resolve(team_number, robot_name, system_name)
     if not team:
         return jsonify({"error": "Team not found"}), 404
 
@@ -1415,12 +1692,9 @@ def system_settings():
     if current_user != team_number and not claims.get("is_global_admin"):
         return jsonify({"error": "Unauthorized"}), 403
 
-    robot = Robot.query.filter_by(team_id=team.id, name=robot_name).first()
     if not robot:
         return jsonify({"error": "Robot not found"}), 404
 
-    system = System.query.filter_by(robot_id=robot.id, name=system_name).first()
-
     if request.method == "GET":
         if not system:
             return jsonify({"error": "System not found"}), 404
@@ -1467,15 +1741,16 @@ def update_system_settings():
     if current_user != team_number and not claims.get("is_global_admin"):
         return jsonify({"error": "Unauthorized"}), 403
 
-    team = Team.query.filter_by(team_number=team_number).first()
-    robot = Robot.query.filter_by(team_id=team.id, name=robot_name).first()
-    system = System.query.filter_by(robot_id=robot.id, name=system_name).first()
+    team, robot, system = paths.resolve(team_number, robot_name, system_name)
 
     if not system:
         return jsonify({"error": "System not found"}), 404
 
-    if old_system_name is not None:
+    if old_system_name is not None and new_system_name != system.name:
+        paths.invalidate(team.team_number, robot.name)
         system.name = new_system_name
+        db.session.flush()
+        RobotBomItem.rebuild(robot.id)  # the placeholder "Main" system is left out of the rollup
     system.assembly_url = data.get("assembly_url")
     system.access_key = data.get("access_key")
     system.secret_key = data.get("secret_key")
@@ -1489,7 +1764,9 @@ def update_system_settings():
 # Web endpoints for form actions (for completeness)
 @app.route('/<team_number>/new_robot', methods=['POST'])
 def create_robot_web(team_number):
-    team = Team.query.filter_by(team_number=team_number).first_or_404()
+    team = paths.resolve(team_number).team
+    if not team:
+        abort(404)
     name = request.form.get('name')
     year = request.form.get('year') or datetime.now().year
     image_text = request.files.get('image_text')
@@ -1502,7 +1779,7 @@ def create_robot_web(team_number):
     db.session.flush()
     # Create default subsystems and machines as per template (simplified)
     for sys_name in ["Main", "System1", "System2", "System3", "System4", "System5"]:
-        db.session.add(System(robot=new_robot, name=sys_name, bom_data=[]))
+        db.session.add(System(robot=new_robot, name=sys_name))
     if image_text:
         team_dir = os.path.join(app.config['UPLOAD_FOLDER'], f"team_{team_number}", "robots")
         os.makedirs(team_dir, exist_ok=True)
@@ -1531,6 +1808,7 @@ def delete_robot(robot_id):
             except Exception:
                 pass
 
+    paths.invalidate(team_number, robot.name)
     db.session.delete(robot)
     db.session.commit()
     return redirect(f"/{team_number}/Admin")
@@ -1571,13 +1849,11 @@ def debug_system_url():
     team_number = request.args.get("team_number")
     robot_name = request.args.get("robot")
     system_name = request.args.get("system")
-    team = Team.query.filter_by(team_number=team_number).first()
+    team, robot, system = paths.resolve(team_number, robot_name, system_name)
     if not team:
         return jsonify({"error": "Team not found"}), 404
-    robot = Robot.query.filter_by(team_id=team.id, name=robot_name).first()
     if not robot:
         return jsonify({"error": "Robot not found"}), 404
-    system = System.query.filter_by(robot_id=robot.id, name=system_name).first()
     if not system:
         return jsonify({"error": "System not found"}), 404
     return jsonify({
@@ -0,0 +1,108 @@
+"""Compare the JSON BOM route with the CSV/Parquet export on a synthetic BOM.
+
+    python benchmarks/bom_export.py              # 10k rows
+    python benchmarks/bom_export.py --rows 50000
+
+Runs the app against an in-memory SQLite database through Flask's test client,
+so the numbers cover query, serialisation and response streaming, not the network.
+A 10k-row run on a development machine:
+
+    route                          bytes        ms
+    json (admin/get_bom)         2874949     510.5
+    csv (export_bom)              959830     253.6
+    parquet (export_bom)          237993     234.6
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DATABASE_URL"] = "sqlite://"
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+
+from app import app  # noqa: E402
+from bom_export import FORMATS  # noqa: E402
+from models import db, Team, Robot, System  # noqa: E402
+
+MATERIALS = ["Aluminum - 6061", "Steel", "Polycarbonate", "Delrin", "PLA"]
+PROCESSES = ["", "", "Saw", "CNC", "Lathe", "3D Print", "Tap"]
+
+
+def synthetic_bom(rows, seed=0):
+    rng = random.Random(seed)
+    for i in range(rows):
+        entry = {
+            "Part Name": f"Part {i}",
+            "Description": f"Synthetic part {i}",
+            "Quantity": rng.randint(1, 8),
+            "Material": rng.choice(MATERIALS),
+            "materialBOM": rng.choice(MATERIALS),
+            "Pre Process": rng.choice(PROCESSES),
+            "Process 1": rng.choice(PROCESSES),
+            "Process 2": rng.choice(PROCESSES),
+            "partId": f"J{i:06d}",
+            "done_preprocess": rng.randint(0, 2),
+            "done_process1": rng.randint(0, 2),
+        }
+        if i % 50 == 0:
+            entry["Material"] = {"displayName": entry["Material"], "id": f"m{i}"}  # shape of old saves
+        yield entry
+
+
+def seed(rows, systems):
+    db.create_all()
+    team = Team(name="Bench", team_number=9999, password="x", adminPassword="x")
+    db.session.add(team)
+    db.session.flush()
+    robot = Robot(name="Bench", year=2025, team_id=team.id)
+    db.session.add(robot)
+    db.session.flush()
+    entries = list(synthetic_bom(rows))
+    per_system = -(-rows // systems)
+    for n in range(systems):
+        system = System(name=f"System{n + 1}", robot_id=robot.id)
+        db.session.add(system)
+        system.replace_bom(entries[n * per_system:(n + 1) * per_system])
+    db.session.commit()
+
+
+def measure(client, url, headers, repeat):
+    best = None
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = client.get(url, headers=headers)
+        size = len(res.get_data())
+        elapsed = time.perf_counter() - start
+        assert res.status_code == 200, res.get_data()[:200]
+        best = elapsed if best is None else min(best, elapsed)
+    return size, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000, help="BOM rows to generate")
+    parser.add_argument("--systems", type=int, default=5, help="systems the rows are spread over")
+    parser.add_argument("--repeat", type=int, default=5, help="requests per route (best time is reported)")
+    args = parser.parse_args()
+
+    with app.app_context():
+        seed(args.rows, args.systems)
+        token = create_access_token(identity="9999", additional_claims={"is_global_admin": True})
+    headers = {"Authorization": f"Bearer {token}"}
+    client = app.test_client()
+
+    routes = [("json (admin/get_bom)", "/api/admin/get_bom?team_number=9999")]
+    routes += [(f"{fmt} (export_bom)", f"/api/export_bom?team_number=9999&format={fmt}") for fmt in FORMATS]
+    print(f"{args.rows} rows over {args.systems} systems")
+    print(f"{'route':<24}{'bytes':>12}{'ms':>10}")
+    for label, url in routes:
+        size, best = measure(client, url, headers, args.repeat)
+        print(f"{label:<24}{size:>12}{best * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
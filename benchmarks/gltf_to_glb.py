@@ -0,0 +1,51 @@
+"""Measure GLTF -> quantized GLB conversion: bytes before/after and time per part.
+
+    python benchmarks/gltf_to_glb.py                 # synthetic parts from fake_onshape
+    python benchmarks/gltf_to_glb.py part1.gltf ...  # real Onshape exports
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gltf import gltf_to_glb  # noqa: E402
+
+
+def synthetic_parts(sizes):
+    from fake_onshape import build_gltf
+    for triangles in sizes:
+        yield f"cylinder-{triangles}", json.dumps(build_gltf(["P0"], triangles)).encode("utf-8")
+
+
+def file_parts(paths):
+    for path in paths:
+        with open(path, "rb") as f:
+            yield os.path.basename(path), f.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="text GLTF files with embedded buffers")
+    parser.add_argument("--sizes", default="500,5000,50000,200000", help="synthetic triangle counts")
+    parser.add_argument("--repeat", type=int, default=3, help="conversions per part (best time is reported)")
+    args = parser.parse_args()
+
+    parts = file_parts(args.files) if args.files else synthetic_parts(int(s) for s in args.sizes.split(","))
+    print(f"{'part':<24}{'gltf':>12}{'gltf.gz':>12}{'glb':>12}{'glb.gz':>12}{'ratio':>8}{'ms':>10}")
+    for name, data in parts:
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            glb = gltf_to_glb(data)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{name:<24}{len(data):>12,}{len(gzip.compress(data, 6)):>12,}{len(glb):>12,}"
+              f"{len(gzip.compress(glb, 6)):>12,}{len(data) / len(glb):>8.1f}{best * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import hashlib
+
+from onshape_client.onshape_url import OnshapeElement
+
+from onshape import OnshapeApi, PRIORITY_BULK, RateBudgetExceeded, run_concurrently
+
+
+def make_client(access_key, secret_key):
+    return OnshapeApi(access_key, secret_key, priority=PRIORITY_BULK)
+
+
+def fetch_bom_from_url(client, url):
+    print(f"📥 Fetching BOM from: {url}", flush=True)
+    element = OnshapeElement(url)
+    bom_url = f"/api/v10/assemblies/d/{element.did}/{element.wvm}/{element.wvmid}/e/{element.eid}/bom"
+    headers = {'Accept': 'application/vnd.onshape.v1+json', 'Content-Type': 'application/json'}
+    return client.get_json(bom_url, params={"indented": "true", "multiLevel": "true"}, headers=headers)
+
+
+def fetch_thumbnail_url(client, document_id):
+    print(f"🖼️ Fetching thumbnail for document {document_id}", flush=True)
+    doc_data = client.get_json(f"/api/v12/documents/{document_id}")
+    thumbnail = doc_data.get("thumbnail")
+    print("📦 Thumbnail field:", thumbnail, flush=True)
+    if not thumbnail:
+        return None
+    sizes = thumbnail.get("sizes", [])
+    if not sizes or not isinstance(sizes, list):
+        return thumbnail.get("href")
+    best = max(sizes, key=lambda s: int(s.get("size", "0x0").split("x")[0]), default=None)
+    return best.get("href") if best else thumbnail.get("href")
+
+
+def document_microversion(client, did, wvm, wvmid):
+    """Identify the exact state of a document: its current microversion for a workspace,
+    or the (immutable) version/microversion id itself."""
+    if wvm == "w":
+        current = client.get_json(f"/api/v6/documents/d/{did}/w/{wvmid}/currentmicroversion")
+        return f"m:{current.get('microversion')}"
+    return f"{wvm}:{wvmid}"
+
+
+def fetch_change_marker(client, urls):
+    """Return a cheap marker that changes whenever any document behind `urls` changes.
+
+    Workspaces report their current microversion; versions and microversions are
+    immutable, so their own id is enough. The URLs themselves are part of the marker
+    so editing the system settings also forces a refresh.
+    """
+    parts = []
+    seen = set()
+    for url in urls:
+        element = OnshapeElement(url)
+        key = (element.did, element.wvm, element.wvmid)
+        if key in seen:
+            continue
+        seen.add(key)
+        parts.append(f"{element.did}:{document_microversion(client, element.did, element.wvm, element.wvmid)}")
+    url_hash = hashlib.sha1("\n".join(urls).encode("utf-8")).hexdigest()[:12]
+    return "|".join(parts + [url_hash])
+
+
+def parse_quantity(value):
+    return int(value) if isinstance(value, (int, str)) and str(value).isdigit() else 1
+
+
+def _header_ids(bom_json):
+    def get_id(name):
+        for header in bom_json.get("headers", []):
+            if header.get("name") == name:
+                return header.get("id")
+        return None
+
+    material_id = get_id("Material")
+    return {
+        "name": get_id("Name"),
+        "description": get_id("Description"),
+        "quantity": get_id("Quantity") or get_id("QTY"),
+        "material": material_id,
+        "material_bom": get_id("Bom Material") or material_id,
+        "pre_process": get_id("Pre Process"),
+        "process1": get_id("Process 1"),
+        "process2": get_id("Process 2"),
+        "item": get_id("Item"),
+    }
+
+
+def _part_entry(row, ids, old_bom_by_id, multiplier):
+    values = row.get("headerIdToValue", {})
+    part_id = row.get("itemSource", {}).get("partId", "")
+    qty = parse_quantity(values.get(ids["quantity"], 1))
+    entry = {
+        "Part Name": values.get(ids["name"], "Unknown"),
+        "Description": values.get(ids["description"], "Unknown"),
+        "Quantity": qty * multiplier,
+        "Material": values.get(ids["material"], "Unknown"),
+        "materialBOM": values.get(ids["material_bom"], "Unknown"),
+        "Pre Process": values.get(ids["pre_process"], "Unknown"),
+        "Process 1": values.get(ids["process1"], "Unknown"),
+        "Process 2": values.get(ids["process2"], "Unknown"),
+        "partId": part_id
+    }
+
+    for key in ["Material", "materialBOM"]:
+        if isinstance(entry[key], dict):
+            entry[key] = entry[key].get("displayName", "Unknown")
+
+    old = old_bom_by_id.get(part_id)
+    if old:
+        entry["done_preprocess"] = old.get("done_preprocess", 0)
+        entry["done_process1"] = old.get("done_process1", 0)
+        entry["done_process2"] = old.get("done_process2", 0)
+        entry["available_qty"] = old.get("available_qty", 0)
+    return entry
+
+
+def extract_part_data(bom_json, old_bom_by_id, multiplier=1):
+    ids = _header_ids(bom_json)
+    return [_part_entry(row, ids, old_bom_by_id, multiplier) for row in bom_json.get("rows", [])]
+
+
+def _row_depth(row, item_id):
+    """Nesting depth of an indented BOM row: 0 for top-level items."""
+    level = row.get("indentLevel")
+    if isinstance(level, int):
+        return level
+    # Fall back to the item number ("1", "1.2", "1.2.3") when no explicit level is given
+    item = row.get("headerIdToValue", {}).get(item_id)
+    if isinstance(item, str) and item:
+        return item.count(".")
+    return 0
+
+
+def flatten_indented_bom(bom_json, old_bom_by_id):
+    """Expand an indented BOM into the leaf part entries `extract_part_data` builds.
+
+    A row followed by deeper rows is a subassembly: it is not emitted itself, and its
+    quantity multiplies the quantities of everything nested under it, to any depth.
+    """
+    ids = _header_ids(bom_json)
+    rows = bom_json.get("rows", [])
+    depths = [_row_depth(row, ids["item"]) for row in rows]
+
+    multipliers = {}  # depth -> total count of the enclosing subassembly at that depth
+    part_list = []
+    for i, row in enumerate(rows):
+        depth = depths[i]
+        for deeper in [d for d in multipliers if d >= depth]:
+            del multipliers[deeper]
+        parent_multiplier = multipliers[max(multipliers)] if multipliers else 1
+
+        if i + 1 < len(rows) and depths[i + 1] > depth:
+            qty = parse_quantity(row.get("headerIdToValue", {}).get(ids["quantity"], 1))
+            multipliers[depth] = parent_multiplier * qty
+        else:
+            part_list.append(_part_entry(row, ids, old_bom_by_id, parent_multiplier))
+    return part_list
+
+
+def _studio_keys(partstudio_urls):
+    keys = set()
+    for url in partstudio_urls or []:
+        try:
+            element = OnshapeElement(url)
+        except Exception:
+            continue
+        keys.add((element.did, element.eid))
+    return keys
+
+
+def build_part_index(bom_json, partstudio_urls=None):
+    """Map the partIds in a BOM to the Part Studio they come from, using `itemSource`.
+
+    PartIds are only unique within one Part Studio, and the BOM also lists COTS and
+    library parts. When several studios claim a partId, the single one among
+    `partstudio_urls` is kept; otherwise the partId is left out so `locate_part`
+    scans the system's own studios for it instead of guessing.
+    """
+    sources = {}
+    for row in bom_json.get("rows", []):
+        source = row.get("itemSource", {})
+        part_id = source.get("partId")
+        if not part_id or not source.get("documentId") or not source.get("elementId"):
+            continue
+        studios = sources.setdefault(part_id, {})
+        studios.setdefault((source["documentId"], source["elementId"]), {
+            "did": source["documentId"],
+            "wvm": source.get("wvmType") or "w",
+            "wvmid": source.get("wvmId"),
+            "eid": source["elementId"],
+        })
+
+    own = _studio_keys(partstudio_urls)
+    index = {}
+    for part_id, studios in sources.items():
+        if len(studios) > 1:
+            studios = {key: location for key, location in studios.items() if key in own}
+        if len(studios) == 1:
+            index[part_id] = next(iter(studios.values()))
+    return index
+
+
+def locate_part(client, part_id, part_index, partstudio_urls, refresh=False):
+    """Find the Part Studio holding `part_id`.
+
+    Uses the persisted index first. On a miss, or with `refresh` (Onshape rejected
+    the indexed location), scans `partstudio_urls` and records every part seen
+    along the way. Returns `(location, index)`, where `index` is the updated
+    mapping to save, or None if it did not change. `location` is None when the
+    part is in none of the studios.
+    """
+    part_index = part_index or {}
+    if part_id in part_index and not refresh:
+        return part_index[part_id], None
+
+    index = dict(part_index)
+    index.pop(part_id, None)
+    for ps_url in partstudio_urls or []:
+        try:
+            element = OnshapeElement(ps_url)
+            res = client.get(f"/api/parts/d/{element.did}/{element.wvm}/{element.wvmid}/e/{element.eid}",
+                             headers={"Accept": "application/json"})
+            if res.status_code != 200:
+                continue
+            for part in res.json():
+                index.setdefault(part["partId"], {"did": element.did, "wvm": element.wvm,
+                                                  "wvmid": element.wvmid, "eid": element.eid})
+        except RateBudgetExceeded:
+            raise  # out of budget is not "part missing"; let the caller answer 429
+        except Exception as e:
+            print(f"⚠️ Failed to process {ps_url}: {e}")
+            continue
+        if part_id in index:
+            break
+    changed = index if index != part_index else None
+    return index.get(part_id), changed
+
+
+def build_system_bom(system, max_concurrency, report=None):
+    """Download and flatten the Onshape BOM for a system.
+
+    The whole hierarchy comes back in one indented BOM response, so subassemblies
+    need no extra calls. Returns `(final_bom, thumbnail_url)` without touching the
+    database, so the caller decides when to save. `report(stage, percent)` is called
+    as each stage starts.
+    """
+    report = report or (lambda stage, percent: None)
+    client = make_client(system.access_key, system.secret_key)
+
+    # Load previous progress
+    old_bom_by_id = {p.get("partId"): p for p in system.bom_entries()}
+
+    # === Parse base document ===
+    assembly_url = system.assembly_url
+    did = OnshapeElement(assembly_url).did
+
+    # === Indented BOM and thumbnail are independent ===
+    report("main_bom", 10)
+    main_json, thumbnail_url = run_concurrently([
+        lambda: fetch_bom_from_url(client, assembly_url),
+        lambda: fetch_thumbnail_url(client, did),
+    ], system.access_key, system.secret_key, max_concurrency)
+    print(f"🖼️ Thumbnail URL: {thumbnail_url}", flush=True)
+
+    # === Flatten subassemblies ===
+    report("flatten", 60)
+    final_bom = flatten_indented_bom(main_json, old_bom_by_id)
+    print(f"✅ Final BOM has {len(final_bom)} parts", flush=True)
+    return final_bom, thumbnail_url, build_part_index(main_json, system.partstudio_urls)
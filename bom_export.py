@@ -0,0 +1,83 @@
+import io
+
+import pandas as pd
+
+from models import db, Team, Robot, System, BomItem, MAIN_SYSTEM
+
+CHUNK_SIZE = 64 * 1024
+CSV_ROWS_PER_CHUNK = 5000
+
+# Formats we can produce -> (mimetype, file extension)
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),  # written by pandas through pyarrow
+}
+
+TEXT_COLUMNS = ["Part Name", "Description", "Material", "materialBOM", "Pre Process", "Process 1", "Process 2",
+                "partId"]
+COUNT_COLUMNS = ["Quantity", "done_preprocess", "done_process1", "done_process2", "available_qty"]
+EXPORT_COLUMNS = ["Team", "Robot", "System"] + TEXT_COLUMNS + COUNT_COLUMNS
+
+
+def _counts(values):
+    """Whole numbers as nullable Int64; anything unparseable or fractional becomes NA."""
+    numeric = pd.to_numeric(values, errors="coerce").astype("float64")
+    return numeric.where(numeric % 1 == 0).astype("Int64")
+
+
+def bom_frame(team_id, robot_id=None, system_id=None):
+    """Typed DataFrame of a team's BOM rows, optionally narrowed to one robot or one system.
+
+    Rows are read with a single column query and assembled column-wise: values that
+    did not fit a BomItem column (Material dicts stored without a name, counts that
+    are not whole numbers) are recovered from `extra` with `json_normalize` and merged in.
+    """
+    fields = [(key, getattr(BomItem, BomItem.FIELDS[key][0])) for key in TEXT_COLUMNS + COUNT_COLUMNS]
+    query = (db.session.query(Team.team_number, Robot.name, System.name, *[c for _, c in fields], BomItem.extra)
+             .join(Robot, Robot.team_id == Team.id)
+             .join(System, System.robot_id == Robot.id)
+             .join(BomItem, BomItem.system_id == System.id)
+             .filter(Team.id == team_id))
+    if robot_id is not None:
+        query = query.filter(Robot.id == robot_id)
+    if system_id is not None:
+        query = query.filter(System.id == system_id)
+    else:
+        query = query.filter(System.name != MAIN_SYSTEM)  # placeholder; its rows copy the other systems
+    rows = query.order_by(Robot.id, System.id, BomItem.position).all()
+
+    df = pd.DataFrame.from_records(rows, columns=["Team", "Robot", "System"] + [k for k, _ in fields] + ["extra"])
+    extra = pd.json_normalize([e or {} for e in df.pop("extra")]).reindex(df.index)
+
+    for key in ("Material", "materialBOM"):
+        for flat in (key, f"{key}.displayName"):
+            if flat in extra:
+                df[key] = df[key].fillna(extra[flat].where(extra[flat].map(type) == str))
+    for key in COUNT_COLUMNS:
+        values = df[key]
+        if key in extra:
+            values = pd.to_numeric(values, errors="coerce").fillna(pd.to_numeric(extra[key], errors="coerce"))
+        df[key] = _counts(values)
+    df["Team"] = df["Team"].astype("Int64")
+    for key in ["Robot", "System"] + TEXT_COLUMNS:
+        df[key] = df[key].astype("string")
+    return df[EXPORT_COLUMNS]
+
+
+def stream_csv(df):
+    """Yield the frame as CSV, a few thousand rows at a time."""
+    for start in range(0, max(len(df), 1), CSV_ROWS_PER_CHUNK):
+        yield df.iloc[start:start + CSV_ROWS_PER_CHUNK].to_csv(index=False, header=start == 0)
+
+
+def stream_parquet(df):
+    """Yield the frame as a Parquet file. Parquet's footer needs the whole file, so it is built first."""
+    buf = io.BytesIO()
+    df.to_parquet(buf, index=False)
+    view = buf.getbuffer()
+    for start in range(0, len(view), CHUNK_SIZE):
+        yield bytes(view[start:start + CHUNK_SIZE])
+
+
+def stream_export(df, fmt):
+    return stream_parquet(df) if fmt == "parquet" else stream_csv(df)
@@ -0,0 +1,207 @@
+import base64
+import json
+
+from sqlalchemy import and_, func, not_, or_
+
+from models import db, Team, Robot, System, BomItem
+
+MAX_PAGE_SIZE = 500
+# Rows fetched per round trip, and bytes buffered per chunk, when streaming exports
+STREAM_BATCH = 500
+STREAM_CHUNK = 64 * 1024
+
+SORT_KEYS = ("position", "name", "quantity", "material")
+
+
+def _material(model):
+    """The material a part is shown and exported under: materialBOM, falling back to Material."""
+    return func.trim(func.coalesce(func.nullif(model.material_bom, ""), model.material, ""))
+
+
+def _sort_exprs(model, key):
+    """Expressions a sort key orders on, before the id tie-breaker."""
+    if key == "position":
+        return model.system_id, model.position
+    if key == "name":
+        return func.lower(func.coalesce(model.name, "")),
+    if key == "quantity":
+        return func.coalesce(model.quantity, 0),
+    return func.lower(_material(model)),
+
+
+def _blank(column):
+    return func.upper(func.trim(func.coalesce(column, ""))).in_(["", "N/A"])
+
+
+def _process_filter(model, process):
+    """Same rules as `cad_export.part_matches`: COTS, InHouse or a machine name."""
+    columns = (model.pre_process, model.process1, model.process2)
+    is_cots = and_(*[_blank(c) for c in columns])
+    if process == "COTS":
+        return is_cots
+    if process == "InHouse":
+        return not_(is_cots)
+    return or_(*[func.trim(c) == process for c in columns])
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def _after(columns, values):
+    """Keyset condition: rows strictly after `values` in the order given by `columns`.
+
+    `columns` is a list of `(expression, descending)`.
+    """
+    clauses = []
+    for i, (column, descending) in enumerate(columns):
+        equal = [c == v for (c, _), v in zip(columns[:i], values[:i])]
+        beyond = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*equal, beyond))
+    return or_(*clauses)
+
+
+def query_bom(model, scope, process=None, material=None, search=None, sort="position", cursor=None, limit=None):
+    """Filter, sort and page BOM rows in the database.
+
+    `model` is `BomItem` or `RobotBomItem` and `scope` the clause selecting whose
+    rows to read. `sort` is one of `SORT_KEYS`, prefixed with "-" for descending
+    order. Pages are addressed by the opaque `next_cursor` of the previous page;
+    without a `limit` the whole filtered BOM is returned. Raises ValueError on bad
+    arguments.
+
+    Returns `{"bom_data", "total", "next_cursor", "materials"}`, where `materials`
+    lists the materials of the parts matching every filter except `material`.
+    """
+    descending = sort.startswith("-")
+    if sort.lstrip("-") not in SORT_KEYS:
+        raise ValueError(f"Unknown sort key '{sort}'")
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    exprs = _sort_exprs(model, sort.lstrip("-"))
+    mat = _material(model)
+
+    filters = [scope]
+    if process:
+        filters.append(_process_filter(model, process))
+    if search:
+        escaped = search.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        filters.append(model.name.ilike(f"%{escaped}%", escape="\\"))
+
+    materials = [m for (m,) in db.session.query(mat).filter(*filters).distinct().order_by(mat) if m]
+    if material is not None:
+        filters.append(mat == material.strip())
+    total = model.query.filter(*filters).count()
+
+    columns = [(e, descending) for e in exprs] + [(model.id, False)]
+    query = db.session.query(model, *exprs).filter(*filters)
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(columns):
+            raise ValueError("Invalid cursor")
+        query = query.filter(_after(columns, values))
+    query = query.order_by(*[c.desc() if d else c for c, d in columns])
+    rows = query.limit(limit + 1).all() if limit else query.all()
+
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        item, *keys = rows[-1]
+        next_cursor = encode_cursor(keys + [item.id])
+    return {
+        "bom_data": [row[0].to_entry() for row in rows],
+        "total": total,
+        "next_cursor": next_cursor,
+        "materials": materials,
+    }
+
+
+def _buffered(pieces):
+    """Join small string pieces into chunks of roughly `STREAM_CHUNK` bytes."""
+    buf = []
+    size = 0
+    for piece in pieces:
+        buf.append(piece)
+        size += len(piece)
+        if size >= STREAM_CHUNK:
+            yield "".join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield "".join(buf)
+
+
+def stream_bom_list(team_id, system_name=None):
+    """Yield `{"bom_data": [...]}` for a team's systems (all of them, or those named `system_name`).
+
+    One query, read in batches, so memory stays flat however large the team is.
+    """
+    query = (BomItem.query.join(System, BomItem.system_id == System.id)
+             .join(Robot, System.robot_id == Robot.id)
+             .filter(Robot.team_id == team_id))
+    if system_name is not None:
+        query = query.filter(System.name == system_name)
+    query = query.order_by(Robot.id, System.id, BomItem.position).yield_per(STREAM_BATCH)
+
+    def pieces():
+        yield '{"bom_data": ['
+        for i, item in enumerate(query):
+            yield ("," if i else "") + json.dumps(item.to_entry())
+        yield "]}"
+    return _buffered(pieces())
+
+
+def stream_bom_dict():
+    """Yield `{"bom_data_dict": {team_number: {robot: {system: [...]}}}}` for every team.
+
+    Teams, robots, systems and BOM rows come from a single outer-joined query in
+    hierarchy order, read in batches; containers are opened and closed as the ids
+    change, so no level of the dictionary is ever built in memory.
+    """
+    query = (db.session.query(Team.id, Team.team_number, Robot.id, Robot.name, System.id, System.name, BomItem)
+             .select_from(Team)
+             .outerjoin(Robot, Robot.team_id == Team.id)
+             .outerjoin(System, System.robot_id == Robot.id)
+             .outerjoin(BomItem, BomItem.system_id == System.id)
+             .order_by(Team.id, Robot.id, System.id, BomItem.position)
+             .yield_per(STREAM_BATCH))
+
+    def pieces():
+        yield '{"bom_data_dict": {'
+        open_ids = [None, None, None]  # team, robot, system currently open
+        depth = 0                      # how many of them are open
+        first = [True, True, True, True]
+        for team_id, team_number, robot_id, robot_name, system_id, system_name, item in query:
+            ids = (team_id, robot_id, system_id)
+            labels = (team_number, robot_name, system_name)
+            level = 0
+            while level < depth and ids[level] == open_ids[level]:
+                level += 1
+            while depth > level:
+                yield "]" if depth == 3 else "}"
+                depth -= 1
+            while depth < 3 and ids[depth] is not None:
+                yield ("" if first[depth] else ",") + json.dumps(str(labels[depth])) + (": [" if depth == 2 else ": {")
+                first[depth] = False
+                open_ids[depth] = ids[depth]
+                depth += 1
+                first[depth] = True
+            if item is not None:
+                yield ("" if first[3] else ",") + json.dumps(item.to_entry())
+                first[3] = False
+        while depth > 0:
+            yield "]" if depth == 3 else "}"
+            depth -= 1
+        yield "}}"
+    return _buffered(pieces())
@@ -0,0 +1,213 @@
+import io
+import re
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from bom import document_microversion
+from file_cache import FileCache
+from translations import DEFAULT_DEADLINE, TranslationError, TranslationTimeout, tracker
+
+
+def translate_part(api, target, part_id, file_format, deadline=DEFAULT_DEADLINE):
+    """Export one part through an Onshape translation and return the streaming download response."""
+    print(f"🚀 Found part, requesting export to {file_format}")
+    r = api.post(
+        f"/api/partstudios/d/{target['did']}/{target['wvm']}/{target['wvmid']}/e/{target['eid']}/translations",
+        headers={"Accept": "application/json", "Content-Type": "application/json"},
+        json={
+            "formatName": file_format,
+            "partIds": part_id,
+            "storeInDocument": False
+        }
+    )
+
+    if r.status_code != 200:
+        print("❌ Failed to start translation:", r.status_code, r.text)
+        raise TranslationError("Failed to start translation", details=r.text, upstream_status=r.status_code)
+
+    translation_id = r.json().get("id")
+    print("🆔 Translation ID:", translation_id)
+
+    # ⏳ Wait for the shared poller to report the result
+    try:
+        result = tracker.wait(api, translation_id, deadline=deadline)
+    except TranslationTimeout:
+        raise TranslationTimeout("Export timed out")
+
+    ids = result.get("resultExternalDataIds")
+    if not ids:
+        raise TranslationError("Export completed but no file found")
+    external_id = ids[0]
+    download_url = f"/api/documents/d/{target['did']}/externaldata/{external_id}"
+    print("✅ Downloading from:", download_url)
+
+    # 🎯 Fetch the actual file
+    file_response = api.get(download_url, headers={"Accept": "application/json"}, stream=True)
+    if file_response.status_code != 200:
+        raise TranslationError("Failed to retrieve translated file", upstream_status=file_response.status_code)
+    return file_response
+
+
+def cached_translation_key(api, target, part_id, file_format):
+    """Cache key for one part export at the document's current state."""
+    microversion = document_microversion(api, target["did"], target["wvm"], target["wvmid"])
+    return FileCache.key(target["did"], microversion, target["eid"], part_id, file_format)
+
+
+def translate_part_to_cache(api, cache, target, part_id, file_format, deadline=DEFAULT_DEADLINE):
+    """Return `(path, key)` of the translated file, translating only on a cache miss."""
+    key = cached_translation_key(api, target, part_id, file_format)
+    path = cache.get(key)
+    if path:
+        print("💾 Serving cached translation:", path)
+        return path, key
+    file_response = translate_part(api, target, part_id, file_format, deadline)
+    return cache.put(key, file_response.iter_content(chunk_size=64 * 1024)), key
+
+
+def warm_part(api, cache, target, part_id, file_format, deadline=DEFAULT_DEADLINE):
+    """Make sure the translated file is in the cache. Returns "cached" or "translated"."""
+    key = cached_translation_key(api, target, part_id, file_format)
+    if cache.get(key):
+        return "cached"
+    file_response = translate_part(api, target, part_id, file_format, deadline)
+    cache.put(key, file_response.iter_content(chunk_size=64 * 1024))
+    return "translated"
+
+
+def current_process(part, qty):
+    """Process a part is waiting on next, mirroring getCurrentProcessStatus in system_detail.html."""
+    done_pre = int(part.get("done_preprocess") or 0)
+    done_p1 = int(part.get("done_process1") or 0)
+    done_p2 = int(part.get("done_process2") or 0)
+    pp = (part.get("Pre Process") or "").strip()
+    p1 = (part.get("Process 1") or "").strip()
+    p2 = (part.get("Process 2") or "").strip()
+
+    if pp and done_pre < qty:
+        return pp
+    if p1 and (not pp or done_pre >= qty) and done_p1 < qty:
+        return p1
+    if p2 and (not p1 or done_p1 >= qty) and done_p2 < qty:
+        return p2
+    return None
+
+
+def _clean_process(value):
+    return not value or value.strip().upper() == "N/A"
+
+
+def part_matches(part, process=None, material=None, part_ids=None):
+    """Apply the BOM page's filter buttons (COTS / InHouse / machine name), material and id filters."""
+    if part_ids and part.get("partId") not in part_ids:
+        return False
+    if material is not None:
+        mat = part.get("materialBOM") or part.get("Material") or ""
+        if mat.strip() != material.strip():
+            return False
+    if process:
+        is_cots = all(_clean_process(part.get(k)) for k in ("Pre Process", "Process 1", "Process 2"))
+        if process == "COTS":
+            return is_cots
+        if process == "InHouse":
+            return not is_cots
+        return process in [(part.get(k) or "").strip() for k in ("Pre Process", "Process 1", "Process 2")]
+    return True
+
+
+def _safe_name(value):
+    return re.sub(r"[^a-zA-Z0-9-_]", "_", value)
+
+
+def export_filename(part, file_format, material=None):
+    """`"<name> xQTY - <material>.<ext>"`, sanitised the same way the BOM page does."""
+    qty = int(part.get("Quantity") or 1)
+    name = _safe_name((part.get("Part Name") or "").strip()) or "Unnamed"
+    mat = _safe_name(material if material is not None else (part.get("materialBOM") or part.get("Material") or ""))
+    return f"{name} x{qty} - {mat}.{file_format.lower()}"
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only stream that hands everything written to it back as chunks."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(jobs, cache, max_workers, deadline=DEFAULT_DEADLINE):
+    """Translate parts concurrently and yield a ZIP of the results as it is built.
+
+    `jobs` is a list of `(arcname, api, target, part_id, file_format)`. Each finished
+    translation is copied from disk into the archive in 64 KiB pieces, so neither the
+    files nor the archive are ever held in memory whole. A file evicted from the cache
+    before it is read is translated once more. Parts that fail are listed in
+    `errors.txt` instead of aborting the download.
+    """
+    scratch = None
+    if not cache.enabled:
+        scratch = tempfile.mkdtemp(prefix="cad-export-")
+        cache = FileCache(scratch, 1 << 62)
+
+    sink = _ChunkSink()
+    errors = []
+    used_names = set()
+    pool = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            futures = {}
+            for arcname, api, target, part_id, file_format in jobs:
+                args = (api, cache, target, part_id, file_format, deadline)
+                futures[pool.submit(translate_part_to_cache, *args)] = arcname, args
+            for future in as_completed(futures):
+                arcname, args = futures[future]
+                try:
+                    path, _ = future.result()
+                    try:
+                        src = open(path, "rb")
+                    except FileNotFoundError:
+                        # Evicted by another worker's put since it was cached: translate it once more
+                        path, _ = translate_part_to_cache(*args)
+                        src = open(path, "rb")
+                except FileNotFoundError:
+                    errors.append(f"{arcname}: evicted from the file cache before it could be added, try again")
+                    continue
+                except Exception as e:
+                    message = e.message if isinstance(e, TranslationError) else str(e)
+                    errors.append(f"{arcname}: {message}")
+                    continue
+                base, dot, ext = arcname.rpartition(".")
+                n = 2
+                while arcname in used_names:
+                    arcname = f"{base} ({n}){dot}{ext}"
+                    n += 1
+                used_names.add(arcname)
+                with src, archive.open(arcname, "w", force_zip64=True) as dest:
+                    for chunk in iter(lambda: src.read(64 * 1024), b""):
+                        dest.write(chunk)
+                        yield sink.drain()
+                yield sink.drain()
+            if errors:
+                archive.writestr("errors.txt", "\n".join(errors) + "\n")
+        yield sink.drain()
+    except GeneratorExit:
+        # The client went away: drop queued translations instead of running them for nobody
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    finally:
+        pool.shutdown(wait=False)
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
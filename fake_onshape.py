@@ -0,0 +1,330 @@
+"""Local stand-in for the parts of the Onshape REST API this app calls.
+
+Used for offline development and benchmarks: start it, set
+ONSHAPE_BASE_URL=http://127.0.0.1:5001 for the app, and point a system's
+assembly / part studio URLs at http://127.0.0.1:5001/documents/<did>/w/<wid>/e/<eid>.
+Assembly elements return a synthetic indented BOM; part studios are named
+PS0..PS<n>, and every part in the BOM lives in one of them.
+
+    python fake_onshape.py --port 5001 --parts 500 --latency-ms 150 --failure-rate 0.02
+
+Behaviour can also be changed at runtime with POST /_fake/config (same keys as
+DEFAULTS), per-endpoint call counts read from GET /_fake/stats, counters cleared
+with POST /_fake/reset, and the document "edited" with POST /_fake/touch.
+"""
+import argparse
+import base64
+import json
+import math
+import random
+import struct
+import threading
+import time
+import uuid
+from collections import Counter
+
+from flask import Flask, Response, jsonify, request
+
+DEFAULTS = {
+    "latency_ms": 0,  # added to every /api call
+    "jitter_ms": 0,  # random extra latency, 0..jitter_ms
+    "failure_rate": 0.0,  # fraction of /api calls answered with 503
+    "rate_limit_rate": 0.0,  # fraction of /api calls answered with 429 + Retry-After
+    "retry_after": 1,
+    "parts": 50,  # leaf parts in the synthetic BOM
+    "depth": 2,  # subassembly nesting depth
+    "per_assembly": 6,  # items per subassembly
+    "studios": 4,  # part studios the parts are spread across
+    "translation_seconds": 1.0,  # time before a translation reports DONE
+    "translation_failure_rate": 0.0,
+    "file_bytes": 200_000,  # size of a translated part file
+    "gltf_triangles": 2_000,  # triangles in a part GLTF at chordTolerance=0.05
+}
+
+PROCESSES = ["", "CNC", "Lathe", "3D Print", "Laser Cutter"]
+MATERIALS = ["Aluminum - 6061", "Polycarbonate", "Steel", "PLA", "Delrin"]
+
+
+def part_id(i):
+    return f"J{i:05d}"
+
+
+def studio_of(i, studios):
+    return f"PS{i % studios}"
+
+
+def build_bom(did, wid, config):
+    """Synthetic indented BOM in the shape of /api/v10/assemblies/.../bom."""
+    headers = [
+        {"id": "h-item", "name": "Item"},
+        {"id": "h-name", "name": "Name"},
+        {"id": "h-desc", "name": "Description"},
+        {"id": "h-qty", "name": "Quantity"},
+        {"id": "h-mat", "name": "Material"},
+        {"id": "h-pre", "name": "Pre Process"},
+        {"id": "h-p1", "name": "Process 1"},
+        {"id": "h-p2", "name": "Process 2"},
+    ]
+    rows = []
+    remaining = [int(config["parts"])]
+    counter = [0]
+    depth = int(config["depth"])
+    per_assembly = max(2, int(config["per_assembly"]))
+    studios = max(1, int(config["studios"]))
+
+    def part_row(level, item):
+        i = counter[0]
+        counter[0] += 1
+        remaining[0] -= 1
+        material = MATERIALS[i % len(MATERIALS)]
+        return {
+            "indentLevel": level,
+            "headerIdToValue": {
+                "h-item": item,
+                "h-name": f"Part {i}",
+                "h-desc": f"Synthetic part {i}",
+                "h-qty": 1 + i % 3,
+                "h-mat": {"displayName": material} if i % 2 else material,
+                "h-pre": "Saw" if i % 5 == 0 else "",
+                "h-p1": PROCESSES[i % len(PROCESSES)],
+                "h-p2": "Tap" if i % 7 == 0 else "",
+            },
+            "itemSource": {
+                "documentId": did,
+                "wvmType": "w",
+                "wvmId": wid,
+                "elementId": studio_of(i, studios),
+                "partId": part_id(i),
+            },
+        }
+
+    def emit(level, prefix, slots):
+        k = 0
+        while remaining[0] > 0 and (slots is None or k < slots):
+            item = f"{prefix}{k + 1}"
+            if level < depth and k % 3 == 2:
+                rows.append({
+                    "indentLevel": level,
+                    "headerIdToValue": {"h-item": item, "h-name": f"Subassembly {item}", "h-qty": 2},
+                    "itemSource": {"documentId": did, "wvmType": "w", "wvmId": wid,
+                                   "elementId": f"ASM{item}", "partId": ""},
+                })
+                emit(level + 1, item + ".", per_assembly)
+            else:
+                rows.append(part_row(level, item))
+            k += 1
+
+    emit(0, "", None)
+    return {"headers": headers, "rows": rows}
+
+
+def build_mesh(triangles):
+    """Cylinder mesh with roughly `triangles` triangles: positions, normals, indices."""
+    segments = max(8, int(math.sqrt(triangles / 2)))
+    rings = max(1, triangles // (2 * segments))
+    positions, normals, indices = [], [], []
+    for r in range(rings + 1):
+        z = 0.05 * r / rings
+        for s in range(segments):
+            a = 2 * math.pi * s / segments
+            positions += [0.02 * math.cos(a), 0.02 * math.sin(a), z]
+            normals += [math.cos(a), math.sin(a), 0.0]
+    for r in range(rings):
+        for s in range(segments):
+            a = r * segments + s
+            b = r * segments + (s + 1) % segments
+            c, d = a + segments, b + segments
+            indices += [a, b, c, b, d, c]
+    return positions, normals, indices
+
+
+def build_gltf(mesh_names, triangles):
+    """Text GLTF with base64 data-URI buffers, one node per name, like Onshape's export."""
+    positions, normals, indices = build_mesh(triangles)
+    pos = struct.pack(f"<{len(positions)}f", *positions)
+    nrm = struct.pack(f"<{len(normals)}f", *normals)
+    idx = struct.pack(f"<{len(indices)}I", *indices)
+    blob = pos + nrm + idx
+    xs, ys, zs = positions[0::3], positions[1::3], positions[2::3]
+    count = len(positions) // 3
+    return {
+        "asset": {"version": "2.0", "generator": "fake_onshape"},
+        "scene": 0,
+        "scenes": [{"nodes": list(range(len(mesh_names)))}],
+        "nodes": [{"name": name, "mesh": 0, "translation": [0.05 * i, 0, 0], "extras": {"partId": name}}
+                  for i, name in enumerate(mesh_names)],
+        "meshes": [{"primitives": [{"attributes": {"POSITION": 0, "NORMAL": 1}, "indices": 2, "material": 0}]}],
+        "materials": [{"pbrMetallicRoughness": {"baseColorFactor": [0.7, 0.7, 0.75, 1.0]}}],
+        "buffers": [{"byteLength": len(blob),
+                     "uri": "data:application/octet-stream;base64," + base64.b64encode(blob).decode("ascii")}],
+        "bufferViews": [
+            {"buffer": 0, "byteOffset": 0, "byteLength": len(pos), "target": 34962},
+            {"buffer": 0, "byteOffset": len(pos), "byteLength": len(nrm), "target": 34962},
+            {"buffer": 0, "byteOffset": len(pos) + len(nrm), "byteLength": len(idx), "target": 34963},
+        ],
+        "accessors": [
+            {"bufferView": 0, "componentType": 5126, "count": count, "type": "VEC3",
+             "min": [min(xs), min(ys), min(zs)], "max": [max(xs), max(ys), max(zs)]},
+            {"bufferView": 1, "componentType": 5126, "count": count, "type": "VEC3"},
+            {"bufferView": 2, "componentType": 5125, "count": len(indices), "type": "SCALAR"},
+        ],
+    }
+
+
+def create_app(**overrides):
+    app = Flask(__name__)
+    config = dict(DEFAULTS, **overrides)
+    stats = Counter()
+    translations = {}
+    state = {"microversion": 1}
+    lock = threading.Lock()
+
+    @app.before_request
+    def simulate_network():
+        if not request.path.startswith("/api/"):
+            return None
+        with lock:
+            stats[request.endpoint or request.path] += 1
+            stats["total"] += 1
+        delay = config["latency_ms"] + random.uniform(0, config["jitter_ms"])
+        if delay:
+            time.sleep(delay / 1000.0)
+        roll = random.random()
+        if roll < config["rate_limit_rate"]:
+            return Response("rate limited", status=429, headers={"Retry-After": str(config["retry_after"])})
+        if roll < config["rate_limit_rate"] + config["failure_rate"]:
+            return Response("injected failure", status=503)
+        return None
+
+    @app.route("/api/v10/assemblies/d/<did>/<wvm>/<wvmid>/e/<eid>/bom")
+    def assembly_bom(did, wvm, wvmid, eid):
+        return jsonify(build_bom(did, wvmid, config))
+
+    @app.route("/api/v12/documents/d/<did>/w/<wid>/contents")
+    def document_contents(did, wid):
+        elements = [{"id": f"PS{i}", "name": f"Part Studio {i}", "elementType": "PARTSTUDIO"}
+                    for i in range(int(config["studios"]))]
+        elements.append({"id": "ASM", "name": "Assembly", "elementType": "ASSEMBLY"})
+        return jsonify({"elements": elements})
+
+    @app.route("/api/v12/documents/<did>")
+    def document_metadata(did):
+        href = f"{request.host_url}thumbnails/{did}.png"
+        return jsonify({"id": did, "name": f"Document {did}",
+                        "thumbnail": {"href": href, "sizes": [{"size": "300x170", "href": href}]}})
+
+    @app.route("/api/v6/documents/d/<did>/w/<wid>/currentmicroversion")
+    def current_microversion(did, wid):
+        return jsonify({"microversion": f"mv{state['microversion']:06d}"})
+
+    @app.route("/api/parts/d/<did>/<wvm>/<wvmid>/e/<eid>")
+    def parts_list(did, wvm, wvmid, eid):
+        studios = max(1, int(config["studios"]))
+        return jsonify([{"partId": part_id(i), "name": f"Part {i}", "elementId": eid}
+                        for i in range(int(config["parts"])) if studio_of(i, studios) == eid])
+
+    def in_studio(pid, eid):
+        """Like Onshape, only answer for a part in the studio that actually holds it."""
+        studios = max(1, int(config["studios"]))
+        return any(part_id(i) == pid and studio_of(i, studios) == eid for i in range(int(config["parts"])))
+
+    def start_translation(did, kind, payload):
+        translation_id = uuid.uuid4().hex
+        failed = random.random() < config["translation_failure_rate"]
+        with lock:
+            translations[translation_id] = {"did": did, "kind": kind, "payload": payload,
+                                            "ready_at": time.time() + config["translation_seconds"],
+                                            "failed": failed}
+        return jsonify({"id": translation_id, "requestState": "ACTIVE"})
+
+    @app.route("/api/partstudios/d/<did>/<wvm>/<wvmid>/e/<eid>/translations", methods=["POST"])
+    def partstudio_translation(did, wvm, wvmid, eid):
+        if not in_studio((request.get_json(silent=True) or {}).get("partIds"), eid):
+            return jsonify({"message": "Part not found"}), 404
+        return start_translation(did, "part", request.get_json(silent=True) or {})
+
+    @app.route("/api/v12/assemblies/d/<did>/<wvm>/<wvmid>/e/<eid>/export/gltf", methods=["POST"])
+    def assembly_gltf_export(did, wvm, wvmid, eid):
+        return start_translation(did, "gltf", request.get_json(silent=True) or {})
+
+    @app.route("/api/translations/<translation_id>")
+    @app.route("/api/v12/translations/<translation_id>")
+    def translation_status(translation_id):
+        job = translations.get(translation_id)
+        if job is None:
+            return jsonify({"message": "Not found"}), 404
+        if time.time() < job["ready_at"]:
+            return jsonify({"id": translation_id, "requestState": "ACTIVE"})
+        if job["failed"]:
+            return jsonify({"id": translation_id, "requestState": "FAILED", "failureReason": "injected"})
+        return jsonify({"id": translation_id, "requestState": "DONE",
+                        "resultExternalDataIds": [translation_id]})
+
+    @app.route("/api/documents/d/<did>/externaldata/<fid>")
+    def external_data(did, fid):
+        job = translations.get(fid)
+        if job is None:
+            return jsonify({"message": "Not found"}), 404
+        if job["kind"] == "gltf":
+            names = [part_id(i) for i in range(min(int(config["parts"]), 40))]
+            body = json.dumps(build_gltf(names, int(config["gltf_triangles"]))).encode("utf-8")
+            return Response(body, content_type="model/gltf+json")
+        size = int(config["file_bytes"])
+        chunk = (b"ISO-10303-21; synthetic part data\n" * 2048)[:65536]
+
+        def generate():
+            sent = 0
+            while sent < size:
+                piece = chunk[:size - sent]
+                sent += len(piece)
+                yield piece
+
+        return Response(generate(), content_type="application/octet-stream",
+                        headers={"Content-Length": str(size)})
+
+    @app.route("/api/v12/parts/d/<did>/<wvm>/<wvmid>/e/<eid>/partid/<pid>/gltf")
+    def part_gltf(did, wvm, wvmid, eid, pid):
+        if not in_studio(pid, eid):
+            return jsonify({"message": "Part not found"}), 404
+        chord = float(request.args.get("chordTolerance", 0.05) or 0.05)
+        triangles = int(config["gltf_triangles"] * min(20.0, max(0.05, 0.05 / chord)))
+        return jsonify(build_gltf([pid], triangles))
+
+    @app.route("/_fake/config", methods=["GET", "POST"])
+    def fake_config():
+        if request.method == "POST":
+            for key, value in (request.get_json(silent=True) or {}).items():
+                if key in DEFAULTS:
+                    config[key] = type(DEFAULTS[key])(value)
+        return jsonify(config)
+
+    @app.route("/_fake/stats")
+    def fake_stats():
+        return jsonify(dict(stats))
+
+    @app.route("/_fake/reset", methods=["POST"])
+    def fake_reset():
+        stats.clear()
+        return jsonify({"ok": True})
+
+    @app.route("/_fake/touch", methods=["POST"])
+    def fake_touch():
+        state["microversion"] += 1
+        return jsonify({"microversion": f"mv{state['microversion']:06d}"})
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Onshape API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    for key, value in DEFAULTS.items():
+        parser.add_argument("--" + key.replace("_", "-"), type=type(value), default=value)
+    args = parser.parse_args()
+    overrides = {key: getattr(args, key) for key in DEFAULTS}
+    create_app(**overrides).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+
+class FileCache:
+    """Size-capped on-disk cache of generated files, evicted least-recently-used first.
+
+    Entries are addressed by a hash of everything that determines their content, so
+    an entry never changes once written and its key doubles as a strong ETag. The
+    file's mtime records its last use. A `max_bytes` of 0 disables the cache.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """Return the path of a cached entry (marking it as used), or None."""
+        if not self.enabled:
+            return None
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, chunks):
+        """Write an iterable of byte chunks as the entry for `key` and return its path.
+
+        Chunks go straight to a temporary file which is renamed into place once
+        complete, so readers never see a partial entry.
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                for chunk in chunks:
+                    if chunk:
+                        tmp.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self.evict(keep=key)
+        return path
+
+    def evict(self, keep=None):
+        """Delete least recently used entries until the cache fits in `max_bytes`."""
+        with self._lock:
+            entries = []
+            total = 0
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if name.startswith(".tmp-"):
+                        continue
+                    full = os.path.join(root, name)
+                    try:
+                        st = os.stat(full)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, name, full))
+                    total += st.st_size
+            entries.sort()
+            for _, size, name, full in entries:
+                if total <= self.max_bytes:
+                    break
+                if name == keep:
+                    continue
+                try:
+                    os.remove(full)
+                    total -= size
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,478 @@
+import base64
+import json
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+from file_cache import FileCache
+
+try:
+    import brotli  # optional: `pip install Brotli` to serve br as well as gzip
+except ImportError:
+    brotli = None
+
+CHUNK_SIZE = 64 * 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 9
+
+# Content-Encodings we can produce, best first
+ENCODINGS = (["br"] if brotli else []) + ["gzip"]
+
+# Onshape tessellation settings per viewer level of detail (smaller = more detail)
+VIEWER_LODS = {
+    "coarse": {"angleTolerance": 1.2, "chordTolerance": 0.2, "maxFacetWidth": 0.5},
+    "fine": {"angleTolerance": 0.5, "chordTolerance": 0.05, "maxFacetWidth": 0.1},
+}
+
+
+class GltfFetchError(Exception):
+    def __init__(self, status, url, details):
+        super().__init__(f"GLTF fetch failed ({status})")
+        self.status = status
+        self.url = url
+        self.details = details
+
+
+class SingleFlight:
+    """Run a call at most once per key at a time; callers arriving meanwhile share its outcome."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event()}
+        if not leader:
+            call["done"].wait()
+            if "error" in call:
+                raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call["done"].set()
+
+
+def part_gltf_path(target, part_id, lod="fine"):
+    """Onshape URL path tessellating one part at the given viewer level of detail."""
+    tessellation = "".join(f"&{name}={value}" for name, value in VIEWER_LODS[lod].items())
+    return (
+        f"/api/v12/parts/d/{target['did']}/{target['wvm']}/{target['wvmid']}/e/{target['eid']}"
+        f"/partid/{part_id}/gltf"
+        f"?rollbackBarIndex=-1"
+        f"&outputSeparateFaceNodes=false"
+        f"&outputFaceAppearances=false"
+        f"{tessellation}"
+    )
+
+
+def fetch_part_gltf(api, cache, flights, target, part_id, lod, microversion):
+    """Tessellate a part into `cache` unless it is there already, and return its cache key.
+
+    Concurrent requests for the same entry share one Onshape call through `flights`.
+    Raises GltfFetchError if Onshape refuses.
+    """
+    url = part_gltf_path(target, part_id, lod)
+    key = FileCache.key(target["did"], microversion, target["eid"], part_id, url, "gltf")
+    if cache.get(key):
+        return key
+
+    def fetch():
+        if cache.get(key):
+            return key
+        res = api.get(url, headers={"Accept": "*/*"}, stream=True)
+        if res.status_code != 200:
+            raise GltfFetchError(res.status_code, url, res.text)
+        cache.put(key, res.iter_content(chunk_size=CHUNK_SIZE))
+        return key
+
+    return flights.do(key, fetch)
+
+
+def _read_chunks(path):
+    with open(path, "rb") as f:
+        yield from iter(lambda: f.read(CHUNK_SIZE), b"")
+
+
+def _compress(path, encoding):
+    """Yield the file at `path` compressed with `encoding`, one chunk at a time."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in _read_chunks(path):
+            yield compressor.process(chunk)
+        yield compressor.finish()
+    elif encoding == "gzip":
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31: gzip container
+        for chunk in _read_chunks(path):
+            yield compressor.compress(chunk)
+        yield compressor.flush()
+    else:
+        raise ValueError(f"Unsupported encoding '{encoding}'")
+
+
+def encoded_variant(cache, key, encoding):
+    """Return `(path, etag)` of the cached entry `key` in the given Content-Encoding.
+
+    Compressed copies are cached as entries of their own, made on first request from
+    the identity entry. Returns None if the identity entry is not cached.
+    """
+    path = cache.get(key)
+    if not path:
+        return None
+    if encoding in (None, "identity"):
+        return path, key
+    variant = FileCache.key(key, encoding)
+    variant_path = cache.get(variant) or cache.put(variant, _compress(path, encoding))
+    return variant_path, variant
+
+
+# --- GLTF -> quantized GLB ---------------------------------------------------
+
+GLB_MAGIC = b"glTF"
+GLB_VERSION = 2
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+TRIANGLES = 4
+
+COMPONENT_DTYPES = {5120: "i1", 5121: "u1", 5122: "<i2", 5123: "<u2", 5125: "<u4", 5126: "<f4"}
+TYPE_SIZES = {"SCALAR": 1, "VEC2": 2, "VEC3": 3, "VEC4": 4, "MAT2": 4, "MAT3": 9, "MAT4": 16}
+
+
+def _pad4(n):
+    return (n + 3) & ~3
+
+
+def _decode_buffers(doc):
+    buffers = []
+    for buffer in doc.get("buffers", []):
+        uri = buffer.get("uri", "")
+        if not uri.startswith("data:"):
+            raise ValueError("Only GLTF with embedded data-URI buffers can be converted")
+        buffers.append(base64.b64decode(uri.split(",", 1)[1]))
+    return buffers
+
+
+def _read_accessor(accessors, views, buffers, index):
+    """Accessor data as a `(count, components)` array; normalized integers come back as floats."""
+    accessor = accessors[index]
+    if "sparse" in accessor or "bufferView" not in accessor:
+        raise ValueError("Sparse or bufferless accessors are not supported")
+    view = views[accessor["bufferView"]]
+    dtype = np.dtype(COMPONENT_DTYPES[accessor["componentType"]])
+    comps = TYPE_SIZES[accessor["type"]]
+    count = accessor["count"]
+    stride = view.get("byteStride") or dtype.itemsize * comps
+    offset = view.get("byteOffset", 0) + accessor.get("byteOffset", 0)
+    data = np.ndarray(shape=(count, comps), dtype=dtype, buffer=buffers[view["buffer"]], offset=offset,
+                      strides=(stride, dtype.itemsize)).copy()
+    if accessor.get("normalized") and dtype.kind in "iu":
+        data = np.maximum(data / float(np.iinfo(dtype).max), -1.0)
+    return data
+
+
+def _index_type(vertex_count):
+    if vertex_count <= 0xFF:
+        return "u1", 5121
+    if vertex_count <= 0xFFFF:
+        return "<u2", 5123
+    return "<u4", 5125
+
+
+def _quantize_mesh(accessors, views, buffers, mesh, emit):
+    """Quantize every primitive of `mesh` in place, calling `emit` for each new accessor.
+
+    Positions become normalized SHORT relative to the mesh's bounding box and normals
+    normalized BYTE. Vertices that end up identical are welded, unused vertices are
+    dropped and indices use the smallest type that fits. Returns the
+    `(translation, scale)` that maps the stored positions back to model space, or None
+    when the mesh has something other than plain triangles and is left alone.
+    """
+    primitives = mesh.get("primitives", [])
+    if not primitives or any(p.get("mode", TRIANGLES) != TRIANGLES or p.get("targets") or
+                             "POSITION" not in p.get("attributes", {}) for p in primitives):
+        return None
+
+    decoded = []
+    for prim in primitives:
+        attrs = {name: _read_accessor(accessors, views, buffers, idx) for name, idx in prim["attributes"].items()}
+        if "indices" in prim:
+            indices = _read_accessor(accessors, views, buffers, prim["indices"])[:, 0].astype(np.int64)
+        else:
+            indices = np.arange(len(attrs["POSITION"]), dtype=np.int64)
+        decoded.append((prim, attrs, indices))
+
+    positions = [a["POSITION"] for _, a, _ in decoded if len(a["POSITION"])]
+    if not positions:
+        return None
+    lo = np.min([p.min(axis=0) for p in positions], axis=0)
+    hi = np.max([p.max(axis=0) for p in positions], axis=0)
+    center = (lo + hi) / 2.0
+    scale = float(max((hi - lo).max() / 2.0, 1e-9))
+
+    for prim, attrs, indices in decoded:
+        qpos = np.rint((attrs["POSITION"] - center) / scale * 32767).clip(-32767, 32767).astype("<i2")
+        qnrm = None
+        if "NORMAL" in attrs:
+            normals = attrs["NORMAL"]
+            lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+            normals = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+            qnrm = np.rint(normals * 127).clip(-127, 127).astype("i1")
+        others = {name: np.ascontiguousarray(values, dtype="<f4")
+                  for name, values in attrs.items() if name not in ("POSITION", "NORMAL")}
+
+        # Weld vertices that became identical, then drop the ones no triangle uses
+        columns = [qpos.view(np.uint8).reshape(len(qpos), -1)]
+        if qnrm is not None:
+            columns.append(qnrm.view(np.uint8).reshape(len(qnrm), -1))
+        columns += [values.view(np.uint8).reshape(len(values), -1) for values in others.values()]
+        rows = np.ascontiguousarray(np.hstack(columns))
+        weld_key = rows.view(np.dtype((np.void, rows.shape[1]))).reshape(-1)
+        _, first, welded = np.unique(weld_key, return_index=True, return_inverse=True)
+        used, new_indices = np.unique(welded.reshape(-1)[indices], return_inverse=True)
+        source = first[used]
+        new_indices = new_indices.reshape(-1)
+        vertex_count = len(source)
+
+        qpos = qpos[source]
+        padded = np.zeros((vertex_count, 4), dtype="<i2")  # vertex attributes are 4-byte aligned
+        padded[:, :3] = qpos
+        prim["attributes"]["POSITION"] = emit(padded.tobytes(), {
+            "componentType": 5122, "normalized": True, "count": vertex_count, "type": "VEC3",
+            "min": qpos.min(axis=0).tolist(), "max": qpos.max(axis=0).tolist(),
+        }, ARRAY_BUFFER, byte_stride=8)
+        if qnrm is not None:
+            padded = np.zeros((vertex_count, 4), dtype="i1")
+            padded[:, :3] = qnrm[source]
+            prim["attributes"]["NORMAL"] = emit(padded.tobytes(), {
+                "componentType": 5120, "normalized": True, "count": vertex_count, "type": "VEC3",
+            }, ARRAY_BUFFER, byte_stride=4)
+        for name, values in others.items():
+            prim["attributes"][name] = emit(values[source].tobytes(), {
+                "componentType": 5126, "count": vertex_count, "type": accessors[prim["attributes"][name]]["type"],
+            }, ARRAY_BUFFER)
+
+        index_dtype, component = _index_type(vertex_count)
+        prim["indices"] = emit(new_indices.astype(index_dtype).tobytes(), {
+            "componentType": component, "count": int(len(new_indices)), "type": "SCALAR",
+        }, ELEMENT_ARRAY_BUFFER)
+    return center.tolist(), scale
+
+
+def filter_scene(doc, part_ids):
+    """Drop every node whose `extras.partId` is not in `part_ids`, with its subtree.
+
+    Nodes left with nothing to draw and meshes no longer referenced go too. Scenes
+    with skins or animations (which point at nodes by index) are left untouched.
+    """
+    if not part_ids or doc.get("skins") or doc.get("animations"):
+        return doc
+    keep = set(part_ids)
+    nodes = doc.get("nodes", [])
+    new_nodes = []
+    remap = {}
+
+    def visit(index):
+        if index in remap:
+            return remap[index]
+        node = nodes[index]
+        part_id = (node.get("extras") or {}).get("partId")
+        result = None
+        if not part_id or part_id in keep:
+            children = [c for c in (visit(child) for child in node.get("children", [])) if c is not None]
+            if children or "mesh" in node or "camera" in node:
+                node = dict(node)
+                node.pop("children", None)
+                if children:
+                    node["children"] = children
+                new_nodes.append(node)
+                result = len(new_nodes) - 1
+        remap[index] = result
+        return result
+
+    for scene in doc.get("scenes", []):
+        scene["nodes"] = [n for n in (visit(i) for i in scene.get("nodes", [])) if n is not None]
+
+    used_meshes = sorted({node["mesh"] for node in new_nodes if "mesh" in node})
+    mesh_remap = {old: new for new, old in enumerate(used_meshes)}
+    for node in new_nodes:
+        if "mesh" in node:
+            node["mesh"] = mesh_remap[node["mesh"]]
+    doc["meshes"] = [doc["meshes"][i] for i in used_meshes]
+    doc["nodes"] = new_nodes
+    return doc
+
+
+def _repack(doc, buffers, quantize=True):
+    """Rewrite `doc` around one new binary buffer holding only the data it still uses.
+
+    With `quantize`, triangle meshes are quantized (see `_quantize_mesh`) and a
+    child node carrying the dequantizing transform is added for each use. Returns
+    the new buffer's bytes.
+    """
+    old_accessors = doc.get("accessors", [])
+    old_views = doc.get("bufferViews", [])
+
+    blob = bytearray()
+    views = []
+    accessors = []
+
+    def add_view(data, target=None, byte_stride=None):
+        blob.extend(b"\0" * (_pad4(len(blob)) - len(blob)))
+        view = {"buffer": 0, "byteOffset": len(blob), "byteLength": len(data)}
+        if target:
+            view["target"] = target
+        if byte_stride:
+            view["byteStride"] = byte_stride
+        blob.extend(data)
+        views.append(view)
+        return len(views) - 1
+
+    def emit(data, accessor, target=None, byte_stride=None):
+        accessors.append(dict(accessor, bufferView=add_view(data, target, byte_stride)))
+        return len(accessors) - 1
+
+    # Anything not re-encoded is copied over as-is, each old view and accessor once
+    copied_views = {}
+    copied_accessors = {}
+
+    def copy_view(index):
+        if index not in copied_views:
+            view = old_views[index]
+            start = view.get("byteOffset", 0)
+            copied_views[index] = add_view(buffers[view["buffer"]][start:start + view["byteLength"]],
+                                           view.get("target"), view.get("byteStride"))
+        return copied_views[index]
+
+    def copy_accessor(index):
+        if index not in copied_accessors:
+            accessor = dict(old_accessors[index])
+            if "sparse" in accessor:
+                raise ValueError("Sparse accessors are not supported")
+            if "bufferView" in accessor:
+                accessor["bufferView"] = copy_view(accessor["bufferView"])
+            accessors.append(accessor)
+            copied_accessors[index] = len(accessors) - 1
+        return copied_accessors[index]
+
+    nodes = doc.get("nodes", [])
+    skinned = {node["mesh"] for node in nodes if "mesh" in node and "skin" in node}
+    dequantize = {}
+    for mesh_index, mesh in enumerate(doc.get("meshes", [])):
+        transform = None
+        if quantize and mesh_index not in skinned:
+            transform = _quantize_mesh(old_accessors, old_views, buffers, mesh, emit)
+        if transform:
+            dequantize[mesh_index] = transform
+            continue
+        for prim in mesh.get("primitives", []):
+            prim["attributes"] = {k: copy_accessor(v) for k, v in prim["attributes"].items()}
+            if "indices" in prim:
+                prim["indices"] = copy_accessor(prim["indices"])
+            if prim.get("targets"):
+                prim["targets"] = [{k: copy_accessor(v) for k, v in t.items()} for t in prim["targets"]]
+
+    for skin in doc.get("skins", []):
+        if "inverseBindMatrices" in skin:
+            skin["inverseBindMatrices"] = copy_accessor(skin["inverseBindMatrices"])
+    for animation in doc.get("animations", []):
+        for sampler in animation.get("samplers", []):
+            sampler["input"] = copy_accessor(sampler["input"])
+            sampler["output"] = copy_accessor(sampler["output"])
+    for image in doc.get("images", []):
+        if "bufferView" in image:
+            image["bufferView"] = copy_view(image["bufferView"])
+
+    for node in list(nodes):
+        if node.get("mesh") in dequantize:
+            mesh_index = node.pop("mesh")
+            translation, scale = dequantize[mesh_index]
+            nodes.append({"mesh": mesh_index, "translation": translation, "scale": [scale] * 3})
+            node.setdefault("children", []).append(len(nodes) - 1)
+
+    doc["accessors"] = accessors
+    doc["bufferViews"] = views
+    blob.extend(b"\0" * (_pad4(len(blob)) - len(blob)))
+    doc["buffers"] = [{"byteLength": len(blob)}]
+    if dequantize:
+        for field in ("extensionsUsed", "extensionsRequired"):
+            doc[field] = sorted(set(doc.get(field, [])) | {"KHR_mesh_quantization"})
+    return bytes(blob)
+
+
+
+def gltf_to_glb(gltf_bytes, part_ids=None):
+    """Repack an Onshape text GLTF as binary GLB with KHR_mesh_quantization.
+
+    Nodes keep their names and `extras` (so `partId` still reaches three.js as
+    `userData`). A quantized mesh moves onto a new child node whose translation and
+    uniform scale undo the quantization, so the scene renders as before. With
+    `part_ids`, only those parts are kept. Raises ValueError for inputs it cannot
+    convert, such as external buffers.
+    """
+    doc = json.loads(gltf_bytes)
+    buffers = _decode_buffers(doc)
+    blob = _repack(filter_scene(doc, part_ids), buffers)
+
+    json_chunk = json.dumps(doc, separators=(",", ":")).encode("utf-8")
+    json_chunk += b" " * (_pad4(len(json_chunk)) - len(json_chunk))
+    total = 12 + 8 + len(json_chunk) + 8 + len(blob)
+    return b"".join([
+        struct.pack("<4sII", GLB_MAGIC, GLB_VERSION, total),
+        struct.pack("<II", len(json_chunk), CHUNK_JSON), json_chunk,
+        struct.pack("<II", len(blob), CHUNK_BIN), blob,
+    ])
+
+
+def filter_gltf(gltf_bytes, part_ids):
+    """Text GLTF holding only the nodes of `part_ids`, with its buffer cut down to match."""
+    doc = json.loads(gltf_bytes)
+    buffers = _decode_buffers(doc)
+    blob = _repack(filter_scene(doc, part_ids), buffers, quantize=False)
+    doc["buffers"][0]["uri"] = "data:application/octet-stream;base64," + base64.b64encode(blob).decode("ascii")
+    return json.dumps(doc, separators=(",", ":")).encode("utf-8")
+
+
+def scene_variant(cache, key, part_ids=None, glb=False):
+    """Cache key of the cached GLTF `key` cut down to `part_ids` and/or converted to GLB.
+
+    Each variant is built once from the cached original and cached itself. Returns
+    None if the original is not cached or cannot be converted.
+    """
+    part_ids = sorted(set(part_ids or []))
+    if not part_ids and not glb:
+        return key if cache.get(key) else None
+    variant = FileCache.key(key, "glb" if glb else "gltf", *part_ids) if part_ids else FileCache.key(key, "glb")
+    if cache.get(variant):
+        return variant
+    path = cache.get(key)
+    if not path:
+        return None
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        data = gltf_to_glb(data, part_ids) if glb else filter_gltf(data, part_ids)
+    except (ValueError, KeyError, IndexError) as e:
+        print(f"⚠️ GLTF conversion failed: {e}")
+        return None
+    cache.put(variant, [data])
+    return variant
+
+
+def glb_variant(cache, key):
+    """Cache key of the GLB conversion of the cached GLTF `key`, or None if that is impossible."""
+    return scene_variant(cache, key, glb=True)
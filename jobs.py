@@ -0,0 +1,107 @@
+import traceback
+import uuid
+from datetime import datetime, timedelta
+
+from models import db, Job
+
+# A queued job nobody has picked up after this long may be claimed by any worker
+CLAIM_AFTER = timedelta(seconds=30)
+# A running job that has not reported progress for this long is considered dead
+STALE_AFTER = timedelta(minutes=10)
+
+_runners = {}
+
+
+def register_runner(kind, runner):
+    """Register `runner(job, report)` as the handler for jobs of the given kind.
+
+    The runner returns a JSON-serialisable result. `report(stage, percent)` persists
+    and broadcasts progress.
+    """
+    _runners[kind] = runner
+
+
+def job_payload(job):
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "state": job.state,
+        "stage": job.stage,
+        "progress": job.progress,
+        "result": job.result,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+    }
+
+
+def create_job(kind, system_id=None, params=None):
+    """Persist a queued job. The caller commits and then calls `start_job`."""
+    job = Job(id=str(uuid.uuid4()), kind=kind, system_id=system_id, params=params or {},
+              state='queued', stage='queued', progress=0)
+    db.session.add(job)
+    return job
+
+
+def pending_job(kind, system_id, states=('queued', 'running')):
+    """Return a job of this kind for the system that has not finished yet, if any."""
+    return Job.query.filter(Job.kind == kind, Job.system_id == system_id, Job.state.in_(states)).first()
+
+
+def start_job(app, socketio, job_id):
+    socketio.start_background_task(_run_job, app, socketio, job_id)
+
+
+def _claim(job_id):
+    """Atomically move a queued job to running. Returns False if another worker got it first."""
+    claimed = Job.query.filter_by(id=job_id, state='queued').update(
+        {"state": "running", "stage": "starting", "updated_at": datetime.utcnow()},
+        synchronize_session=False
+    )
+    db.session.commit()
+    return claimed == 1
+
+
+def _run_job(app, socketio, job_id):
+    with app.app_context():
+        if not _claim(job_id):
+            return
+        job = db.session.get(Job, job_id)
+        runner = _runners.get(job.kind)
+
+        def report(stage, percent):
+            job.stage = stage
+            job.progress = percent
+            db.session.commit()
+            socketio.emit("job_progress", job_payload(job))
+
+        try:
+            if runner is None:
+                raise ValueError(f"No runner registered for job kind '{job.kind}'")
+            report("starting", 0)
+            result = runner(job, report)
+            job.state = 'done'
+            job.stage = 'done'
+            job.progress = 100
+            job.result = result
+            db.session.commit()
+        except Exception as e:
+            traceback.print_exc()
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            job.state = 'failed'
+            job.error = str(e)
+            db.session.commit()
+        socketio.emit("job_progress", job_payload(job))
+
+
+def check_job(app, socketio, job):
+    """Recover jobs orphaned by a dead worker when someone polls them."""
+    now = datetime.utcnow()
+    if job.state == 'queued' and job.created_at and now - job.created_at > CLAIM_AFTER:
+        start_job(app, socketio, job.id)
+    elif job.state == 'running' and job.updated_at and now - job.updated_at > STALE_AFTER:
+        job.state = 'failed'
+        job.error = "Job stopped reporting progress"
+        db.session.commit()
+    return job
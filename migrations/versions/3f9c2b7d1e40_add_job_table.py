@@ -0,0 +1,41 @@
+"""Add job table for background BOM refreshes
+
+Revision ID: 3f9c2b7d1e40
+Revises: af711723c854
+Create Date: 2026-10-18 09:12:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import Text
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '3f9c2b7d1e40'
+down_revision = 'af711723c854'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job',
+                    sa.Column('id', sa.String(length=36), nullable=False),
+                    sa.Column('kind', sa.String(length=50), nullable=False),
+                    sa.Column('system_id', sa.Integer(), nullable=True),
+                    sa.Column('state', sa.String(length=20), nullable=False),
+                    sa.Column('stage', sa.String(length=50), nullable=True),
+                    sa.Column('progress', sa.Integer(), nullable=False),
+                    sa.Column('params', postgresql.JSON(astext_type=Text()), nullable=True),
+                    sa.Column('result', postgresql.JSON(astext_type=Text()), nullable=True),
+                    sa.Column('error', sa.Text(), nullable=True),
+                    sa.Column('created_at', sa.DateTime(), nullable=False),
+                    sa.Column('updated_at', sa.DateTime(), nullable=False),
+                    sa.ForeignKeyConstraint(['system_id'], ['system.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id')
+                    )
+    op.create_index(op.f('ix_job_system_id'), 'job', ['system_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_job_system_id'), table_name='job')
+    op.drop_table('job')
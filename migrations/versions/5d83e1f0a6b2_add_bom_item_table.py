@@ -0,0 +1,141 @@
+"""Move system BOM JSON into an indexed bom_item table
+
+Revision ID: 5d83e1f0a6b2
+Revises: c27e5a9b4d18
+Create Date: 2026-10-18 13:10:00.000000
+
+"""
+import json
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import Text
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '5d83e1f0a6b2'
+down_revision = 'c27e5a9b4d18'
+branch_labels = None
+depends_on = None
+
+# BOM entry key -> (column, kind), frozen copy of BomItem.FIELDS at this revision
+FIELDS = {
+    "Part Name": ("name", str),
+    "Description": ("description", str),
+    "Quantity": ("quantity", int),
+    "Material": ("material", str),
+    "materialBOM": ("material_bom", str),
+    "Pre Process": ("pre_process", str),
+    "Process 1": ("process1", str),
+    "Process 2": ("process2", str),
+    "partId": ("part_id", str),
+    "done_preprocess": ("done_preprocess", int),
+    "done_process1": ("done_process1", int),
+    "done_process2": ("done_process2", int),
+    "available_qty": ("available_qty", int),
+}
+MATERIAL_KEYS = ("Material", "materialBOM")
+
+
+def _coerce(value, kind):
+    if kind is int:
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, int):
+            return value
+        if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+            return int(value.strip())
+        return None
+    return value if isinstance(value, str) else None
+
+
+def _row(system_id, position, entry):
+    row = {column: None for column, _ in FIELDS.values()}
+    row.update(system_id=system_id, position=position)
+    extra = {}
+    for key, value in entry.items():
+        if key in MATERIAL_KEYS and isinstance(value, dict) and isinstance(value.get("displayName"), str):
+            value = value["displayName"]
+        column, kind = FIELDS.get(key, (None, None))
+        coerced = _coerce(value, kind) if column else None
+        if coerced is not None:
+            row[column] = coerced
+        if coerced is None or type(coerced) is not type(value):
+            extra[key] = value
+    row["extra"] = extra or None
+    return row
+
+
+def upgrade():
+    bom_item = op.create_table(
+        'bom_item',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('system_id', sa.Integer(), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('part_id', sa.String(length=100), nullable=True),
+        sa.Column('name', sa.String(length=500), nullable=True),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('quantity', sa.Integer(), nullable=True),
+        sa.Column('material', sa.String(length=200), nullable=True),
+        sa.Column('material_bom', sa.String(length=200), nullable=True),
+        sa.Column('pre_process', sa.String(length=100), nullable=True),
+        sa.Column('process1', sa.String(length=100), nullable=True),
+        sa.Column('process2', sa.String(length=100), nullable=True),
+        sa.Column('done_preprocess', sa.Integer(), nullable=True),
+        sa.Column('done_process1', sa.Integer(), nullable=True),
+        sa.Column('done_process2', sa.Integer(), nullable=True),
+        sa.Column('available_qty', sa.Integer(), nullable=True),
+        sa.Column('extra', postgresql.JSON(astext_type=Text()), nullable=True),
+        sa.ForeignKeyConstraint(['system_id'], ['system.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('bom_item', schema=None) as batch_op:
+        batch_op.create_index('ix_bom_item_system_part', ['system_id', 'part_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_bom_item_material'), ['material'], unique=False)
+        batch_op.create_index(batch_op.f('ix_bom_item_material_bom'), ['material_bom'], unique=False)
+        batch_op.create_index(batch_op.f('ix_bom_item_pre_process'), ['pre_process'], unique=False)
+        batch_op.create_index(batch_op.f('ix_bom_item_process1'), ['process1'], unique=False)
+        batch_op.create_index(batch_op.f('ix_bom_item_process2'), ['process2'], unique=False)
+
+    # Backfill from the JSON blobs, one system at a time
+    bind = op.get_bind()
+    systems = bind.execute(sa.text("SELECT id, bom_data FROM system WHERE bom_data IS NOT NULL")).fetchall()
+    for system_id, bom_data in systems:
+        if isinstance(bom_data, str):
+            bom_data = json.loads(bom_data)
+        rows = [_row(system_id, position, entry) for position, entry in enumerate(bom_data or [])
+                if isinstance(entry, dict)]
+        if rows:
+            op.bulk_insert(bom_item, rows)
+
+
+def downgrade():
+    # Write the rows back into the JSON column before dropping them
+    bind = op.get_bind()
+    columns = [column for column, _ in FIELDS.values()]
+    items = bind.execute(sa.text(
+        f"SELECT system_id, {', '.join(columns)}, extra FROM bom_item ORDER BY system_id, position"
+    )).fetchall()
+    boms = {}
+    for item in items:
+        values = dict(zip(columns, item[1:-1]))
+        entry = {key: values[column] for key, (column, _) in FIELDS.items() if values[column] is not None}
+        extra = item[-1]
+        for key, value in (json.loads(extra) if isinstance(extra, str) else (extra or {})).items():
+            if key in entry and _coerce(value, FIELDS[key][1]) != entry[key]:
+                continue  # changed since it was coerced; the column is current
+            entry[key] = value
+        boms.setdefault(item[0], []).append(entry)
+    for system_id, entries in boms.items():
+        bind.execute(sa.text("UPDATE system SET bom_data = :bom WHERE id = :id"),
+                     {"bom": json.dumps(entries), "id": system_id})
+
+    with op.batch_alter_table('bom_item', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_bom_item_process2'))
+        batch_op.drop_index(batch_op.f('ix_bom_item_process1'))
+        batch_op.drop_index(batch_op.f('ix_bom_item_pre_process'))
+        batch_op.drop_index(batch_op.f('ix_bom_item_material_bom'))
+        batch_op.drop_index(batch_op.f('ix_bom_item_material'))
+        batch_op.drop_index('ix_bom_item_system_part')
+
+    op.drop_table('bom_item')
@@ -0,0 +1,23 @@
+"""Add microversion change marker to system
+
+Revision ID: 8a41d6c2f913
+Revises: 3f9c2b7d1e40
+Create Date: 2026-10-18 10:05:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '8a41d6c2f913'
+down_revision = '3f9c2b7d1e40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('system', sa.Column('microversion', sa.String(length=500), nullable=True))
+
+
+def downgrade():
+    op.drop_column('system', 'microversion')
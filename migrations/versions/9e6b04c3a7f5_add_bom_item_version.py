@@ -0,0 +1,23 @@
+"""Add version counter to bom_item for optimistic progress updates
+
+Revision ID: 9e6b04c3a7f5
+Revises: 5d83e1f0a6b2
+Create Date: 2026-10-18 13:40:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '9e6b04c3a7f5'
+down_revision = '5d83e1f0a6b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('bom_item', sa.Column('version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    op.drop_column('bom_item', 'version')
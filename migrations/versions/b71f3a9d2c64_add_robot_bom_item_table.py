@@ -0,0 +1,102 @@
+"""Add robot_bom_item rollup of every system's BOM rows by partId
+
+Revision ID: b71f3a9d2c64
+Revises: 9e6b04c3a7f5
+Create Date: 2026-10-18 14:20:00.000000
+
+"""
+import json
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import Text
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'b71f3a9d2c64'
+down_revision = '9e6b04c3a7f5'
+branch_labels = None
+depends_on = None
+
+TEXT_COLUMNS = ['part_id', 'name', 'description', 'material', 'material_bom', 'pre_process', 'process1', 'process2']
+SUMMED_COLUMNS = ['quantity', 'done_preprocess', 'done_process1', 'done_process2', 'available_qty']
+
+
+def _rollup(robot_id, items):
+    first = items[0]
+    row = {column: first[column] for column in TEXT_COLUMNS}
+    for column in SUMMED_COLUMNS:
+        values = [item[column] for item in items if item[column] is not None]
+        row[column] = sum(values) if values else None
+    extra = first['extra']
+    row.update(robot_id=robot_id, system_id=first['system_id'], position=first['position'],
+               extra=json.loads(extra) if isinstance(extra, str) else extra)
+    return row
+
+
+def upgrade():
+    robot_bom_item = op.create_table(
+        'robot_bom_item',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('robot_id', sa.Integer(), nullable=False),
+        sa.Column('system_id', sa.Integer(), nullable=True),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('part_id', sa.String(length=100), nullable=True),
+        sa.Column('name', sa.String(length=500), nullable=True),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('quantity', sa.Integer(), nullable=True),
+        sa.Column('material', sa.String(length=200), nullable=True),
+        sa.Column('material_bom', sa.String(length=200), nullable=True),
+        sa.Column('pre_process', sa.String(length=100), nullable=True),
+        sa.Column('process1', sa.String(length=100), nullable=True),
+        sa.Column('process2', sa.String(length=100), nullable=True),
+        sa.Column('done_preprocess', sa.Integer(), nullable=True),
+        sa.Column('done_process1', sa.Integer(), nullable=True),
+        sa.Column('done_process2', sa.Integer(), nullable=True),
+        sa.Column('available_qty', sa.Integer(), nullable=True),
+        sa.Column('extra', postgresql.JSON(astext_type=Text()), nullable=True),
+        sa.ForeignKeyConstraint(['robot_id'], ['robot.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('robot_bom_item', schema=None) as batch_op:
+        batch_op.create_index('ix_robot_bom_item_robot_part', ['robot_id', 'part_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_robot_bom_item_material'), ['material'], unique=False)
+        batch_op.create_index(batch_op.f('ix_robot_bom_item_material_bom'), ['material_bom'], unique=False)
+        batch_op.create_index(batch_op.f('ix_robot_bom_item_pre_process'), ['pre_process'], unique=False)
+        batch_op.create_index(batch_op.f('ix_robot_bom_item_process1'), ['process1'], unique=False)
+        batch_op.create_index(batch_op.f('ix_robot_bom_item_process2'), ['process2'], unique=False)
+
+    # Backfill: merge each robot's rows by partId, skipping the placeholder "Main" system
+    bind = op.get_bind()
+    items = bind.execute(sa.text(
+        "SELECT s.robot_id, b.system_id, b.position, b.extra, "
+        + ", ".join(f"b.{column}" for column in TEXT_COLUMNS + SUMMED_COLUMNS)
+        + " FROM bom_item b JOIN system s ON s.id = b.system_id"
+        " WHERE s.name != 'Main' ORDER BY s.robot_id, b.system_id, b.position"
+    )).mappings().all()
+    groups = {}
+    order = []
+    for item in items:
+        if item['part_id'] is None:
+            order.append((item['robot_id'], [item]))
+            continue
+        key = (item['robot_id'], item['part_id'])
+        if key not in groups:
+            groups[key] = []
+            order.append((item['robot_id'], groups[key]))
+        groups[key].append(item)
+    rows = [_rollup(robot_id, group) for robot_id, group in order]
+    if rows:
+        op.bulk_insert(robot_bom_item, rows)
+
+
+def downgrade():
+    with op.batch_alter_table('robot_bom_item', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_robot_bom_item_process2'))
+        batch_op.drop_index(batch_op.f('ix_robot_bom_item_process1'))
+        batch_op.drop_index(batch_op.f('ix_robot_bom_item_pre_process'))
+        batch_op.drop_index(batch_op.f('ix_robot_bom_item_material_bom'))
+        batch_op.drop_index(batch_op.f('ix_robot_bom_item_material'))
+        batch_op.drop_index('ix_robot_bom_item_robot_part')
+
+    op.drop_table('robot_bom_item')
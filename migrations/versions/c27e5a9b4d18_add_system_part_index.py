@@ -0,0 +1,25 @@
+"""Add partId -> Part Studio index to system
+
+Revision ID: c27e5a9b4d18
+Revises: 8a41d6c2f913
+Create Date: 2026-10-18 11:20:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import Text
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'c27e5a9b4d18'
+down_revision = '8a41d6c2f913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('system', sa.Column('part_index', postgresql.JSON(astext_type=Text()), nullable=True))
+
+
+def downgrade():
+    op.drop_column('system', 'part_index')
@@ -0,0 +1,36 @@
+"""Make robot_bom_item unique per (robot_id, part_id)
+
+Revision ID: e4c18a7b2f90
+Revises: b71f3a9d2c64
+Create Date: 2026-10-18 16:30:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'e4c18a7b2f90'
+down_revision = 'b71f3a9d2c64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Concurrent rebuilds could each insert a row for the same part; every such row is
+    # a complete rollup, so keep the newest one
+    op.execute(
+        "DELETE FROM robot_bom_item WHERE part_id IS NOT NULL AND id NOT IN ("
+        "SELECT keep FROM (SELECT MAX(id) AS keep FROM robot_bom_item WHERE part_id IS NOT NULL"
+        " GROUP BY robot_id, part_id) AS newest)"
+    )
+    with op.batch_alter_table('robot_bom_item', schema=None) as batch_op:
+        batch_op.drop_index('ix_robot_bom_item_robot_part')
+        batch_op.create_index('uq_robot_bom_item_robot_part', ['robot_id', 'part_id'], unique=True,
+                              postgresql_where=sa.text('part_id IS NOT NULL'),
+                              sqlite_where=sa.text('part_id IS NOT NULL'))
+
+
+def downgrade():
+    with op.batch_alter_table('robot_bom_item', schema=None) as batch_op:
+        batch_op.drop_index('uq_robot_bom_item_robot_part')
+        batch_op.create_index('ix_robot_bom_item_robot_part', ['robot_id', 'part_id'], unique=False)
@@ -1,9 +1,14 @@
+from datetime import datetime
+
 import bcrypt
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.dialects.postgresql import JSON
 
 db = SQLAlchemy()
 
+# Name of the per-robot placeholder system whose BOM is the rollup of all the others
+MAIN_SYSTEM = "Main"
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -40,6 +45,7 @@ class Robot(db.Model):
     systems = db.relationship('System', back_populates='robot', cascade="all, delete-orphan")
     image_text = db.Column(db.String(100), nullable=True, default='uploads/robot_images/default_robot.png')
     machines = db.relationship("Machine", backref="robot", cascade="all, delete-orphan")  # ✅ ADD THIS
+    bom_rollup = db.relationship('RobotBomItem', cascade="all, delete-orphan")
 
 
 
@@ -50,12 +56,236 @@ class System(db.Model):
     partstudio_urls = db.Column(JSON)
     access_key = db.Column(db.String(100), nullable=True)
     secret_key = db.Column(db.String(100), nullable=True)
-    bom_data = db.Column(JSON)
+    bom_data = db.Column(JSON)  # legacy copy from before BomItem; no longer read or written
     robot_id = db.Column(db.Integer, db.ForeignKey('robot.id'), nullable=False)
     robot = db.relationship('Robot', back_populates='systems')
     subassembly_urls = db.Column(JSON)
     thumbnail_url = db.Column(db.String)
+    microversion = db.Column(db.String(500), nullable=True)  # Onshape change marker of the last fetched BOM
+    part_index = db.Column(JSON)  # partId -> {did, wvm, wvmid, eid} of the Part Studio it lives in
+    bom_items = db.relationship('BomItem', back_populates='system', cascade="all, delete-orphan",
+                                order_by='BomItem.position')
+
+    def bom_entries(self):
+        """The system's BOM as the list of part dicts the API has always returned."""
+        if self.id is None:
+            return []
+        return BomItem.entries_for([self.id])
+
+    def replace_bom(self, entries):
+        """Replace every BomItem of this system with rows built from `entries`. The caller commits."""
+        if self.id is None:
+            db.session.add(self)
+            db.session.flush()
+        old_part_ids = {p for (p,) in db.session.query(BomItem.part_id).filter_by(system_id=self.id).distinct()}
+        BomItem.query.filter_by(system_id=self.id).delete(synchronize_session=False)
+        db.session.expire(self, ['bom_items'])
+        items = [BomItem.from_entry(entry, self.id, position) for position, entry in enumerate(entries)]
+        db.session.add_all(items)
+        if self.name != MAIN_SYSTEM:
+            db.session.flush()
+            RobotBomItem.rebuild(self.robot_id, old_part_ids | {item.part_id for item in items})
+
+
+class BomColumns:
+    """Part columns shared by per-system BOM rows and the robot-level rollup."""
+
+    # BOM entry key -> (column, kind). Counters stay NULL when the entry has no such key.
+    FIELDS = {
+        "Part Name": ("name", str),
+        "Description": ("description", str),
+        "Quantity": ("quantity", int),
+        "Material": ("material", str),
+        "materialBOM": ("material_bom", str),
+        "Pre Process": ("pre_process", str),
+        "Process 1": ("process1", str),
+        "Process 2": ("process2", str),
+        "partId": ("part_id", str),
+        "done_preprocess": ("done_preprocess", int),
+        "done_process1": ("done_process1", int),
+        "done_process2": ("done_process2", int),
+        "available_qty": ("available_qty", int),
+    }
+    # Progress counters a single PATCH may change
+    PROGRESS_FIELDS = ("done_preprocess", "done_process1", "done_process2", "available_qty")
+    # Old saves hold Onshape's material object here instead of its name
+    MATERIAL_KEYS = ("Material", "materialBOM")
+
+    id = db.Column(db.Integer, primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    part_id = db.Column(db.String(100), nullable=True)
+    name = db.Column(db.String(500), nullable=True)
+    description = db.Column(db.Text, nullable=True)
+    quantity = db.Column(db.Integer, nullable=True)
+    material = db.Column(db.String(200), nullable=True, index=True)
+    material_bom = db.Column(db.String(200), nullable=True, index=True)
+    pre_process = db.Column(db.String(100), nullable=True, index=True)
+    process1 = db.Column(db.String(100), nullable=True, index=True)
+    process2 = db.Column(db.String(100), nullable=True, index=True)
+    done_preprocess = db.Column(db.Integer, nullable=True)
+    done_process1 = db.Column(db.Integer, nullable=True)
+    done_process2 = db.Column(db.Integer, nullable=True)
+    available_qty = db.Column(db.Integer, nullable=True)
+    extra = db.Column(JSON)  # entry values that do not fit a column, or were coerced to fit, kept verbatim
+
+    @staticmethod
+    def _coerce(value, kind):
+        """Column value for an entry value, or None if it has to stay in `extra`."""
+        if kind is int:
+            if isinstance(value, bool):
+                return None
+            if isinstance(value, int):
+                return value
+            if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+                return int(value.strip())
+            return None
+        return value if isinstance(value, str) else None
+
+    def to_entry(self):
+        entry = {}
+        for key, (column, _) in self.FIELDS.items():
+            value = getattr(self, column)
+            if value is not None:
+                entry[key] = value
+        for key, value in (self.extra or {}).items():
+            # The original of a coerced value ("3" for 3) is returned as sent, unless the
+            # column has been changed since (a progress update, a rollup sum)
+            if key in entry and self._coerce(value, self.FIELDS[key][1]) != entry[key]:
+                continue
+            entry[key] = value
+        return entry
+
+
+class BomItem(BomColumns, db.Model):
+    """One part row of a system's BOM, in the same order and with the same keys as the old JSON."""
+    __table_args__ = (
+        db.Index('ix_bom_item_system_part', 'system_id', 'part_id'),
+    )
+
+    # Row identity sent to clients; never stored back from an entry
+    ROW_KEYS = ("itemId", "version")
+
+    system_id = db.Column(db.Integer, db.ForeignKey('system.id', ondelete='CASCADE'), nullable=False)
+    system = db.relationship('System', back_populates='bom_items')
+    version = db.Column(db.Integer, nullable=False, default=0)  # bumped on every progress update
+
+    @classmethod
+    def from_entry(cls, entry, system_id, position=0):
+        item = cls(system_id=system_id, position=position)
+        extra = {}
+        for key, value in entry.items():
+            if key in cls.ROW_KEYS:
+                continue
+            if key in cls.MATERIAL_KEYS and isinstance(value, dict) and isinstance(value.get("displayName"), str):
+                value = value["displayName"]
+            column, kind = cls.FIELDS.get(key, (None, None))
+            coerced = cls._coerce(value, kind) if column else None
+            if coerced is not None:
+                setattr(item, column, coerced)
+            if coerced is None or type(coerced) is not type(value):
+                extra[key] = value
+        item.extra = extra or None
+        return item
+
+    @classmethod
+    def entries_for(cls, system_ids):
+        """BOM entries of several systems in one query, system by system in position order."""
+        if not system_ids:
+            return []
+        items = cls.query.filter(cls.system_id.in_(system_ids)).order_by(cls.system_id, cls.position).all()
+        return [item.to_entry() for item in items]
+
+    def to_entry(self):
+        entry = super().to_entry()
+        entry["itemId"] = self.id
+        entry["version"] = self.version
+        return entry
+
+
+class RobotBomItem(BomColumns, db.Model):
+    """One part of a robot's "Main" BOM: every system's rows for a partId merged into one.
+
+    Descriptive columns come from the part's first occurrence (by system, then
+    position); quantity and progress counters are summed. Rows are kept current
+    by `rebuild`, which callers run for the partIds they touched. A robot has at
+    most one row per partId; rows without a partId are never merged.
+    """
+    __table_args__ = (
+        db.Index('uq_robot_bom_item_robot_part', 'robot_id', 'part_id', unique=True,
+                 postgresql_where=db.text('part_id IS NOT NULL'), sqlite_where=db.text('part_id IS NOT NULL')),
+    )
+
+    robot_id = db.Column(db.Integer, db.ForeignKey('robot.id', ondelete='CASCADE'), nullable=False)
+    system_id = db.Column(db.Integer, nullable=True)  # system of the first occurrence, for ordering
+
+    SUMMED = ("quantity", "done_preprocess", "done_process1", "done_process2", "available_qty")
+
+    @classmethod
+    def from_items(cls, robot_id, items):
+        first = items[0]
+        row = cls(robot_id=robot_id, system_id=first.system_id, position=first.position,
+                  extra=dict(first.extra) if first.extra else None)
+        for column, _ in cls.FIELDS.values():
+            if column in cls.SUMMED:
+                values = [getattr(item, column) for item in items if getattr(item, column) is not None]
+                setattr(row, column, sum(values) if values else None)
+            else:
+                setattr(row, column, getattr(first, column))
+        return row
+
+    @classmethod
+    def rebuild(cls, robot_id, part_ids=None):
+        """Recompute the rollup rows for `part_ids`, or for the whole robot. The caller commits.
+
+        The placeholder system named "Main" is left out: it stands for this rollup.
+        The robot row is locked first (FOR UPDATE, until the caller commits) so two
+        rebuilds of one robot cannot both delete the old rows and insert their own.
+        """
+        db.session.query(Robot.id).filter(Robot.id == robot_id).with_for_update().first()
+        system_ids = [sid for (sid,) in db.session.query(System.id).filter(System.robot_id == robot_id,
+                                                                          System.name != MAIN_SYSTEM)]
+        stale = cls.query.filter(cls.robot_id == robot_id)
+        items = BomItem.query.filter(BomItem.system_id.in_(system_ids))
+        if part_ids is not None:
+            part_ids = set(part_ids)
+            named = [p for p in part_ids if p is not None]
+            stale_match = [cls.part_id.in_(named)]
+            item_match = [BomItem.part_id.in_(named)]
+            if None in part_ids:
+                stale_match.append(cls.part_id.is_(None))
+                item_match.append(BomItem.part_id.is_(None))
+            stale = stale.filter(db.or_(*stale_match))
+            items = items.filter(db.or_(*item_match))
+        stale.delete(synchronize_session=False)
+
+        groups = {}
+        rows = []
+        # populate_existing: rows may have been changed by bulk UPDATEs behind the session's back
+        for item in items.order_by(BomItem.system_id, BomItem.position).populate_existing():
+            if item.part_id is None:
+                rows.append([item])  # nothing to merge on
+            elif item.part_id in groups:
+                groups[item.part_id].append(item)
+            else:
+                groups[item.part_id] = [item]
+                rows.append(groups[item.part_id])
+        db.session.add_all(cls.from_items(robot_id, group) for group in rows)
+
 
+class Job(db.Model):
+    """Background work (e.g. a BOM refresh) tracked in the DB so any worker can report on it."""
+    id = db.Column(db.String(36), primary_key=True)
+    kind = db.Column(db.String(50), nullable=False, default='bom_refresh')
+    system_id = db.Column(db.Integer, db.ForeignKey('system.id', ondelete='CASCADE'), nullable=True, index=True)
+    system = db.relationship('System')
+    state = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    stage = db.Column(db.String(50), nullable=True)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    params = db.Column(JSON)
+    result = db.Column(JSON)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
 
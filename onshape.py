@@ -0,0 +1,310 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Point at a stand-in server (see fake_onshape.py) with the ONSHAPE_BASE_URL env var
+ONSHAPE_BASE_URL = os.getenv("ONSHAPE_BASE_URL", "https://cad.onshape.com")
+
+# Default number of simultaneous Onshape calls allowed for one credential pair
+DEFAULT_MAX_CONCURRENCY = 4
+
+# (connect, read) timeouts in seconds for every Onshape call
+DEFAULT_TIMEOUT = (10, 60)
+# Size of the pieces a streamed download is relayed in
+STREAM_CHUNK_SIZE = 64 * 1024
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRY_STATUSES = {500, 502, 503, 504}
+
+PRIORITY_INTERACTIVE = "interactive"  # a user is waiting on the result (viewer, single download)
+PRIORITY_BULK = "bulk"  # background work (BOM refresh, batch export)
+
+# Token-bucket defaults per access key, per process; override with configure_rate_budget()
+DEFAULT_RATE_PER_SEC = 2.0
+DEFAULT_BURST = 10
+DEFAULT_BULK_RESERVE = 3  # tokens held back for interactive calls
+DEFAULT_MAX_WAIT = 120.0
+
+_rate_settings = {
+    "rate": DEFAULT_RATE_PER_SEC,
+    "burst": DEFAULT_BURST,
+    "bulk_reserve": DEFAULT_BULK_RESERVE,
+    "max_wait": DEFAULT_MAX_WAIT,
+}
+_budgets = {}
+_budgets_lock = threading.Lock()
+_semaphores = {}
+_semaphores_lock = threading.Lock()
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def credential_slot(access_key, secret_key, limit=DEFAULT_MAX_CONCURRENCY):
+    """Return the semaphore bounding concurrent calls made with one credential pair.
+
+    The first caller sets the bound for the process; asking for the same pair with
+    a different `limit` raises ValueError instead of quietly using the other size.
+    """
+    key = (access_key, secret_key)
+    limit = max(1, int(limit))
+    with _semaphores_lock:
+        entry = _semaphores.get(key)
+        if entry is None:
+            entry = (limit, threading.BoundedSemaphore(limit))
+            _semaphores[key] = entry
+        elif entry[0] != limit:
+            raise ValueError(f"Credential slot already sized for {entry[0]} concurrent calls, not {limit}")
+        return entry[1]
+
+
+def run_concurrently(calls, access_key, secret_key, limit=DEFAULT_MAX_CONCURRENCY):
+    """Run independent Onshape calls on a bounded pool and return their results in order.
+
+    `calls` is a list of zero-argument callables. At most `limit` of them run at once
+    for the given credential pair, even across requests. The first exception raised
+    by any call is re-raised once all calls have finished.
+    """
+    if not calls:
+        return []
+    limit = max(1, int(limit))
+    slot = credential_slot(access_key, secret_key, limit)
+
+    def guarded(call):
+        with slot:
+            return call()
+
+    with ThreadPoolExecutor(max_workers=min(len(calls), limit)) as pool:
+        futures = [pool.submit(guarded, call) for call in calls]
+        return [f.result() for f in futures]
+
+
+class RateBudgetExceeded(Exception):
+    pass
+
+
+class RateBudget:
+    """Token bucket shared by every Onshape call made with one access key.
+
+    Interactive calls may spend every token. Bulk calls leave `bulk_reserve`
+    tokens untouched and also yield while an interactive call is waiting, so a
+    BOM refresh cannot starve someone opening the viewer.
+    """
+
+    def __init__(self, rate, burst, bulk_reserve):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.bulk_reserve = min(float(bulk_reserve), self.burst - 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.waiting = {PRIORITY_INTERACTIVE: 0, PRIORITY_BULK: 0}
+        self.granted = {PRIORITY_INTERACTIVE: 0, PRIORITY_BULK: 0}
+        self.throttled = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority=PRIORITY_BULK, max_wait=DEFAULT_MAX_WAIT):
+        floor = 0 if priority == PRIORITY_INTERACTIVE else self.bulk_reserve
+        deadline = time.monotonic() + max_wait
+        with self.lock:
+            self.waiting[priority] += 1
+        try:
+            while True:
+                with self.lock:
+                    self._refill()
+                    yield_to_interactive = priority != PRIORITY_INTERACTIVE and self.waiting[PRIORITY_INTERACTIVE]
+                    if self.tokens - 1 >= floor and not yield_to_interactive:
+                        self.tokens -= 1
+                        self.granted[priority] += 1
+                        return
+                    delay = max(0.05, (floor + 1 - self.tokens) / self.rate)
+                if time.monotonic() + delay > deadline:
+                    raise RateBudgetExceeded("Onshape rate budget exhausted, try again shortly")
+                time.sleep(min(delay, 1.0))
+        finally:
+            with self.lock:
+                self.waiting[priority] -= 1
+
+    def penalize(self):
+        """Onshape answered 429: empty the bucket so every caller backs off."""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0)
+            self.throttled += 1
+
+    def snapshot(self):
+        with self.lock:
+            self._refill()
+            return {
+                "tokens": round(self.tokens, 2),
+                "burst": self.burst,
+                "rate_per_sec": self.rate,
+                "bulk_reserve": self.bulk_reserve,
+                "waiting": dict(self.waiting),
+                "granted": dict(self.granted),
+                "throttled": self.throttled,
+            }
+
+
+def configure_rate_budget(rate=None, burst=None, bulk_reserve=None, max_wait=None):
+    """Set the token-bucket parameters used for access keys seen from now on."""
+    for name, value in (("rate", rate), ("burst", burst), ("bulk_reserve", bulk_reserve), ("max_wait", max_wait)):
+        if value is not None:
+            _rate_settings[name] = float(value)
+
+
+def rate_budget(access_key):
+    with _budgets_lock:
+        budget = _budgets.get(access_key)
+        if budget is None:
+            budget = RateBudget(_rate_settings["rate"], _rate_settings["burst"], _rate_settings["bulk_reserve"])
+            _budgets[access_key] = budget
+        return budget
+
+
+def rate_budget_usage():
+    """Snapshot of every access key's budget, with the keys masked."""
+    with _budgets_lock:
+        budgets = list(_budgets.items())
+    return [{"access_key": (key or "")[:4] + "…", **budget.snapshot()} for key, budget in budgets]
+
+
+def get_session(access_key, secret_key):
+    """Return the shared keep-alive session for one credential pair."""
+    key = (access_key, secret_key)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            session.auth = (access_key, secret_key)
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(10, DEFAULT_MAX_CONCURRENCY * 2))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[key] = session
+        return session
+
+
+def _backoff(attempt):
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def _retry_after(response):
+    """Seconds to wait according to a Retry-After header, or None."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class OnshapeApi:
+    """Onshape REST calls for one credential pair over a pooled session.
+
+    Every call gets a timeout. 429 responses are retried after `Retry-After` (or a
+    backoff); connection errors and 5xx responses are retried with jittered
+    exponential backoff for idempotent methods only. Once retries run out the last
+    response is returned so callers can report the status as before.
+
+    Each attempt first takes a token from the access key's `RateBudget` at this
+    client's priority, waiting at most `max_wait` seconds (the configured default
+    when None) before raising `RateBudgetExceeded`.
+    """
+
+    def __init__(self, access_key, secret_key, priority=PRIORITY_BULK, base_url=None):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.priority = priority
+        self.base_url = (base_url or ONSHAPE_BASE_URL).rstrip("/")
+        self.session = get_session(access_key, secret_key)
+        self.budget = rate_budget(access_key)
+
+    def url(self, path):
+        return path if path.startswith("http") else self.base_url + path
+
+    def request(self, method, path, retries=MAX_RETRIES, timeout=DEFAULT_TIMEOUT, max_wait=None, **kwargs):
+        method = method.upper()
+        idempotent = method in IDEMPOTENT_METHODS
+        url = self.url(path)
+        for attempt in range(retries + 1):
+            last = attempt == retries
+            self.budget.acquire(self.priority, _rate_settings["max_wait"] if max_wait is None else max_wait)
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if not idempotent or last:
+                    raise
+                time.sleep(_backoff(attempt))
+                continue
+
+            if response.status_code == 429:
+                self.budget.penalize()
+            if response.status_code == 429 and not last:
+                delay = _retry_after(response)
+                response.close()
+                time.sleep(min(BACKOFF_MAX, delay) if delay is not None else _backoff(attempt))
+                continue
+            if response.status_code in RETRY_STATUSES and idempotent and not last:
+                response.close()
+                time.sleep(_backoff(attempt))
+                continue
+            return response
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def get_json(self, path, **kwargs):
+        """GET a JSON document, raising `requests.HTTPError` on a non-2xx status."""
+        response = self.get(path, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+
+def relay_stream(response, accept_encoding=""):
+    """Relay a `stream=True` response chunk by chunk: return `(chunks, headers)`.
+
+    When the client accepts the upstream's Content-Encoding (or there is none), the
+    bytes go through untouched and `Content-Length`/`Content-Encoding` are forwarded.
+    Otherwise the body is decoded on the fly and its length is unknown. The upstream
+    connection is released once the chunks are exhausted or the client goes away.
+    """
+    encoding = (response.headers.get("Content-Encoding") or "").strip().lower()
+    accepted = {e.split(";")[0].strip().lower() for e in (accept_encoding or "").split(",")}
+    passthrough = encoding in ("", "identity") or encoding in accepted
+    headers = {}
+    if passthrough:
+        if encoding not in ("", "identity"):
+            headers["Content-Encoding"] = encoding
+        if response.headers.get("Content-Length"):
+            headers["Content-Length"] = response.headers["Content-Length"]
+
+    def chunks():
+        try:
+            if passthrough:
+                yield from response.raw.stream(STREAM_CHUNK_SIZE, decode_content=False)
+            else:
+                yield from response.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+        finally:
+            response.close()
+
+    return chunks(), headers
@@ -0,0 +1,112 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import and_
+
+from models import db, Team, Robot, System
+
+ResolvedPath = namedtuple("ResolvedPath", ["team", "robot", "system"])
+
+
+class PathResolver:
+    """Resolve `(team_number, robot_name, system_name)` to rows in one query, caching the ids.
+
+    Lookups that found every requested level are remembered in a bounded LRU of
+    ids. A cached lookup still costs one query, by primary key, and the rows it
+    returns are checked against the requested names, so an entry made stale by
+    another worker's rename or delete falls back to a fresh lookup by name instead
+    of returning the wrong row. Misses are never cached. Call `invalidate` after
+    renaming or deleting a robot or system so this worker drops its entries early.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = int(max_entries)
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(team_number, robot_name, system_name):
+        return str(team_number), robot_name, system_name
+
+    def resolve(self, team_number, robot_name=None, system_name=None):
+        """Return `ResolvedPath(team, robot, system)`, with None for levels not found or not asked for."""
+        if team_number is None or team_number == "":
+            return ResolvedPath(None, None, None)
+        key = self._key(team_number, robot_name, system_name)
+        with self._lock:
+            ids = self._ids.get(key)
+            if ids is not None:
+                self._ids.move_to_end(key)
+        if ids is not None:
+            path = self._load(*ids)
+            if self._matches(path, *key):
+                self.hits += 1
+                return path
+            self._forget(key)
+        self.misses += 1
+        path = self._lookup(*key)
+        found = path.team and (robot_name is None or path.robot) and (system_name is None or path.system)
+        if found:
+            self._remember(key, tuple(row.id if row else None for row in path))
+        return path
+
+    def invalidate(self, team_number, robot_name=None):
+        """Drop cached lookups for a team, or only those under one of its robots."""
+        team_number = str(team_number)
+        with self._lock:
+            for key in [k for k in self._ids if k[0] == team_number and robot_name in (None, k[1])]:
+                del self._ids[key]
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._ids), "max_entries": self.max_entries, "hits": self.hits,
+                    "misses": self.misses}
+
+    def _lookup(self, team_number, robot_name, system_name):
+        row = (db.session.query(Team, Robot, System)
+               .select_from(Team)
+               .outerjoin(Robot, and_(Robot.team_id == Team.id, Robot.name == robot_name))
+               .outerjoin(System, and_(System.robot_id == Robot.id, System.name == system_name))
+               .filter(Team.team_number == team_number)
+               .first())
+        return ResolvedPath(*row) if row else ResolvedPath(None, None, None)
+
+    def _load(self, team_id, robot_id, system_id):
+        row = (db.session.query(Team, Robot, System)
+               .select_from(Team)
+               .outerjoin(Robot, Robot.id == robot_id)
+               .outerjoin(System, System.id == system_id)
+               .filter(Team.id == team_id)
+               .first())
+        return ResolvedPath(*row) if row else ResolvedPath(None, None, None)
+
+    @staticmethod
+    def _matches(path, team_number, robot_name, system_name):
+        team, robot, system = path
+        if team is None or str(team.team_number) != team_number:
+            return False
+        if robot_name is not None and (robot is None or robot.name != robot_name or robot.team_id != team.id):
+            return False
+        if system_name is not None and (system is None or system.name != system_name
+                                        or system.robot_id != robot.id):
+            return False
+        return True
+
+    def _remember(self, key, ids):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._ids[key] = ids
+            self._ids.move_to_end(key)
+            while len(self._ids) > self.max_entries:
+                self._ids.popitem(last=False)
+
+    def _forget(self, key):
+        with self._lock:
+            self._ids.pop(key, None)
@@ -3,6 +3,37 @@ import { OrbitControls } from 'three/addons/controls/OrbitControls.js';
 import { GLTFLoader } from 'three/addons/loaders/GLTFLoader.js';
 
 let renderer, camera, scene, controls;
+let currentModel = null;
+let modelReady = Promise.resolve(false);
+let viewerSession = 0;  // bumped per opened model so late loads for an old one are dropped
+
+// Hide nodes outside window.visiblePartIds, centre the model and outline its edges
+function prepareModel(model) {
+    if (window.visiblePartIds?.length > 0) {
+        model.traverse((node) => {
+            const id = node.userData?.partId;
+            if (id && !window.visiblePartIds.includes(id)) {
+                node.visible = false;
+            }
+        });
+    }
+    const box = new THREE.Box3().setFromObject(model);
+    const size = box.getSize(new THREE.Vector3());
+    const center = box.getCenter(new THREE.Vector3());
+    model.position.sub(center);
+
+    model.traverse(child => {
+        if (child.isMesh) {
+            const edges = new THREE.EdgesGeometry(child.geometry);
+            const line = new THREE.LineSegments(
+                edges,
+                new THREE.LineBasicMaterial({ color: 0x000000 })
+            );
+            child.add(line);
+        }
+    });
+    return { size, center };
+}
 
 window.showGLTFViewer = async function (blobUrl) {
     const canvas = document.getElementById("gltfCanvas");
@@ -44,53 +75,37 @@ window.showGLTFViewer = async function (blobUrl) {
     controls.minPolarAngle = 0;
     controls.maxPolarAngle = Math.PI;
 
-    const loader = new GLTFLoader();
-
-    loader.load(blobUrl, function (gltf) {
-        const model = gltf.scene;
-        scene.add(model);
-        if (window.visiblePartIds?.length > 0) {
-            gltf.scene.traverse((node) => {
-                const id = node.userData?.partId;
-                if (id && !window.visiblePartIds.includes(id)) {
-                    node.visible = false;
-                }
-            });
-        }
-        const box = new THREE.Box3().setFromObject(model);
-        const size = box.getSize(new THREE.Vector3());
-        const center = box.getCenter(new THREE.Vector3());
-        model.position.sub(center);
-
-        const maxDim = Math.max(size.x, size.y, size.z);
-        const fov = camera.fov * (Math.PI / 180);
-        const distance = Math.abs(maxDim / Math.sin(fov / 2)) * 0.6;
-
-        camera.position.set(distance, distance, distance);
-        camera.lookAt(0, 0, 0);
-        controls.target.set(0, 0, 0);
-        controls.update();
-
-        model.traverse(child => {
-            if (child.isMesh) {
-                const edges = new THREE.EdgesGeometry(child.geometry);
-                const line = new THREE.LineSegments(
-                    edges,
-                    new THREE.LineBasicMaterial({ color: 0x000000 })
-                );
-                child.add(line);
-            }
+    const session = ++viewerSession;
+    currentModel = null;
+    modelReady = new Promise((resolve) => {
+        new GLTFLoader().load(blobUrl, function (gltf) {
+            if (session !== viewerSession) return resolve(false);
+            const model = gltf.scene;
+            scene.add(model);
+            const { size } = prepareModel(model);
+            currentModel = model;
+
+            const maxDim = Math.max(size.x, size.y, size.z);
+            const fov = camera.fov * (Math.PI / 180);
+            const distance = Math.abs(maxDim / Math.sin(fov / 2)) * 0.6;
+
+            camera.position.set(distance, distance, distance);
+            camera.lookAt(0, 0, 0);
+            controls.target.set(0, 0, 0);
+            controls.update();
+
+            // ✅ Hide loading when ready
+            loadingOverlay.classList.add("hidden");
+
+            animate();
+            resolve(true);
+        }, undefined, (error) => {
+            console.error("❌ GLTF Load Failed:", error);
+            loadingOverlay.classList.add("hidden");
+            alert("Failed to load 3D model.");
+            viewerModal.classList.add("hidden");
+            resolve(false);
         });
-
-        // ✅ Hide loading when ready
-        loadingOverlay.classList.add("hidden");
-
-        animate();
-    }, undefined, (error) => {
-        console.error("❌ GLTF Load Failed:", error);
-        loadingOverlay.classList.add("hidden");
-        alert("Failed to load 3D model.");
-        viewerModal.classList.add("hidden");
     });
 
     function animate() {
@@ -99,8 +114,36 @@ window.showGLTFViewer = async function (blobUrl) {
         renderer.render(scene, camera);
     }
 
+    return modelReady;  // settles once the loader is done with blobUrl
 };
+
+// Swap the model on screen for a more detailed one of the same part, keeping the camera.
+// Resolves once the loader is done with blobUrl.
+window.replaceGLTFModel = async function (blobUrl) {
+    const session = viewerSession;
+    if (!(await modelReady) || session !== viewerSession) return;
+    await new Promise((resolve) => {
+        new GLTFLoader().load(blobUrl, function (gltf) {
+            resolve();
+            if (session !== viewerSession || !currentModel) return;
+            const model = gltf.scene;
+            prepareModel(model);
+            scene.remove(currentModel);
+            currentModel.traverse(child => {
+                child.geometry?.dispose();
+            });
+            scene.add(model);
+            currentModel = model;
+        }, undefined, (error) => {
+            console.warn("⚠️ Detailed model failed to load, keeping the coarse one:", error);
+            resolve();
+        });
+    });
+};
+
 window.closeViewer = function () {
+    viewerSession++;
+
     document.getElementById("viewerModal").classList.add("hidden");
     document.getElementById("viewerLoading").classList.add("hidden");
 
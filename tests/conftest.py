@@ -0,0 +1,63 @@
+"""App fixtures: an in-memory database and a team/robot to hang systems off."""
+import os
+import tempfile
+
+import pytest
+
+# app reads these at import time; never point the tests at a real database or cache
+_cache_dir = tempfile.mkdtemp(prefix="frcbom-tests-")
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ["CAD_CACHE_DIR"] = os.path.join(_cache_dir, "cad_cache")
+os.environ["GLTF_CACHE_DIR"] = os.path.join(_cache_dir, "gltf_cache")
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+
+import app as app_module  # noqa: E402
+from models import db, Team, Robot, System  # noqa: E402
+
+TEAM_NUMBER = "1234"
+
+
+@pytest.fixture
+def app():
+    flask_app = app_module.app
+    flask_app.config["TESTING"] = True
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+    app_module.paths.clear()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth(app):
+    token = create_access_token(identity=TEAM_NUMBER, additional_claims={"is_team_admin": True})
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def robot(app):
+    team = Team(name="Test Team", team_number=int(TEAM_NUMBER), password="x", adminPassword="x")
+    db.session.add(team)
+    db.session.flush()
+    robot = Robot(name="Bot", year=2025, team_id=team.id)
+    db.session.add(robot)
+    db.session.commit()
+    return robot
+
+
+@pytest.fixture
+def add_system(robot):
+    """Create a system of `robot` holding `entries` as its BOM."""
+    def add(name, entries=()):
+        system = System(name=name, robot_id=robot.id)
+        system.replace_bom(list(entries))
+        db.session.commit()
+        return system
+    return add
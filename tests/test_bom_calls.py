@@ -0,0 +1,67 @@
+"""Outbound Onshape calls made while building a system BOM, counted with a stubbed client."""
+from collections import Counter
+from types import SimpleNamespace
+
+import bom
+
+ASSEMBLY_URL = "https://cad.onshape.com/documents/D1/w/W1/e/ASM"
+HEADERS = [
+    {"id": "h-item", "name": "Item"},
+    {"id": "h-name", "name": "Name"},
+    {"id": "h-qty", "name": "Quantity"},
+    {"id": "h-mat", "name": "Material"},
+]
+
+
+def row(level, item, name, qty, part_id=""):
+    return {
+        "indentLevel": level,
+        "headerIdToValue": {"h-item": item, "h-name": name, "h-qty": qty, "h-mat": {"displayName": "Steel"}},
+        "itemSource": {"documentId": "D1", "wvmType": "w", "wvmId": "W1", "elementId": "PS0", "partId": part_id},
+    }
+
+
+def gearbox(prefix, qty):
+    """The same gearbox subassembly, with a nested shaft subassembly, placed under `prefix`."""
+    return [
+        row(0, prefix, "Gearbox", qty),
+        row(1, f"{prefix}.1", "Plate", 2, "JPLATE"),
+        row(1, f"{prefix}.2", "Shaft", 1),
+        row(2, f"{prefix}.2.1", "Hex Shaft", 1, "JHEX"),
+        row(2, f"{prefix}.2.2", "Spacer", 4, "JSPACER"),
+    ]
+
+
+# Two drivetrain sides share one gearbox design, plus a loose top-level part
+BOM_JSON = {"headers": HEADERS, "rows": gearbox("1", 1) + gearbox("2", 2) + [row(0, "3", "Bumper", 1, "JBUMP")]}
+
+
+class StubClient:
+    def __init__(self):
+        self.calls = Counter()
+
+    def get_json(self, path, **kwargs):
+        if path.endswith("/bom"):
+            self.calls["bom"] += 1
+            return BOM_JSON
+        if path.startswith("/api/v12/documents/"):
+            self.calls["document"] += 1
+            return {"thumbnail": None}
+        raise AssertionError(f"unexpected Onshape call: {path}")
+
+
+def test_repeated_subassemblies_cost_one_bom_call(monkeypatch):
+    client = StubClient()
+    monkeypatch.setattr(bom, "make_client", lambda access_key, secret_key: client)
+    system = SimpleNamespace(access_key="a", secret_key="s", assembly_url=ASSEMBLY_URL, partstudio_urls=[],
+                             bom_entries=lambda: [])
+
+    final_bom, thumbnail_url, part_index = bom.build_system_bom(system, max_concurrency=2)
+
+    assert client.calls == {"bom": 1, "document": 1}
+    assert thumbnail_url is None
+    quantities = [(p["partId"], p["Quantity"]) for p in final_bom]
+    assert quantities == [("JPLATE", 2), ("JHEX", 1), ("JSPACER", 4),
+                          ("JPLATE", 4), ("JHEX", 2), ("JSPACER", 8), ("JBUMP", 1)]
+    assert {p["Material"] for p in final_bom} == {"Steel"}
+    assert set(part_index) == {"JPLATE", "JHEX", "JSPACER", "JBUMP"}
@@ -0,0 +1,47 @@
+"""Query parameters of GET /api/bom."""
+import pytest
+
+PARTS = [
+    {"partId": "JPLATE", "Part Name": "Plate", "Quantity": 2, "Material": "Aluminum"},
+    {"partId": "JHEX", "Part Name": "Hex Shaft", "Quantity": 1, "Material": "Steel"},
+    {"partId": "JSPACER", "Part Name": "Spacer", "Quantity": 4},
+]
+
+
+@pytest.fixture
+def drive(add_system):
+    return add_system("Drive", PARTS)
+
+
+def get_bom(client, auth, **params):
+    query = {"team_number": "1234", "robot": "Bot", "system": "Drive", **params}
+    return client.get("/api/get_bom", query_string=query, headers=auth)
+
+
+def part_ids(res):
+    return [p["partId"] for p in res.get_json()["bom_data"]]
+
+
+def test_limit_pages_the_bom(client, auth, drive):
+    res = get_bom(client, auth, limit=2)
+    assert res.status_code == 200
+    assert part_ids(res) == ["JPLATE", "JHEX"]
+    assert res.get_json()["next_cursor"]
+
+
+@pytest.mark.parametrize("limit", ["abc", "1.5"])
+def test_non_integer_limit_is_rejected(client, auth, drive, limit):
+    res = get_bom(client, auth, limit=limit)
+    assert res.status_code == 400
+    assert res.get_json() == {"error": "limit must be an integer"}
+
+
+@pytest.mark.parametrize("material", ["", "  "])
+def test_empty_material_is_no_filter(client, auth, drive, material):
+    res = get_bom(client, auth, material=material)
+    assert res.status_code == 200
+    assert part_ids(res) == ["JPLATE", "JHEX", "JSPACER"]
+
+
+def test_material_filters(client, auth, drive):
+    assert part_ids(get_bom(client, auth, material="Steel")) == ["JHEX"]
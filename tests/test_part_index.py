@@ -0,0 +1,83 @@
+"""partId -> Part Studio index: ambiguous partIds and stale entries."""
+import pytest
+
+import bom
+from onshape import RateBudgetExceeded
+
+OWN_STUDIO = "https://cad.onshape.com/documents/D1/w/W1/e/PS0"
+
+
+def source_row(part_id, did, eid):
+    return {"itemSource": {"documentId": did, "wvmType": "w", "wvmId": f"W{did[-1]}", "elementId": eid,
+                           "partId": part_id}}
+
+
+def location(did, eid):
+    return {"did": did, "wvm": "w", "wvmid": f"W{did[-1]}", "eid": eid}
+
+
+class Response:
+    status_code = 200
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class PartsClient:
+    """Answers /api/parts with the partIds of each studio, counting the calls."""
+
+    def __init__(self, studios):
+        self.studios = studios
+        self.calls = 0
+
+    def get(self, path, **kwargs):
+        self.calls += 1
+        eid = path.rsplit("/", 1)[-1]
+        return Response([{"partId": p} for p in self.studios.get(eid, [])])
+
+
+def test_unique_part_ids_are_indexed():
+    index = bom.build_part_index({"rows": [source_row("JHD", "D1", "PS0"), source_row("JFD", "D2", "LIB")]})
+    assert index == {"JHD": location("D1", "PS0"), "JFD": location("D2", "LIB")}
+
+
+def test_shared_part_id_prefers_the_systems_own_studio():
+    rows = [source_row("JHD", "D2", "LIB"), source_row("JHD", "D1", "PS0")]
+    index = bom.build_part_index({"rows": rows}, [OWN_STUDIO])
+    assert index == {"JHD": location("D1", "PS0")}
+
+
+def test_shared_part_id_outside_own_studios_is_left_to_a_scan():
+    rows = [source_row("JHD", "D2", "LIB"), source_row("JHD", "D3", "COTS")]
+    assert bom.build_part_index({"rows": rows}, [OWN_STUDIO]) == {}
+
+
+def test_index_hit_skips_the_scan():
+    client = PartsClient({"PS0": ["JHD"]})
+    target, changed = bom.locate_part(client, "JHD", {"JHD": location("D2", "LIB")}, [OWN_STUDIO])
+    assert (target, changed, client.calls) == (location("D2", "LIB"), None, 0)
+
+
+def test_refresh_replaces_a_stale_entry():
+    client = PartsClient({"PS0": ["JHD"]})
+    target, changed = bom.locate_part(client, "JHD", {"JHD": location("D2", "LIB")}, [OWN_STUDIO], refresh=True)
+    assert target == location("D1", "PS0")
+    assert changed == {"JHD": location("D1", "PS0")}
+
+
+def test_refresh_drops_an_entry_found_nowhere():
+    client = PartsClient({"PS0": []})
+    target, changed = bom.locate_part(client, "JHD", {"JHD": location("D2", "LIB")}, [OWN_STUDIO], refresh=True)
+    assert (target, changed) == (None, {})
+
+
+def test_scan_out_of_budget_is_not_a_miss():
+    class BudgetlessClient:
+        def get(self, path, **kwargs):
+            raise RateBudgetExceeded("Onshape rate budget exhausted, try again shortly")
+
+    with pytest.raises(RateBudgetExceeded):
+        bom.locate_part(BudgetlessClient(), "JHD", {}, [OWN_STUDIO])
@@ -0,0 +1,75 @@
+"""Version-checked progress updates: PATCH /api/bom_items/<id>/progress."""
+import pytest
+
+from models import db, BomItem
+
+PARTS = [
+    {"partId": "JPLATE", "Part Name": "Plate", "Quantity": 2},
+    {"partId": "JHEX", "Part Name": "Hex Shaft", "Quantity": 1},
+]
+
+
+@pytest.fixture
+def plate(add_system):
+    system = add_system("Drive", PARTS)
+    return system.bom_entries()[0]
+
+
+def patch(client, auth, item_id, **body):
+    return client.patch(f"/api/bom_items/{item_id}/progress", json=body, headers=auth)
+
+
+def test_update_applies_and_bumps_the_version(client, auth, plate):
+    res = patch(client, auth, plate["itemId"], version=plate["version"], done_process1=1)
+    assert res.status_code == 200
+    part = res.get_json()["part"]
+    assert (part["done_process1"], part["version"]) == (1, plate["version"] + 1)
+
+    res = patch(client, auth, plate["itemId"], version=part["version"], done_process1=2, available_qty=1)
+    assert res.status_code == 200
+    part = res.get_json()["part"]
+    assert (part["done_process1"], part["available_qty"], part["version"]) == (2, 1, plate["version"] + 2)
+
+
+def test_stale_version_is_refused_with_the_current_part(client, auth, plate):
+    assert patch(client, auth, plate["itemId"], version=plate["version"], done_process1=1).status_code == 200
+
+    # A second client still holding the old version must not overwrite the first edit
+    res = patch(client, auth, plate["itemId"], version=plate["version"], done_process1=5)
+    assert res.status_code == 409
+    part = res.get_json()["part"]
+    assert (part["done_process1"], part["version"]) == (1, plate["version"] + 1)
+    assert db.session.get(BomItem, plate["itemId"]).done_process1 == 1
+
+
+def test_version_bumped_behind_the_request_is_refused(client, auth, plate):
+    # Another worker commits its own update between this client's read and its PATCH
+    BomItem.query.filter_by(id=plate["itemId"]).update(
+        {BomItem.done_preprocess: 2, BomItem.version: BomItem.version + 1}, synchronize_session=False)
+    db.session.commit()
+
+    res = patch(client, auth, plate["itemId"], version=plate["version"], done_preprocess=1)
+    assert res.status_code == 409
+    part = res.get_json()["part"]
+    assert (part["done_preprocess"], part["version"]) == (2, plate["version"] + 1)
+
+
+def test_row_deleted_by_a_bom_refresh_is_not_found(client, auth, plate):
+    system = db.session.get(BomItem, plate["itemId"]).system
+    system.replace_bom([])  # a refresh after the parts left the assembly deletes their rows
+    db.session.commit()
+
+    res = patch(client, auth, plate["itemId"], version=plate["version"], done_process1=1)
+    assert res.status_code == 404
+    assert res.get_json() == {"error": "BOM item not found"}
+
+
+@pytest.mark.parametrize("body, error", [
+    ({"done_process1": 1}, "version is required"),
+    ({"version": 0, "done_process1": -1}, "done_process1 must be a non-negative integer"),
+    ({"version": 0}, "No progress fields to update"),
+])
+def test_bad_bodies_are_rejected(client, auth, plate, body, error):
+    res = patch(client, auth, plate["itemId"], **body)
+    assert res.status_code == 400
+    assert res.get_json() == {"error": error}
@@ -0,0 +1,71 @@
+"""Robot-wide "Main" BOM: RobotBomItem rows summed over the robot's systems."""
+from models import db, RobotBomItem
+
+
+def plate(qty, **progress):
+    return {"partId": "JPLATE", "Part Name": "Plate", "Quantity": qty, **progress}
+
+
+def hex_shaft(qty, **progress):
+    return {"partId": "JHEX", "Part Name": "Hex Shaft", "Quantity": qty, **progress}
+
+
+def rollup(robot):
+    rows = RobotBomItem.query.filter_by(robot_id=robot.id).order_by(RobotBomItem.system_id, RobotBomItem.position)
+    return {row.part_id: (row.quantity, row.done_process1) for row in rows}
+
+
+def test_parts_are_summed_across_systems(robot, add_system):
+    add_system("Drive", [plate(2, done_process1=1), hex_shaft(1)])
+    add_system("Intake", [plate(3, done_process1=2)])
+    assert rollup(robot) == {"JPLATE": (5, 3), "JHEX": (1, None)}
+
+
+def test_main_placeholder_is_left_out(robot, add_system):
+    add_system("Drive", [plate(2)])
+    add_system("Main", [plate(10), hex_shaft(4)])
+    assert rollup(robot) == {"JPLATE": (2, None)}
+
+
+def test_main_bom_is_served_from_the_rollup(client, auth, robot, add_system):
+    add_system("Drive", [plate(2), hex_shaft(1)])
+    add_system("Intake", [plate(3)])
+    res = client.get("/api/get_bom", query_string={"team_number": "1234", "robot": "Bot", "system": "Main"},
+                     headers=auth)
+    assert res.status_code == 200
+    assert [(p["partId"], p["Quantity"]) for p in res.get_json()["bom_data"]] == [("JPLATE", 5), ("JHEX", 1)]
+
+
+def test_rename_rebuilds_the_rollup(client, auth, robot, add_system):
+    add_system("Drive", [plate(2)])
+    add_system("Intake", [plate(3), hex_shaft(1)])
+
+    def rename(old, new):
+        res = client.post("/api/update_system_settings", headers=auth, json={
+            "team_number": "1234", "robot_name": "Bot", "old_system_name": old, "new_system_name": new})
+        assert res.status_code == 200
+
+    rename("Intake", "Main")  # now the placeholder, so no longer counted
+    assert rollup(robot) == {"JPLATE": (2, None)}
+    rename("Main", "Intake")
+    assert rollup(robot) == {"JPLATE": (5, None), "JHEX": (1, None)}
+
+
+def test_progress_patch_updates_the_rollup(client, auth, robot, add_system):
+    drive = add_system("Drive", [plate(2, done_process1=1)])
+    add_system("Intake", [plate(3, done_process1=2)])
+    item = drive.bom_entries()[0]
+
+    res = client.patch(f"/api/bom_items/{item['itemId']}/progress", headers=auth,
+                       json={"version": item["version"], "done_process1": 2})
+    assert res.status_code == 200
+    assert rollup(robot) == {"JPLATE": (5, 4)}
+
+
+def test_replace_bom_updates_the_rollup(robot, add_system):
+    drive = add_system("Drive", [plate(2), hex_shaft(1)])
+    add_system("Intake", [plate(3)])
+
+    drive.replace_bom([plate(4)])  # the hex shaft left the drive, the plate count changed
+    db.session.commit()
+    assert rollup(robot) == {"JPLATE": (7, None)}
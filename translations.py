@@ -0,0 +1,188 @@
+import threading
+import time
+
+import requests
+
+from onshape import RateBudgetExceeded, RETRY_STATUSES
+
+# Adaptive polling: start quickly, back off while a translation stays pending
+POLL_INITIAL = 0.5
+POLL_GROWTH = 1.5
+POLL_MAX = 5.0
+DEFAULT_DEADLINE = 120.0
+
+
+class TranslationError(Exception):
+    def __init__(self, message, status=500, details=None, upstream_status=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.details = details
+        self.upstream_status = upstream_status  # Onshape's status code, when it refused a call
+
+
+class TranslationFailed(TranslationError):
+    pass
+
+
+class TranslationTimeout(TranslationError):
+    def __init__(self, message="Translation timed out"):
+        super().__init__(message, 504)
+
+
+class PendingTranslation:
+    """One translation being watched by the tracker; callers block on `wait()`."""
+
+    def __init__(self, api, translation_id, poll_path, deadline):
+        self.api = api
+        self.translation_id = translation_id
+        self.poll_path = poll_path
+        self.deadline = deadline
+        self.interval = POLL_INITIAL
+        self.next_poll = time.monotonic() + POLL_INITIAL
+        self.polls = 0
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+        self._callbacks = []
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def add_done_callback(self, callback):
+        """Call `callback(pending)` from the poller thread once the translation settles."""
+        self._callbacks.append(callback)
+        if self.done:
+            callback(self)
+
+    def wait(self):
+        """Block until the translation is DONE and return its status JSON, or raise TranslationError.
+
+        The poller settles the translation at its deadline; waiting is bounded by the
+        deadline too, so a stalled poller cannot leave the caller blocked forever.
+        """
+        while not self._done.wait(timeout=max(0.0, self.deadline - time.monotonic())):
+            if time.monotonic() >= self.deadline:
+                raise TranslationTimeout()
+        if self.error:
+            raise self.error
+        return self.result
+
+    def _finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self._done.set()
+        for callback in list(self._callbacks):
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"⚠️ Translation callback failed: {e}")
+
+
+class TranslationTracker:
+    """Owns every pending Onshape translation in this process and polls them from one thread.
+
+    Each translation is polled on its own schedule, starting at `POLL_INITIAL`
+    seconds and growing by `POLL_GROWTH` up to `POLL_MAX`, until it is DONE or
+    FAILED or its deadline passes. Waiters sleep on an event instead of polling,
+    so any number of concurrent translations cost a single poll stream.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def track(self, api, translation_id, poll_path=None, deadline=DEFAULT_DEADLINE):
+        """Start watching `translation_id` and return its `PendingTranslation`.
+
+        Tracking an id that is already pending returns the existing entry, keeping
+        the later of the two deadlines.
+        """
+        poll_path = poll_path or f"/api/translations/{translation_id}"
+        expires = time.monotonic() + deadline
+        with self._cond:
+            pending = self._pending.get(translation_id)
+            if pending:
+                pending.deadline = max(pending.deadline, expires)
+                return pending
+            pending = PendingTranslation(api, translation_id, poll_path, expires)
+            self._pending[translation_id] = pending
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="translation-poller", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return pending
+
+    def wait(self, api, translation_id, poll_path=None, deadline=DEFAULT_DEADLINE):
+        return self.track(api, translation_id, poll_path, deadline).wait()
+
+    def stats(self):
+        with self._cond:
+            return {"pending": len(self._pending),
+                    "ids": {tid: p.polls for tid, p in self._pending.items()}}
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                now = time.monotonic()
+                due = [p for p in self._pending.values() if p.next_poll <= now or p.deadline <= now]
+                if not due:
+                    wake = min(min(p.next_poll, p.deadline) for p in self._pending.values())
+                    self._cond.wait(timeout=max(0.0, wake - now))
+                    continue
+            for pending in due:
+                self._poll(pending)
+
+    def _poll(self, pending):
+        if time.monotonic() >= pending.deadline:
+            self._settle(pending, error=TranslationTimeout())
+            return
+        try:
+            self._check(pending)
+        except Exception as e:
+            print(f"❌ Polling translation {pending.translation_id} failed: {e}")
+            self._settle(pending, error=TranslationError(f"Polling failed: {e}"))
+
+    def _check(self, pending):
+        # One attempt and no waiting for rate tokens: the poller thread serves every
+        # translation, so anything transient is retried on the next scheduled poll.
+        try:
+            res = pending.api.get(pending.poll_path, headers={"Accept": "application/json"}, retries=0, max_wait=0)
+        except (requests.RequestException, RateBudgetExceeded) as e:
+            print(f"⚠️ Polling translation {pending.translation_id} failed, will retry: {e}")
+            self._reschedule(pending)
+            return
+        pending.polls += 1
+        if res.status_code == 429 or res.status_code in RETRY_STATUSES:
+            print(f"⚠️ Polling translation {pending.translation_id} got {res.status_code}, will retry")
+            res.close()
+            self._reschedule(pending)
+            return
+        if res.status_code != 200:
+            self._settle(pending, error=TranslationError("Polling failed", res.status_code, res.text))
+            return
+        result = res.json()
+        state = result.get("requestState")
+        print(f"⏳ Translation {pending.translation_id} poll {pending.polls}: {state}")
+        if state == "DONE":
+            self._settle(pending, result=result)
+        elif state == "FAILED":
+            self._settle(pending, error=TranslationFailed("Translation failed", details=result.get("failureReason")))
+        else:
+            self._reschedule(pending)
+
+    def _reschedule(self, pending):
+        pending.next_poll = time.monotonic() + pending.interval
+        pending.interval = min(POLL_MAX, pending.interval * POLL_GROWTH)
+
+    def _settle(self, pending, result=None, error=None):
+        with self._cond:
+            self._pending.pop(pending.translation_id, None)
+        pending._finish(result, error)
+
+
+tracker = TranslationTracker()